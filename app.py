@@ -1,9 +1,63 @@
+import time
+
+# 画面の実行1回分の所要時間の計測開始（プロセスで最初の実行ではモジュールの読み込みも含む）
+_RUN_STARTED = time.perf_counter()
+
+import math
+import os
+import re
+import uuid
 import streamlit as st
 from config import Config
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from components.file_uploader import FileUploader
-from components.pdf_processor import PDFProcessor
-from components.gemini_analyzer import GeminiAnalyzer
+from components.job_manager import get_job_manager, JOB_DONE, JOB_FAILED
 from utils.error_handler import ErrorHandler
+from utils.event_sink import StreamlitSink
+from utils.metrics import get_metrics
+from utils.rate_limiter import get_rate_limiter
+from utils.result_store import get_result_store
+
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'style.css')
+
+@st.cache_resource(show_spinner=False)
+def load_stylesheet():
+    """
+    style.cssをコメント・余分な空白を除いた<style>要素にして返す（ファイルの読み込みはプロセスで1回だけ）
+    """
+    with open(STYLESHEET_PATH, encoding='utf-8') as f:
+        css = f.read()
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.DOTALL)
+    css = re.sub(r'\s+', ' ', css).strip()
+    return f"<style>{css}</style>"
+
+@st.cache_resource(show_spinner=False)
+def app_process_state():
+    """
+    プロセス内の全セッションで共有する状態（プロセスで最初の実行かどうかの判定に使う）
+    """
+    return {'runs': 0}
+
+@st.cache_resource(show_spinner=False)
+def start_job_manager():
+    """
+    ジョブのワーカーをプロセスで最初の実行時に起動する
+    （前回のサーバー停止で中断された待機中・実行中のジョブは、画面を開いた時点で再開する）
+    """
+    return get_job_manager()
+
+if Config.JOB_ENGINE_ENABLED:
+    start_job_manager()
+
+def record_run_time():
+    """
+    この実行の所要時間を記録（プロセスで最初の実行は'app_cold_start'、以降は'app_rerun'）
+    """
+    seconds = time.perf_counter() - _RUN_STARTED
+    state = app_process_state()
+    stage = 'app_cold_start' if state['runs'] == 0 else 'app_rerun'
+    state['runs'] += 1
+    get_metrics().record(stage, seconds)
 
 def main():
     st.set_page_config(
@@ -13,62 +67,8 @@ def main():
         initial_sidebar_state="collapsed"
     )
 
-    # シンプルなカスタムスタイル
-    st.markdown("""
-    <style>
-    /* メインタイトルのスタイリング */
-    h1 {
-        color: #2E4057;
-        padding-bottom: 10px;
-        border-bottom: 2px solid #FF6B6B;
-    }
-
-    /* ボタンのカスタマイズ */
-    .stButton > button {
-        background-color: #FF6B6B;
-        color: white;
-        border-radius: 20px;
-        border: none;
-        padding: 0.5rem 1rem;
-        font-weight: bold;
-        transition: all 0.3s;
-    }
-
-    .stButton > button:hover {
-        background-color: #FF5252;
-        transform: translateY(-2px);
-        box-shadow: 0 5px 10px rgba(0,0,0,0.2);
-    }
-
-    /* ファイルアップローダーのスタイル */
-    .stFileUploader {
-        border: 2px dashed #FF6B6B;
-        border-radius: 10px;
-        padding: 20px;
-    }
-
-    /* プログレスバー */
-    .stProgress > div > div {
-        background-color: #FF6B6B;
-    }
-
-    /* エクスパンダーのヘッダー */
-    .streamlit-expanderHeader {
-        background-color: #f8f9fa;
-        border-radius: 10px;
-        border: 1px solid #dee2e6;
-    }
-
-    /* メトリクスカード風 */
-    div[data-testid="metric-container"] {
-        background-color: #f8f9fa;
-        border: 1px solid #e9ecef;
-        padding: 10px;
-        border-radius: 10px;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    # カスタムスタイル（style.cssの読み込みはプロセスで1回だけ）
+    st.markdown(load_stylesheet(), unsafe_allow_html=True)
 
     # ヘッダー部分
     col1, col2, col3 = st.columns([1, 2, 1])
@@ -82,10 +82,16 @@ def main():
     st.markdown("---")
 
     # セッションステートの初期化
-    if 'analysis_results' not in st.session_state:
-        st.session_state.analysis_results = None
+    if 'analysis_run_id' not in st.session_state:
+        # 結果そのものはセッションに持たず、結果の保存先での解析ID（ジョブID）だけを持つ
+        st.session_state.analysis_run_id = None
     if 'file_count' not in st.session_state:
         st.session_state.file_count = 0
+    if 'analysis_notes' not in st.session_state:
+        st.session_state.analysis_notes = []
+    if 'job_id' not in st.session_state:
+        # ブラウザを再読み込みしても実行中のジョブを追えるよう、URLのジョブIDを引き継ぐ
+        st.session_state.job_id = st.query_params.get('job')
 
     # メインコンテンツ
     with st.container():
@@ -96,6 +102,8 @@ def main():
         uploaded_files = file_uploader.create_upload_widget()
 
         if uploaded_files:
+            # ディスクへ1回だけ保存し、以降はサイズ等の情報も保存済みのファイルから取得する
+            uploaded_files = file_uploader.spool_files(uploaded_files)
             st.session_state.file_count = len(uploaded_files)
 
             # ファイル情報を表示（メトリクス形式）
@@ -103,19 +111,16 @@ def main():
             with col1:
                 st.metric(label="📎 アップロードファイル数", value=f"{len(uploaded_files)} 件")
             with col2:
-                total_size = sum(len(file.read()) for file in uploaded_files) / (1024 * 1024)
-                for file in uploaded_files:
-                    file.seek(0)  # ファイルポインタをリセット
+                total_size = sum(file.size for file in uploaded_files) / (1024 * 1024)
                 st.metric(label="💾 合計サイズ", value=f"{total_size:.2f} MB")
             with col3:
-                file_types = set(file.name.split('.')[-1].upper() for file in uploaded_files)
+                file_types = set(file.extension.upper() for file in uploaded_files)
                 st.metric(label="📋 ファイル形式", value=", ".join(file_types))
 
             # ファイルリスト
             with st.expander("📂 アップロードされたファイル詳細", expanded=False):
                 for i, file in enumerate(uploaded_files, 1):
-                    file_size = len(file.read()) / 1024 / 1024
-                    file.seek(0)
+                    file_size = file.size / 1024 / 1024
                     st.write(f"{i}. **{file.name}** ({file_size:.2f} MB)")
 
             st.markdown("---")
@@ -124,16 +129,29 @@ def main():
             col1, col2, col3 = st.columns([2, 1, 2])
             with col2:
                 if st.button("🚀 解析開始", type="primary", use_container_width=True):
-                    if file_uploader.validate_files(uploaded_files):
-                        with st.spinner('🔄 処理中... しばらくお待ちください'):
-                            st.session_state.analysis_results = process_files(uploaded_files)
+                    if st.session_state.job_id:
+                        st.info("解析を実行中です。完了までお待ちください。")
+                    elif file_uploader.validate_files(uploaded_files):
+                        if Config.JOB_ENGINE_ENABLED:
+                            submit_job(uploaded_files)
+                        else:
+                            with st.spinner('🔄 処理中... しばらくお待ちください'):
+                                results = process_files(uploaded_files)
+                            if results:
+                                run_id = uuid.uuid4().hex
+                                get_result_store().save(run_id, results)
+                                show_run(run_id)
         else:
             # ファイルがアップロードされていない時の案内
             st.info("👆 上のエリアにPDFまたは画像ファイルをドラッグ&ドロップ、またはクリックして選択してください")
 
+    # 実行中ジョブの状態表示
+    if st.session_state.job_id:
+        show_job_status()
+
     # 結果表示セクション
-    if st.session_state.analysis_results:
-        display_results(st.session_state.analysis_results)
+    if st.session_state.analysis_run_id:
+        display_results(st.session_state.analysis_run_id)
 
     # フッター
     st.markdown("---")
@@ -144,82 +162,219 @@ def main():
 
 def process_files(uploaded_files):
     """
-    ファイルを処理して解析結果を返す
+    ファイルを処理して解析結果を返す（バックグラウンドジョブを使わない場合）
     """
-    error_handler = ErrorHandler()
-
-    if not error_handler.validate_api_key():
-        return None
+    # 解析処理のモジュールは画面の表示には不要なため、使うときに読み込む
+    from components.analysis_runner import AnalysisRunner
 
     # プログレスバーの表示
     progress_text = st.empty()
     progress_bar = st.progress(0)
 
-    progress_text.text("📝 ファイルを準備中...")
-    progress_bar.progress(0.2)
+    def on_stage(message, fraction):
+        progress_text.text(message)
+        progress_bar.progress(fraction)
 
-    pdf_processor = PDFProcessor()
-    files_data = pdf_processor.process_multiple_files(uploaded_files)
+    ctx = get_script_run_ctx()
+    results = AnalysisRunner(
+        StreamlitSink(), session_id=ctx.session_id if ctx else None
+    ).run(uploaded_files, on_stage=on_stage)
 
-    if not files_data:
-        st.error("❌ 処理可能なファイルがありません。")
-        progress_text.empty()
-        progress_bar.empty()
-        return None
+    # プログレス表示をクリア
+    if results:
+        time.sleep(1)
+    progress_text.empty()
+    progress_bar.empty()
 
-    progress_text.text("🔄 データを処理中...")
-    progress_bar.progress(0.5)
+    if results:
+        st.success("✨ 解析が正常に完了しました！")
 
-    all_batches = pdf_processor.prepare_batches(files_data)
+    return results
 
-    progress_text.text("🤖 AIで解析中...")
-    progress_bar.progress(0.7)
+def submit_job(uploaded_files):
+    """
+    解析をバックグラウンドジョブとして登録する
+    """
+    if not ErrorHandler().validate_api_key():
+        return
 
-    gemini_analyzer = GeminiAnalyzer()
-    results = gemini_analyzer.analyze_all_batches(all_batches)
+    ctx = get_script_run_ctx()
+    job_id = get_job_manager().submit(uploaded_files, session_id=ctx.session_id if ctx else None)
 
-    progress_text.text("✅ 処理完了！")
-    progress_bar.progress(1.0)
+    st.session_state.job_id = job_id
+    show_run(None)
+    st.session_state.analysis_notes = []
+    st.query_params['job'] = job_id
 
-    # プログレス表示をクリア
-    import time
-    time.sleep(1)
-    progress_text.empty()
-    progress_bar.empty()
+def show_run(run_id):
+    """
+    表示する解析結果を切り替え、一覧の検索条件・ページ・選択を初期化する
+    """
+    st.session_state.analysis_run_id = run_id
+    for key in ('result_query', 'result_search_content', 'result_page', 'result_selected'):
+        st.session_state.pop(key, None)
 
-    st.success("✨ 解析が正常に完了しました！")
+def clear_job():
+    """
+    表示中のジョブを画面から外す
+    """
+    st.session_state.job_id = None
+    if 'job' in st.query_params:
+        del st.query_params['job']
 
-    return results
+@st.fragment(run_every=Config.JOB_POLL_INTERVAL)
+def show_job_status():
+    """
+    ジョブの状態・進捗・途中結果を定期的に取得して表示
+    """
+    job_id = st.session_state.job_id
+    if not job_id:
+        return
+
+    job = get_job_manager().get(job_id)
+    if job is None:
+        clear_job()
+        st.rerun()
+        return
+
+    if job['status'] == JOB_DONE:
+        # 以前の形式（ジョブテーブルに結果を保存したジョブ）は結果の保存先へ移してから表示する
+        result_store = get_result_store()
+        if job['results'] and not result_store.exists(job_id):
+            result_store.save(job_id, job['results'])
+        show_run(job_id)
+        st.session_state.analysis_notes = [
+            message['message'] for message in job['messages'] if message['level'] == 'caption'
+        ]
+        clear_job()
+        st.rerun()
+        return
+
+    st.markdown("### ⏳ 解析ジョブ")
+    st.caption(f"ジョブID: {job_id}")
+
+    if job['status'] == JOB_FAILED:
+        st.error(f"❌ 解析に失敗しました: {job['error'] or ''}")
+        if st.button("閉じる", key="close_failed_job"):
+            clear_job()
+            st.rerun()
+    elif job['total']:
+        st.progress(job['completed'] / job['total'])
+        st.text(job['progress_message'] or "🤖 AIで解析中...")
+        show_rate_limit_status()
+    else:
+        st.progress(0)
+        st.text("📝 ファイルを準備中...")
+
+    problems = [message for message in job['messages'] if message['level'] in ('warning', 'error')]
+    for message in problems[-5:]:
+        if message['level'] == 'error':
+            st.error(message['message'])
+        else:
+            st.warning(message['message'])
+
+    for file_name, text in job['partial_results'].items():
+        with st.expander(f"📄 {file_name}（受信中）", expanded=True):
+            st.markdown(text)
+
+def show_rate_limit_status():
+    """
+    全セッション共通の送信待ちの状況を表示（他の解析と送信の順番を待っている場合）
+    """
+    rate_limiter = get_rate_limiter()
+    if rate_limiter is None:
+        return
+
+    stats = rate_limiter.stats()
+    if stats['queue_depth']:
+        st.caption(
+            f"⏱️ APIの送信待ち: {stats['queue_depth']} 件（{stats['sessions']} セッション,"
+            f" 最長 {stats['oldest_wait_seconds']:.0f}秒）"
+        )
 
-def display_results(results):
+def display_results(run_id):
     """
-    解析結果を表示
+    解析結果を表示（ファイルの一覧は検索・ページ送りで絞り込み、選択したファイルの結果だけを読み込む）
     """
     st.markdown("### 📊 解析結果")
 
+    result_store = get_result_store()
+    entries = result_store.index(run_id)
+    if entries is None:
+        st.warning("解析結果が見つかりません（保存期間を過ぎた可能性があります）")
+        show_new_analysis_button()
+        return
+
     # 結果のサマリー
-    st.info(f"📋 {len(results)} 件のファイルを解析しました")
-
-    # タブ形式で結果を表示
-    if len(results) > 1:
-        tabs = st.tabs([f"📄 {name}" for name in results.keys()])
-        for tab, (file_name, content) in zip(tabs, results.items()):
-            with tab:
-                st.markdown(content)
-    else:
+    st.info(f"📋 {len(entries)} 件のファイルを解析しました")
+    for note in st.session_state.analysis_notes:
+        st.caption(note)
+
+    if len(entries) == 1:
         # 1ファイルの場合はそのまま表示
-        file_name, content = list(results.items())[0]
+        file_name = entries[0]['file_name']
+    else:
+        file_name = select_result_file(result_store, run_id)
+
+    if file_name:
         with st.container():
             st.markdown(f"#### 📄 {file_name}")
-            st.markdown(content)
+            st.markdown(result_store.read(run_id, file_name) or "")
+
+    show_new_analysis_button()
+
+def select_result_file(result_store, run_id):
+    """
+    検索・ページ送りできるファイルの一覧を表示し、選択されたファイル名を返す
+    """
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("🔍 ファイル名で絞り込み", key="result_query")
+    with col2:
+        search_content = st.checkbox("結果の本文も検索", key="result_search_content")
 
-    # アクションボタン
+    page_size = Config.RESULTS_PAGE_SIZE
+    _, total = result_store.search(run_id, query, search_content, limit=0)
+    if not total:
+        st.caption("該当するファイルがありません")
+        return None
+
+    page_count = math.ceil(total / page_size)
+    page = min(st.session_state.get('result_page', 1), page_count)
+    if page_count > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("◀ 前へ", disabled=page <= 1, use_container_width=True):
+                page -= 1
+        with col3:
+            if st.button("次へ ▶", disabled=page >= page_count, use_container_width=True):
+                page += 1
+        with col2:
+            st.caption(f"{total} 件中 {(page - 1) * page_size + 1}〜{min(page * page_size, total)} 件目"
+                       f"（{page}/{page_count} ページ）")
+    st.session_state.result_page = page
+
+    entries, _ = result_store.search(run_id, query, search_content, (page - 1) * page_size, page_size)
+    names = [entry['file_name'] for entry in entries]
+    if st.session_state.get('result_selected') not in names:
+        st.session_state.result_selected = names[0]
+    return st.radio("ファイル", names, key="result_selected", format_func=lambda name: f"📄 {name}")
+
+def show_new_analysis_button():
+    """
+    アクションボタン（表示中の結果を閉じて新しい解析を始める）
+    """
     st.markdown("---")
     col1, col2, col3 = st.columns([2, 1, 2])
     with col2:
         if st.button("🔄 新規解析", use_container_width=True):
-            st.session_state.analysis_results = None
+            show_run(None)
+            st.session_state.analysis_notes = []
+            clear_job()
             st.rerun()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        record_run_time()
\ No newline at end of file
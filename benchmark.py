@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+ローカル処理のマイクロベンチマーク
+合成した図面風PDF（線画＋寸法文字）を使って、レンダリング・リサイズ・エンコード・バッチ分割の
+各段階の処理時間（ページ/秒）とピークメモリ（RSS）を計測し、JSONLに追記します
+Gemini APIは呼び出しません
+--target appでは、Streamlit画面の最初の実行（コールドスタート）と再実行1回あたりの所要時間を計測します
+
+使用例:
+    python benchmark.py --page-size A1 --pages 20 --lines 800
+    python benchmark.py --page-size A3 --pages 100 --dpi 150 --workers 8 --output bench_results.jsonl
+    python benchmark.py --target app --reruns 20
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import random
+from typing import Any, Callable, Dict, List
+
+from config import Config
+
+# 用紙サイズ（ポイント、縦向き）
+PAGE_SIZES = {
+    'A4': (595, 842),
+    'A3': (842, 1191),
+    'A2': (1191, 1684),
+    'A1': (1684, 2384),
+    'A0': (2384, 3370),
+}
+
+
+def generate_drawing_pdf(page_size: str, page_count: int, lines_per_page: int, seed: int = 0) -> bytes:
+    """
+    図面風の合成PDFを生成（横向きの用紙に枠・図面枠・ランダムな線分・寸法文字を描く）
+    """
+    height, width = PAGE_SIZES[page_size]
+    rng = random.Random(seed)
+
+    objects = []
+
+    def add_object(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add_object(b"")  # 後でページ一覧を書き込む
+    page_ids = []
+
+    for page_number in range(1, page_count + 1):
+        commands = ["0.5 w", f"20 20 {width - 40} {height - 40} re S"]
+        # 右下の図面枠（タイトルブロック）
+        commands.append(f"{width - 320} 20 300 120 re S")
+        commands.append(f"BT /F1 14 Tf {width - 310} 110 Td (DRAWING No. {page_number:03d}) Tj ET")
+        for _ in range(lines_per_page):
+            x1, y1 = rng.uniform(40, width - 40), rng.uniform(160, height - 40)
+            if rng.random() < 0.5:
+                x2, y2 = x1 + rng.uniform(-300, 300), y1
+            else:
+                x2, y2 = x1, y1 + rng.uniform(-300, 300)
+            commands.append(f"{x1:.1f} {y1:.1f} m {x2:.1f} {y2:.1f} l S")
+        for _ in range(max(1, lines_per_page // 20)):
+            x, y = rng.uniform(40, width - 120), rng.uniform(160, height - 40)
+            commands.append(f"BT /F1 8 Tf {x:.1f} {y:.1f} Td ({rng.randint(100, 9999)}) Tj ET")
+
+        stream = "\n".join(commands).encode('ascii')
+        content_id = add_object(
+            b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream"
+        )
+        page_ids.append(add_object(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>".encode('ascii')
+        ))
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode('ascii')
+    catalog_id = add_object(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode('ascii'))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for object_id, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(f"{object_id} 0 obj\n".encode('ascii') + body + b"\nendobj\n")
+    xref_offset = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('ascii'))
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode('ascii'))
+    output.write(
+        f"trailer\n<< /Size {len(objects) + 1} /Root {catalog_id} 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n".encode('ascii')
+    )
+    return output.getvalue()
+
+
+def current_rss_bytes() -> int:
+    """
+    現在のRSS（Linuxでは/proc、それ以外はプロセス開始以降のピーク値）
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOSはバイト、Linuxはキロバイト単位
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class StageTimer:
+    """
+    1段階の処理時間と、処理中のピークRSSを計測する
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+
+    def measure(self, func: Callable[[], Any]) -> Dict[str, Any]:
+        baseline = current_rss_bytes()
+        peak = [baseline]
+        stop = threading.Event()
+
+        def _sample() -> None:
+            while not stop.is_set():
+                peak[0] = max(peak[0], current_rss_bytes())
+                stop.wait(self.interval)
+
+        sampler = threading.Thread(target=_sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            value = func()
+        finally:
+            seconds = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+        peak[0] = max(peak[0], current_rss_bytes())
+
+        return {
+            'value': value,
+            'seconds': seconds,
+            'peak_rss_mb': peak[0] / 1024 / 1024,
+            'rss_growth_mb': (peak[0] - baseline) / 1024 / 1024,
+        }
+
+
+def git_revision() -> str:
+    """
+    計測したコミットのハッシュ（gitが使えない場合は'unknown'）
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    各段階を計測して結果を返す
+    """
+    # 設定をベンチマーク用に上書き（キャッシュは計測の邪魔になるため無効化）
+    Config.IMAGE_DPI = args.dpi
+    Config.MAX_PAGES_PER_BATCH = args.batch_size
+    Config.RENDER_WORKERS = args.workers
+    Config.RENDER_MODE = args.render_mode
+    Config.IMAGE_ENCODING = args.encoding
+    Config.IMAGE_LAYOUT_MODE = args.layout_mode
+    Config.RENDER_CACHE_ENABLED = False
+    Config.RESULT_CACHE_ENABLED = False
+    Config.INCREMENTAL_ENABLED = False
+    Config.METRICS_ENABLED = False
+
+    # Configの上書き後に読み込む（既定値を読み込み時に固定しているモジュールがあるため）
+    from components.pdf_processor import PDFProcessor
+    from utils.event_sink import EventSink, set_event_sink
+    from utils.image_converter import ImageConverter
+    from utils.parallel_renderer import ParallelRenderer
+    from utils.upload_store import StoredUpload
+
+    set_event_sink(EventSink())
+    timer = StageTimer()
+    stages: List[Dict[str, Any]] = []
+
+    def record(name: str, pages: int, func: Callable[[], Any]) -> Any:
+        result = timer.measure(func)
+        stages.append({
+            'stage': name,
+            'pages': pages,
+            'seconds': round(result['seconds'], 4),
+            'pages_per_sec': round(pages / result['seconds'], 2) if result['seconds'] else None,
+            'peak_rss_mb': round(result['peak_rss_mb'], 1),
+            'rss_growth_mb': round(result['rss_growth_mb'], 1),
+        })
+        return result['value']
+
+    pages = args.pages
+    pdf_bytes = record('generate_pdf', pages, lambda: generate_drawing_pdf(
+        args.page_size, pages, args.lines, seed=args.seed
+    ))
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+        f.write(pdf_bytes)
+        pdf_path = f.name
+
+    try:
+        processor = PDFProcessor(EventSink())
+        upload = StoredUpload('benchmark.pdf', pdf_path)
+
+        file_data = record('process_pdf', pages, lambda: processor.process_pdf(upload))
+        if file_data is None:
+            raise SystemExit("合成PDFを読み込めませんでした。Popplerがインストールされているか確認してください。")
+        all_batches = record('prepare_batches', pages, lambda: processor.prepare_batches({'benchmark.pdf': file_data}))
+
+        images = record('pdf_to_images', pages, lambda: ImageConverter.pdf_to_images(pdf_path, dpi=args.dpi))
+        record('parallel_render', pages, lambda: ParallelRenderer.render_pages(
+            pdf_path, list(range(1, pages + 1)), args.dpi, render_sizes=file_data['render_sizes']
+        ))
+    finally:
+        os.remove(pdf_path)
+
+    record('resize_image_if_needed', pages, lambda: [
+        ImageConverter.resize_image_if_needed(image) for image in images
+    ])
+    laid_out = record('layout_page', pages, lambda: [
+        part for image in images for part in ImageConverter.layout_page(image)[0]
+    ])
+    encoded = record('encode_for_upload', pages, lambda: [
+        ImageConverter.encode_for_upload(image) for image in laid_out
+    ])
+    record('batch_images', pages, lambda: ImageConverter.batch_images(images, args.batch_size))
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'params': {
+            'page_size': args.page_size,
+            'pages': pages,
+            'lines_per_page': args.lines,
+            'seed': args.seed,
+        },
+        'config': {
+            'dpi': args.dpi,
+            'batch_size': args.batch_size,
+            'workers': args.workers,
+            'render_mode': args.render_mode,
+            'encoding': args.encoding,
+            'layout_mode': args.layout_mode,
+        },
+        'summary': {
+            'pdf_bytes': len(pdf_bytes),
+            'batches': len(all_batches),
+            'rendered_pixels': sum(image.width * image.height for image in images),
+            'sent_images': len(laid_out),
+            'sent_pixels': sum(image.width * image.height for image in laid_out),
+            'encoded_bytes': sum(len(blob['data']) for blob in encoded),
+        },
+        'stages': stages,
+    }
+
+
+def run_app_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Streamlitのテスト用ランナーで画面を実行し、最初の実行と再実行の所要時間を計測する
+    （計測前に画面のモジュールを読み込まないこと。最初の実行にモジュールの読み込み時間を含めるため）
+    """
+    from streamlit.testing.v1 import AppTest
+
+    Config.METRICS_ENABLED = False
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    app = AppTest.from_file(app_path, default_timeout=120)
+    timer = StageTimer()
+    stages: List[Dict[str, Any]] = []
+
+    def record(name: str, runs: int, func: Callable[[], Any]) -> None:
+        result = timer.measure(func)
+        if app.exception:
+            raise SystemExit(f"画面の実行中にエラーが発生しました: {app.exception[0].value}")
+        stages.append({
+            'stage': name,
+            'runs': runs,
+            'seconds': round(result['seconds'], 4),
+            'ms_per_run': round(result['seconds'] / runs * 1000, 1),
+            'peak_rss_mb': round(result['peak_rss_mb'], 1),
+            'rss_growth_mb': round(result['rss_growth_mb'], 1),
+        })
+
+    record('app_cold_start', 1, app.run)
+
+    def _rerun() -> None:
+        for _ in range(args.reruns):
+            app.run()
+
+    record('app_rerun', args.reruns, _rerun)
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'target': 'app',
+        'params': {'reruns': args.reruns},
+        'stages': stages,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="合成PDFでローカル処理の各段階を計測します")
+    parser.add_argument('--page-size', choices=sorted(PAGE_SIZES), default='A3', help="用紙サイズ")
+    parser.add_argument('--pages', type=int, default=20, help="ページ数")
+    parser.add_argument('--lines', type=int, default=500, help="1ページあたりの線分の数（線の密度）")
+    parser.add_argument('--seed', type=int, default=0, help="乱数シード")
+    parser.add_argument('--dpi', type=int, default=Config.IMAGE_DPI, help="レンダリング解像度")
+    parser.add_argument('--batch-size', type=int, default=Config.MAX_PAGES_PER_BATCH, help="1バッチの最大ページ数")
+    parser.add_argument('--workers', type=int, default=Config.RENDER_WORKERS, help="レンダリングの並列数")
+    parser.add_argument('--render-mode', choices=['fit', 'dpi'], default=Config.RENDER_MODE, help="レンダリング方式")
+    parser.add_argument('--encoding', choices=['auto', 'png', 'jpeg', 'webp'], default='auto', help="画像のエンコード方式")
+    parser.add_argument('--layout-mode', choices=['fit', 'crop', 'tile'], default=Config.IMAGE_LAYOUT_MODE, help="画像のレイアウト処理")
+    parser.add_argument('--target', choices=['pipeline', 'app'], default='pipeline', help="計測対象（ローカル処理/画面の実行）")
+    parser.add_argument('--reruns', type=int, default=10, help="--target appで計測する再実行の回数")
+    parser.add_argument('--output', default='bench_results.jsonl', help="結果を追記するJSONLファイル")
+    args = parser.parse_args()
+
+    result = run_app_benchmark(args) if args.target == 'app' else run_benchmark(args)
+
+    with open(args.output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    if args.target == 'app':
+        print(f"{'stage':<24}{'runs':>6}{'ms/run':>10}{'peak MB':>10}{'+MB':>8}")
+        for stage in result['stages']:
+            print(
+                f"{stage['stage']:<24}{stage['runs']:>6}{stage['ms_per_run']:>10.1f}"
+                f"{stage['peak_rss_mb']:>10.1f}{stage['rss_growth_mb']:>8.1f}"
+            )
+        print(f"\n結果を {args.output} に追記しました（revision: {result['revision']}）")
+        return 0
+
+    print(f"{'stage':<24}{'sec':>10}{'pages/s':>10}{'peak MB':>10}{'+MB':>8}")
+    for stage in result['stages']:
+        print(
+            f"{stage['stage']:<24}{stage['seconds']:>10.3f}"
+            f"{stage['pages_per_sec'] or 0:>10.1f}{stage['peak_rss_mb']:>10.1f}{stage['rss_growth_mb']:>8.1f}"
+        )
+    print(f"\n結果を {args.output} に追記しました（revision: {result['revision']}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
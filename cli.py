@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+PDF解析のコマンドライン実行スクリプト
+ディレクトリまたはマニフェストに含まれるファイルを順に解析し、1ファイル1行のJSONLで結果を出力します
+出力済みのファイルは次回実行時にスキップするため、中断しても続きから再開できます
+
+使用例:
+    python cli.py drawings/ -o results.jsonl
+    python cli.py manifest.jsonl -o results.jsonl --render-workers 16 --api-concurrency 8
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+from config import Config
+from components.analysis_runner import AnalysisRunner
+from utils.event_sink import ConsoleSink, EventSink, JsonlSink, MultiSink, set_event_sink
+from utils.upload_store import StoredUpload, hash_file
+
+
+def collect_files(source: str, recursive: bool) -> List[str]:
+    """
+    ディレクトリ・マニフェスト（JSONLまたは1行1パスのテキスト）から解析対象のファイルパスを集める
+    """
+    extensions = tuple(f".{ext}" for ext in Config.SUPPORTED_FILE_TYPES)
+
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(extensions):
+                    paths.append(os.path.join(root, name))
+            if not recursive:
+                break
+        return paths
+
+    # マニフェストのパスはマニフェストの場所からの相対パスとして解釈する
+    base_dir = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                entry = json.loads(line)
+                path = entry.get('path') or entry.get('file')
+                if not path:
+                    continue
+            else:
+                path = line
+            paths.append(os.path.join(base_dir, path))
+    return paths
+
+
+def load_completed(output_path: str) -> Dict[str, str]:
+    """
+    出力済みのJSONLから、解析に成功したファイルの{パス: SHA-256}を読み込む
+    """
+    completed = {}
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に書きかけになった行は無視する
+                continue
+            if record.get('status') == 'ok':
+                completed[record['path']] = record['sha256']
+    return completed
+
+
+def build_event_sink(args: argparse.Namespace) -> EventSink:
+    """
+    オプションに応じて通知先を組み立てる
+    """
+    sinks = []
+    if not args.quiet:
+        sinks.append(ConsoleSink())
+    if args.events_file:
+        sinks.append(JsonlSink(args.events_file))
+    return MultiSink(sinks)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="PDF・画像ファイルを一括解析してJSONLに出力します")
+    parser.add_argument('source', help="解析対象のディレクトリ、またはマニフェスト（JSONLの'path'列、または1行1パス）")
+    parser.add_argument('-o', '--output', default='results.jsonl', help="結果の出力先（JSONL）")
+    parser.add_argument('-r', '--recursive', action='store_true', help="ディレクトリを再帰的に探索する")
+    parser.add_argument('--render-workers', type=int, default=Config.RENDER_WORKERS, help="PDFレンダリングの並列数")
+    parser.add_argument('--api-concurrency', type=int, default=Config.MAX_CONCURRENT_REQUESTS, help="Gemini APIへの同時リクエスト数")
+    parser.add_argument('--no-resume', action='store_true', help="出力済みのファイルもやり直す")
+    parser.add_argument('--events-file', help="処理イベントをJSONLで出力するファイル")
+    parser.add_argument('--metrics-dir', help="Prometheus形式の計測値（.prom）を書き出すディレクトリ")
+    parser.add_argument('--profile', action='store_true', help="各ファイルの解析をcProfile・tracemallocで計測する")
+    parser.add_argument('-q', '--quiet', action='store_true', help="標準エラー出力への進捗表示を行わない")
+    args = parser.parse_args()
+
+    Config.RENDER_WORKERS = max(1, args.render_workers)
+    Config.MAX_CONCURRENT_REQUESTS = max(1, args.api_concurrency)
+    # 途中結果の逐次表示は不要なため、ストリーミングは使わない
+    Config.STREAM_RESPONSES = False
+    if args.metrics_dir:
+        Config.METRICS_PROMETHEUS_DIR = args.metrics_dir
+
+    events = build_event_sink(args)
+    set_event_sink(events)
+
+    paths = collect_files(args.source, args.recursive)
+    completed = {} if args.no_resume else load_completed(args.output)
+
+    runner = AnalysisRunner(events, profile=args.profile)
+    failures = 0
+
+    for index, path in enumerate(paths, 1):
+        abs_path = os.path.abspath(path)
+        file_hash = hash_file(abs_path)
+
+        if completed.get(abs_path) == file_hash:
+            events.info(f"({index}/{len(paths)}) 解析済みのためスキップ: {path}")
+            continue
+
+        events.info(f"({index}/{len(paths)}) 解析開始: {path}")
+        start = time.perf_counter()
+        name = os.path.basename(abs_path)
+        record = {'path': abs_path, 'name': name, 'sha256': file_hash}
+        try:
+            # 入力ファイルはコピーせず、その場所のまま処理する
+            upload = StoredUpload(name, abs_path, file_hash=file_hash)
+            results = runner.run([upload], label=f"{index:05d}_{file_hash[:12]}")
+            if results and name in results:
+                record.update(status='ok', result=results[name])
+            else:
+                record.update(status='failed', error="解析結果がありません。")
+        except Exception as e:
+            record.update(status='failed', error=str(e))
+
+        record['elapsed_seconds'] = round(time.perf_counter() - start, 3)
+        record['finished_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+        if record['status'] != 'ok':
+            failures += 1
+
+        # 1ファイルごとに追記してフラッシュし、中断しても完了分は残るようにする
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    events.info(f"完了: {len(paths)} ファイル中 失敗 {failures} 件")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
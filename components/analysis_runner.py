@@ -0,0 +1,207 @@
+from typing import Any, Callable, Dict, List, Optional
+import contextlib
+import datetime
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.pdf_processor import PDFProcessor
+from components.gemini_analyzer import GeminiAnalyzer
+from utils.error_handler import ErrorHandler
+from utils.event_sink import EventSink
+from utils.metrics import MetricsRecorder, get_metrics, profile_run
+from utils.pipeline import iter_in_background
+from config import Config
+
+class AnalysisRunner:
+    """
+    アップロードファイルの読み込みからバッチ解析までを通しで実行する
+    Streamlitに依存しないため、画面・バックグラウンドジョブのどちらからも利用できる
+    """
+
+    def __init__(
+        self,
+        events: EventSink,
+        model=None,
+        profile: bool = Config.PROFILE_ENABLED,
+        context_client=None,
+        session_id: Optional[str] = None
+    ):
+        """
+        profileをTrueにすると、run 1回分をcProfile・tracemallocで計測してConfig.PROFILE_DIRへ保存する
+        model・context_clientはGeminiAnalyzerへそのまま渡す（テスト用のスタブ等）
+        session_idは送信の制限で順番を公平に回す単位（画面のセッション）
+        """
+        self.events = events
+        self.model = model
+        self.context_client = context_client
+        self.session_id = session_id
+        self.profile = profile
+        self.metrics = get_metrics()
+
+    def run(
+        self,
+        uploaded_files: List[Any],
+        on_stage: Optional[Callable[[str, float], None]] = None,
+        label: Optional[str] = None
+    ) -> Optional[Dict[str, str]]:
+        """
+        ファイルを処理して解析結果を{ファイル名: Markdown}で返す
+        on_stageには処理段階の説明と全体に対する進み具合（0〜1）が渡される
+        labelはプロファイルの保存名・計測スパンの属性に使う（ジョブID等）
+        """
+        label = label or datetime.datetime.now().strftime('run_%Y%m%d_%H%M%S_%f')
+        profiler = profile_run(label) if self.profile else contextlib.nullcontext()
+        before = self.metrics.snapshot()
+
+        try:
+            with profiler, self.metrics.span('analysis_run', run=label, files=len(uploaded_files)):
+                results = self._run(uploaded_files, on_stage)
+        finally:
+            self.metrics.write_prometheus()
+
+        if results is not None:
+            self.report_timings(MetricsRecorder.diff(self.metrics.snapshot(), before))
+        if self.profile:
+            self.events.caption(f"プロファイルを保存しました: {os.path.join(Config.PROFILE_DIR, label)}.prof / .txt")
+
+        return results
+
+    def _run(
+        self,
+        uploaded_files: List[Any],
+        on_stage: Optional[Callable[[str, float], None]]
+    ) -> Optional[Dict[str, str]]:
+        def _stage(message: str, fraction: float) -> None:
+            if on_stage:
+                on_stage(message, fraction)
+
+        error_handler = ErrorHandler(self.events)
+        if self.model is None and not error_handler.validate_api_key():
+            return None
+
+        _stage("📝 ファイルを準備中...", 0.2)
+
+        gemini_analyzer = GeminiAnalyzer(
+            model=self.model, events=self.events, context_client=self.context_client, session_id=self.session_id
+        )
+        pdf_processor = PDFProcessor(self.events, cache_settings=gemini_analyzer.cache_settings())
+
+        # ファイルの読み込み・バッチ分割 → 画像化・エンコード → API呼び出しを段階ごとに並行して進める
+        # 各段階の間は上限付きのキュー（先行処理数）で区切り、メモリ使用量を抑える
+        all_batches = iter_in_background(
+            pdf_processor.iter_batches(uploaded_files),
+            maxsize=Config.PIPELINE_QUEUE_SIZE,
+            initializer=self.events.attach_thread,
+            name="file-prepare"
+        )
+
+        _stage("🤖 AIで解析中...", 0.5)
+
+        try:
+            results = gemini_analyzer.analyze_all_batches(
+                all_batches, iter_batch_images=pdf_processor.iter_batch_images
+            )
+        finally:
+            # コンテキストキャッシュはジョブごとに作り、終了時に削除する
+            gemini_analyzer.close()
+
+        if not results:
+            self.events.error("❌ 処理可能なファイルがありません。")
+            return None
+
+        # 差分解析の比較元・ファイル全体の結果の再利用は、全バッチの解析結果を保存できたファイルだけを記録する
+        pdf_processor.record_completed_files(gemini_analyzer.failed_files)
+
+        # 送信しなかったページを結果に残し、どのページを元にした解析か後から確認できるようにする
+        for file_name, skipped_pages in pdf_processor.skipped_pages.items():
+            if file_name in results:
+                results[file_name] += (
+                    "\n\n---\n"
+                    f"※ 空白・重複のため解析から除外したページ: {pdf_processor.describe_skipped_pages(skipped_pages)}"
+                )
+
+        _stage("✅ 処理完了！", 1.0)
+
+        self.report_stats(pdf_processor, gemini_analyzer)
+
+        return results
+
+    def report_timings(self, stages: Dict[str, Dict[str, float]]) -> None:
+        """
+        処理段階ごとの所要時間を通知（並列実行される段階は各スレッドの合計時間）
+        """
+        labels = {
+            'upload_read': "読込",
+            'pdf_to_images': "画像化",
+            'resize_encode': "リサイズ・エンコード",
+            'rate_limit_wait': "送信待ち",
+            'generate_content': "API",
+            'retry_attempt': "試行",
+        }
+        parts = [
+            f"{name} {stages[stage]['seconds']:.1f}秒/{stages[stage]['count']:.0f}回"
+            for stage, name in labels.items() if stage in stages
+        ]
+        if parts:
+            self.events.caption("処理時間: " + "、".join(parts))
+
+    def report_stats(self, pdf_processor: PDFProcessor, gemini_analyzer: GeminiAnalyzer) -> None:
+        """
+        送信量・キャッシュの統計を通知
+        """
+        upload_stats = gemini_analyzer.upload_stats
+        if upload_stats['raw_bytes']:
+            self.events.caption(
+                f"送信画像: 非圧縮 {upload_stats['raw_bytes'] / 1024 / 1024:.1f} MB → "
+                f"エンコード後 {upload_stats['encoded_bytes'] / 1024 / 1024:.1f} MB"
+            )
+
+        token_stats = gemini_analyzer.token_stats
+        if token_stats['total_tokens']:
+            cached = f"、うちキャッシュ参照 {token_stats['cached_tokens']:,}" if token_stats['cached_tokens'] else ""
+            self.events.caption(
+                f"トークン: 入力 {token_stats['prompt_tokens']:,}{cached} / 出力 {token_stats['candidates_tokens']:,}"
+                f"（合計 {token_stats['total_tokens']:,}）"
+            )
+
+        rate_limit_stats = gemini_analyzer.rate_limit_stats
+        if rate_limit_stats['waits']:
+            self.events.caption(
+                f"送信の制限: {rate_limit_stats['requests']} 回中 {rate_limit_stats['waits']} 回待機"
+                f"（合計 {rate_limit_stats['wait_seconds']:.1f}秒, 最長 {rate_limit_stats['max_wait_seconds']:.1f}秒）"
+            )
+
+        if gemini_analyzer.context_cache is not None:
+            context_stats = gemini_analyzer.context_cache.stats
+            if context_stats['uses']:
+                self.events.caption(
+                    f"コンテキストキャッシュ: {context_stats['created']} 件登録・{context_stats['uses']} 回参照"
+                    f"（再送しなかった入力 約 {context_stats['saved_tokens']:,} トークン）"
+                )
+            else:
+                self.events.caption(
+                    "コンテキストキャッシュ: 使用しませんでした"
+                    f"（共通の送信内容が {Config.CONTEXT_CACHE_MIN_TOKENS:,} トークン未満、または登録に失敗）"
+                )
+
+        if gemini_analyzer.result_cache is not None:
+            cache_stats = gemini_analyzer.result_cache.stats()
+            self.events.caption(
+                f"解析キャッシュ: ヒット {cache_stats['hits']} 件 / ミス {cache_stats['misses']} 件"
+                f"（保存済み {cache_stats['entries']} 件, {cache_stats['bytes'] / 1024:.1f} KB）"
+            )
+            if gemini_analyzer.reused_batches:
+                self.events.caption(
+                    f"差分解析: 前回の版から内容の変わっていない {gemini_analyzer.reused_batches} バッチの結果を再利用"
+                )
+
+        if pdf_processor.render_cache is not None:
+            render_stats = pdf_processor.render_cache.stats()
+            self.events.caption(
+                f"ページキャッシュ: ヒット {render_stats['hits']} / ミス {render_stats['misses']} ページ"
+                f"（変換 {render_stats['cold_seconds_per_page'] * 1000:.0f} ms/ページ,"
+                f" キャッシュ読込 {render_stats['warm_seconds_per_page'] * 1000:.0f} ms/ページ,"
+                f" {render_stats['bytes'] / 1024 / 1024:.1f} MB）"
+            )
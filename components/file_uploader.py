@@ -6,6 +6,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import Config
+from utils.upload_store import StoredUpload, get_upload_store
 
 class FileUploader:
     def __init__(self):
@@ -24,6 +25,32 @@ class FileUploader:
 
         return uploaded_files if uploaded_files else None
 
+    def spool_files(self, uploaded_files: List) -> List[StoredUpload]:
+        """
+        アップロードファイルをアップロード置き場へ保存（画面の再実行では保存し直さない）
+        """
+        spooled = st.session_state.setdefault('spooled_uploads', {})
+        upload_store = get_upload_store()
+
+        current_keys = [getattr(file, 'file_id', None) or f"{file.name}:{file.size}" for file in uploaded_files]
+        # 選択中のファイルは、他のファイルの保存で容量を超えても削除しない
+        keep = {spooled[key].path for key in current_keys if key in spooled}
+
+        stored_files = []
+        for file, key in zip(uploaded_files, current_keys):
+            if key not in spooled or not os.path.exists(spooled[key].path):
+                spooled[key] = upload_store.add(file, keep=keep)
+                keep.add(spooled[key].path)
+            stored_files.append(spooled[key])
+
+        # 選択を外したファイルの情報は破棄する
+        current_keys = set(current_keys)
+        for key in list(spooled):
+            if key not in current_keys:
+                del spooled[key]
+
+        return stored_files
+
     def display_uploaded_files_info(self, uploaded_files: List) -> None:
         """
         アップロードされたファイルの情報を表示
@@ -35,8 +62,7 @@ class FileUploader:
 
         with st.expander("アップロードされたファイル一覧"):
             for file in uploaded_files:
-                file_size = len(file.read()) / 1024 / 1024
-                file.seek(0)
+                file_size = file.size / 1024 / 1024
                 st.write(f"- {file.name} ({file_size:.2f} MB)")
 
     def validate_files(self, uploaded_files: List) -> bool:
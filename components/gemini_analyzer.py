@@ -1,106 +1,668 @@
-import google.generativeai as genai
-import streamlit as st
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple, Union
 from PIL import Image
-import time
+import io
+import json
+import logging
+import re
 import sys
 import os
+import threading
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.error_handler import ErrorHandler
+from utils.batch_planner import BatchPlanner, TOKENS_PER_IMAGE_TILE
+from utils.context_cache import ContextCache, GenaiContextClient
+from utils.error_handler import ErrorHandler, ERROR_PAYLOAD
+from utils.event_sink import EventSink, get_event_sink
 from utils.image_converter import ImageConverter
+from utils.result_cache import ResultCache, get_result_cache
+from utils.metrics import get_metrics, profile_worker
+from utils.model_client import get_generative_model
+from utils.rate_limiter import RateLimiter, get_rate_limiter
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+# 分割PDFのページ数を数える（PyPDF2で書き出したPDFはページのオブジェクトを圧縮しない）
+PDF_PAGE_PATTERN = re.compile(rb"/Type\s*/Page\b")
+
 class GeminiAnalyzer:
-    def __init__(self):
-        self.error_handler = ErrorHandler()
+    MODEL_NOT_INITIALIZED = "モデルが初期化されていません。API キーを確認してください。"
+    NO_RESULT = "解析結果を取得できませんでした。"
+    ANALYSIS_FAILED = "解析に失敗しました。"
+    RENDER_FAILED = "ページを画像化できなかったため解析できませんでした。"
+    SHARED_TEXT_DESCRIPTION = "（以下はこのファイルのテキストページです。図面の解析の参考にしてください）"
+    SHARED_TEXT_REFERENCE = "--- {}ページ（テキスト：共通の内容に記載） ---"
+    TILE_DESCRIPTION = (
+        "（次の{0}枚の画像は1ページの図面を{1}行×{2}列に分割した部分画像です。"
+        "左上から行ごとの順に並んでおり、隣り合う部分画像は一部が重なっています。1ページとして解析してください）"
+    )
+
+    def __init__(
+        self,
+        model=None,
+        events: Optional[EventSink] = None,
+        context_client=None,
+        session_id: Optional[str] = None,
+        rate_limiter: Optional[RateLimiter] = None
+    ):
+        """
+        modelを渡すとAPIの初期化を行わずそのモデル（テスト用のスタブ等）を使用する
+        eventsを渡すとメッセージ・進捗・途中結果をそこへ通知する（既定ではStreamlitへ表示）
+        context_clientはコンテキストキャッシュの作成・削除に使うクライアント
+        （Config.CONTEXT_CACHE_ENABLEDのとき。modelを渡した場合は、これも渡したときだけキャッシュを使う）
+        session_idは送信の制限で順番を公平に回す単位（画面のセッション等。省略時はこの解析だけの単位）
+        rate_limiterは送信の制限（省略時はプロセス共通の制限。modelを渡した場合は、これも渡したときだけ制限する）
+        """
+        self.events = events or get_event_sink()
+        self.error_handler = ErrorHandler(self.events)
         self.image_converter = ImageConverter()
-        self.model = None
-        self._initialize_model()
+        self.result_cache = get_result_cache() if Config.RESULT_CACHE_ENABLED else None
+        self.metrics = get_metrics()
+        self.upload_stats = {'raw_bytes': 0, 'encoded_bytes': 0}
+        self.token_stats = {'prompt_tokens': 0, 'candidates_tokens': 0, 'total_tokens': 0, 'cached_tokens': 0}
+        # 前回の版の解析結果を再利用したバッチ数
+        self.reused_batches = 0
+        # 1つ以上のバッチの解析に失敗したファイル（改訂履歴へ保存しない）
+        self.failed_files = set()
+        self._stats_lock = threading.Lock()
+        self.context_cache = None
+        if Config.CONTEXT_CACHE_ENABLED and (model is None or context_client is not None):
+            self.context_cache = ContextCache(context_client or GenaiContextClient(), events=self.events)
+        self.session_id = session_id or uuid.uuid4().hex
+        self.rate_limiter = rate_limiter if rate_limiter is not None or model is not None else get_rate_limiter()
+        # 送信の制限で待った回数・秒数
+        self.rate_limit_stats = {'requests': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        self.model = model
+        if self.model is None:
+            self._initialize_model()
 
     def _initialize_model(self):
         """
         Gemini APIの初期化
         """
         if not self.error_handler.validate_api_key():
-            st.error("APIキーが設定されていません。.envファイルを確認してください。")
+            self.events.error("APIキーが設定されていません。.envファイルを確認してください。")
             return
 
         try:
-            genai.configure(api_key=Config.GEMINI_API_KEY)
-            self.model = genai.GenerativeModel(Config.GEMINI_MODEL)
-            # 初期化成功のログは表示しない（UIをクリーンに保つため）
-            pass
+            # APIの設定・モデルの作成はプロセスで1回だけ行い、ジョブ間で共有する
+            self.model = get_generative_model(Config.GEMINI_MODEL)
         except Exception as e:
-            st.error(f"Gemini APIの初期化に失敗しました: {str(e)}")
-            st.error(f"APIキーの最初の10文字: {Config.GEMINI_API_KEY[:10] if Config.GEMINI_API_KEY else 'なし'}...")
+            self.events.error(f"Gemini APIの初期化に失敗しました: {str(e)}")
+            self.events.error(f"APIキーの最初の10文字: {Config.GEMINI_API_KEY[:10] if Config.GEMINI_API_KEY else 'なし'}...")
             self.error_handler.handle_error(e, "Gemini APIの初期化に失敗しました")
 
-    def analyze_images(self, images: List[Image.Image], prompt: str = Config.ANALYSIS_PROMPT) -> str:
+    def analyze_images(
+        self,
+        images: List[Union[Image.Image, str, Dict[str, Any]]],
+        prompt: str = Config.ANALYSIS_PROMPT,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        metric_labels: Optional[Dict[str, Any]] = None
+    ) -> str:
         """
         画像リストを解析して結果を返す
+        テキストページの文字列や{'mime_type', 'data'}形式のデータ（分割PDF等）もそのまま含めてよい
+        on_chunkを渡すとストリーミングで受信し、受信済みのテキスト全体を都度渡す
+        metric_labelsは計測スパンに付ける属性（ファイル名・バッチ番号等）
         """
+        result, _ = self._analyze_images(images, prompt, on_chunk, metric_labels)
+        return result
+
+    def _analyze_images(
+        self,
+        images: List[Union[Image.Image, str, Dict[str, Any]]],
+        prompt: str = Config.ANALYSIS_PROMPT,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        metric_labels: Optional[Dict[str, Any]] = None,
+        page_numbers: Optional[List[int]] = None,
+        context: Optional[List[Any]] = None
+    ) -> Tuple[str, bool]:
+        """
+        画像リストを解析して（結果, 全体の解析に成功したか）を返す
+        page_numbersはimagesと同じ並びのページ番号（分割再送時のメッセージに使う）
+        contextは各リクエストの先頭に付ける共通の内容（省略時はpromptのみ。コンテキストキャッシュの対象）
+        """
+        labels = metric_labels or {}
         if not self.model:
-            return "モデルが初期化されていません。API キーを確認してください。"
+            return self.MODEL_NOT_INITIALIZED, False
+        if not images:
+            # プロンプトだけを送信すると、モデルが内容の無い解析結果を作ってしまう
+            return self.ANALYSIS_FAILED, False
 
         try:
-            def _analyze():
-                # 画像数を確認（デバッグ時のみ表示）
-                # st.info(f"📄 {len(images)}ページの画像を解析中...")
+            # リサイズ・エンコードは再試行のたびに繰り返さないよう、送信前に1回だけ行う
+            contents = self.prepare_contents(images, labels)
+        except Exception as e:
+            self.events.error(
+                f"画像の変換エラー: {str(e)}（エラータイプ: {type(e).__name__}）",
+                detail=traceback.format_exc()
+            )
+            return self.ANALYSIS_FAILED, False
 
-                # 画像サイズを確認して必要に応じてリサイズ
-                processed_images = []
-                for i, img in enumerate(images):
-                    # 大きすぎる画像はリサイズ
-                    resized_img = self.image_converter.resize_image_if_needed(img)
-                    processed_images.append(resized_img)
+        if page_numbers is not None and len(page_numbers) != len(contents):
+            page_numbers = None
+        return self._send_contents(contents, context or [prompt], on_chunk, labels, page_numbers)
 
-                # Gemini APIへ送信
-                response = self.model.generate_content([prompt] + processed_images)
+    def prepare_contents(
+        self,
+        images: List[Union[Image.Image, str, Dict[str, Any]]],
+        metric_labels: Optional[Dict[str, Any]] = None
+    ) -> List[Any]:
+        """
+        画像を必要に応じてリサイズ・エンコードし、送信できる形式に変換する
+        部分画像に分割したページは、説明文と部分画像のリストを1ページ分の要素とする
+        """
+        # 変換済み（先行処理でエンコード済み等）の内容はそのまま返す
+        if all(isinstance(img, (str, dict, list)) for img in images):
+            return list(images)
+
+        processed_images = []
+        raw_bytes = 0
+        encoded_bytes = 0
+        tiles = 0
+        with self.metrics.span('resize_encode', **(metric_labels or {})) as span:
+            for img in images:
+                # テキストページとエンコード済みデータ（分割PDF・分割済みのページ等）はそのまま送信
+                if isinstance(img, (str, dict, list)):
+                    processed_images.append(img)
+                    continue
+                # 大きすぎる画像はリサイズ（レイアウト処理の設定により余白の切り取り・分割も行う）
+                parts, grid = self.image_converter.layout_page(img)
+                if Config.IMAGE_ENCODING != 'none':
+                    # 送信サイズを抑えるためにエンコード
+                    encoded_parts = []
+                    for part in parts:
+                        blob = self.image_converter.encode_for_upload(part)
+                        raw_bytes += part.width * part.height * len(part.getbands())
+                        encoded_bytes += len(blob['data'])
+                        encoded_parts.append(blob)
+                    parts = encoded_parts
+
+                if len(parts) == 1:
+                    processed_images.append(parts[0])
+                else:
+                    processed_images.append([self.TILE_DESCRIPTION.format(len(parts), *grid)] + parts)
+                    tiles += len(parts)
+            span.update(pages=len(images), tiles=tiles, raw_bytes=raw_bytes, encoded_bytes=encoded_bytes)
+
+        if raw_bytes:
+            self._record_upload_bytes(raw_bytes, encoded_bytes)
+        return processed_images
+
+    def prepare_batch_images(self, batch_data: Dict[str, Any], images: List[Any]) -> List[Any]:
+        """
+        バッチの画像を送信用に変換する（iter_batch_imagesの先行処理から呼ばれる）
+        """
+        return self.prepare_contents(
+            images,
+            {'file_name': batch_data['file_name'], 'batch_number': batch_data['batch_number']}
+        )
+
+    def _send_contents(
+        self,
+        contents: List[Any],
+        context: List[Any],
+        on_chunk: Optional[Callable[[str], None]],
+        labels: Dict[str, Any],
+        page_numbers: Optional[List[int]]
+    ) -> Tuple[str, bool]:
+        """
+        変換済みの内容を送信する（送信サイズ超過で失敗した場合は半分に分割して再送する）
+        """
+        try:
+            result = self.error_handler.retry_on_failure(
+                lambda: self._generate(context, contents, on_chunk, labels),
+                custom_error_msg="Gemini APIの呼び出しに失敗しました",
+                metric_labels=labels
+            )
+            return (result, True) if result else (self.NO_RESULT, False)
+
+        except Exception as e:
+            if (ErrorHandler.classify_error(e) == ERROR_PAYLOAD
+                    and Config.BISECT_ON_PAYLOAD_ERROR and len(contents) > 1):
+                return self._bisect_contents(contents, context, on_chunk, labels, page_numbers)
+
+            # 詳細なエラー情報を表示
+            if ErrorHandler.classify_error(e) == ERROR_PAYLOAD:
+                self.events.error(
+                    f"{self._describe_pages(page_numbers, len(contents))}は送信サイズの上限を超えるため解析できませんでした: {str(e)}"
+                )
+            else:
+                self.events.error(
+                    f"画像解析エラー: {str(e)}（エラータイプ: {type(e).__name__}）",
+                    detail=traceback.format_exc()
+                )
+            return self.ANALYSIS_FAILED, False
+
+    def _bisect_contents(
+        self,
+        contents: List[Any],
+        context: List[Any],
+        on_chunk: Optional[Callable[[str], None]],
+        labels: Dict[str, Any],
+        page_numbers: Optional[List[int]]
+    ) -> Tuple[str, bool]:
+        """
+        内容を前半・後半に分けて送信し、結果をつなげて返す（失敗したページを絞り込む）
+        """
+        middle = len(contents) // 2
+        halves = [(0, middle), (middle, len(contents))]
+        self.events.warning(
+            f"{self._describe_pages(page_numbers, len(contents))}が送信サイズの上限を超えたため、"
+            f"{middle}件・{len(contents) - middle}件に分割して再送信します"
+        )
+
+        texts = []
+        succeeded = True
+        for start, end in halves:
+            part_pages = page_numbers[start:end] if page_numbers else None
+            header = f"#### {self._describe_pages(part_pages, end - start)}\n\n" if part_pages else ""
+            done = "".join(texts)
+
+            part_on_chunk = None
+            if on_chunk is not None:
+                part_on_chunk = lambda text, done=done, header=header: on_chunk(done + header + text)
+
+            text, ok = self._send_contents(contents[start:end], context, part_on_chunk, labels, part_pages)
+            texts.append(header + text + "\n\n")
+            succeeded = succeeded and ok
+
+        return "".join(texts).rstrip(), succeeded
+
+    @staticmethod
+    def _describe_pages(page_numbers: Optional[List[int]], count: int) -> str:
+        """
+        メッセージ用のページ範囲の表記
+        """
+        if not page_numbers:
+            return f"送信内容（{count}件）"
+        if len(page_numbers) == 1:
+            return f"{page_numbers[0]}ページ"
+        return f"{page_numbers[0]}〜{page_numbers[-1]}ページ"
+
+    @staticmethod
+    def _flatten_contents(contents: List[Any]) -> List[Any]:
+        """
+        部分画像に分割したページ（リスト）を展開して、APIへ渡す内容の並びにする
+        """
+        flattened = []
+        for content in contents:
+            if isinstance(content, list):
+                flattened.extend(content)
+            else:
+                flattened.append(content)
+        return flattened
+
+    def _generate(
+        self,
+        context: List[Any],
+        contents: List[Any],
+        on_chunk: Optional[Callable[[str], None]],
+        labels: Dict[str, Any]
+    ) -> Optional[str]:
+        """
+        Gemini APIへ1回送信して応答のテキストを返す
+        共通の内容（context）がモデル側にキャッシュされていれば、キャッシュを参照して残りの内容だけを送信する
+        """
+        cached = self.context_cache.get(context) if self.context_cache else None
+        if cached is not None:
+            model, request = cached.model, self._flatten_contents(contents)
+        else:
+            model, request = self.model, self._flatten_contents(context + contents)
+
+        # キャッシュを参照した共通の内容も入力トークン数に数えられる
+        estimated_tokens = self.estimate_request_tokens(self._flatten_contents(context + contents))
+        self._wait_for_rate_limit(estimated_tokens, labels)
+
+        with self.metrics.span(
+            'generate_content', stream=on_chunk is not None, pages=len(contents),
+            context_cached=cached is not None, **labels
+        ) as span:
+            try:
+                if on_chunk is not None:
+                    return self._generate_streaming(model, request, on_chunk, span)
+
+                response = model.generate_content(request)
+                self._record_usage(response, span)
 
                 # レスポンスの確認
                 if response and hasattr(response, 'text'):
                     return response.text
                 else:
-                    st.error("APIレスポンスにテキストが含まれていません")
+                    span['error'] = 'EmptyResponse'
+                    self.events.error("APIレスポンスにテキストが含まれていません")
                     return None
+            finally:
+                if self.rate_limiter is not None and span.get('prompt_tokens'):
+                    self.rate_limiter.settle(estimated_tokens, span['prompt_tokens'])
 
-            result = self.error_handler.retry_on_failure(
-                _analyze,
-                custom_error_msg="Gemini APIの呼び出しに失敗しました"
-            )
-
-            return result if result else "解析結果を取得できませんでした。"
+    def _wait_for_rate_limit(self, estimated_tokens: int, labels: Dict[str, Any]) -> None:
+        """
+        送信の制限（全セッション共通の1分あたりのリクエスト数・トークン数）に余裕ができるまで待つ
+        """
+        if self.rate_limiter is None:
+            return
 
-        except Exception as e:
-            # 詳細なエラー情報を表示
-            st.error(f"画像解析エラー: {str(e)}")
-            st.error(f"エラータイプ: {type(e).__name__}")
-            st.text("スタックトレース:")
-            st.code(traceback.format_exc())
-            return "解析に失敗しました。"
+        grant = self.rate_limiter.acquire(self.session_id, estimated_tokens)
+        wait_seconds = grant['wait_seconds']
+        self.metrics.record(
+            'rate_limit_wait', wait_seconds,
+            queue_depth=grant['queue_depth'], estimated_tokens=estimated_tokens, **labels
+        )
+        with self._stats_lock:
+            self.rate_limit_stats['requests'] += 1
+            if grant['waited']:
+                self.rate_limit_stats['waits'] += 1
+            self.rate_limit_stats['wait_seconds'] += wait_seconds
+            self.rate_limit_stats['max_wait_seconds'] = max(self.rate_limit_stats['max_wait_seconds'], wait_seconds)
+
+    @staticmethod
+    def estimate_request_tokens(contents: List[Any]) -> int:
+        """
+        送信内容の入力トークン数の見積もり（テキストは文字数、画像はサイズ、分割PDFはページ数から計算）
+        """
+        tokens = 0
+        for content in contents:
+            if isinstance(content, str):
+                tokens += len(content)
+            elif isinstance(content, Image.Image):
+                tokens += BatchPlanner.estimate_image_tokens(*content.size)
+            elif isinstance(content, dict) and content.get('mime_type', '').startswith('image/'):
+                # 画像のサイズはヘッダーだけを読んで取得する
+                with Image.open(io.BytesIO(content['data'])) as image:
+                    tokens += BatchPlanner.estimate_image_tokens(*image.size)
+            elif isinstance(content, dict):
+                tokens += max(1, len(PDF_PAGE_PATTERN.findall(content['data']))) * TOKENS_PER_IMAGE_TILE
+        return tokens
+
+    def _generate_streaming(
+        self,
+        model: Any,
+        contents: List[Any],
+        on_chunk: Callable[[str], None],
+        span: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        ストリーミングで応答を受信し、チャンクごとにon_chunkへ受信済みテキストを渡す
+        """
+        response = model.generate_content(contents, stream=True)
+        start = time.perf_counter()
+
+        text = ""
+        for chunk in response:
+            try:
+                chunk_text = chunk.text
+            except ValueError:
+                # テキストを含まないチャンク（終了理由のみ等）は読み飛ばす
+                continue
+            if chunk_text:
+                if not text and span is not None:
+                    span['first_chunk_seconds'] = round(time.perf_counter() - start, 3)
+                text += chunk_text
+                on_chunk(text)
+
+        # 最後まで受信した後のresponseにはトークン数が集計されている
+        self._record_usage(response, span)
+
+        if not text:
+            if span is not None:
+                span['error'] = 'EmptyResponse'
+            self.events.error("APIレスポンスにテキストが含まれていません")
+            return None
+        return text
+
+    def _record_usage(self, response: Any, span: Optional[Dict[str, Any]] = None) -> None:
+        """
+        レスポンスのusage_metadataからトークン数を記録（取得できない場合は何もしない）
+        """
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is None:
+            return
 
-    def analyze_batch(self, batch_data: Dict[str, Any], progress_bar=None) -> str:
+        tokens = {
+            'prompt_tokens': getattr(usage, 'prompt_token_count', 0) or 0,
+            'candidates_tokens': getattr(usage, 'candidates_token_count', 0) or 0,
+            'total_tokens': getattr(usage, 'total_token_count', 0) or 0,
+            'cached_tokens': getattr(usage, 'cached_content_token_count', 0) or 0,
+        }
+        if span is not None:
+            span.update(tokens)
+        with self._stats_lock:
+            for key, value in tokens.items():
+                self.token_stats[key] += value
+
+    def _record_upload_bytes(self, raw_bytes: int, encoded_bytes: int) -> None:
+        """
+        エンコード前後の画像バイト数を記録
+        """
+        logger.info(
+            "画像エンコード: 非圧縮 %.1f MB -> 送信 %.1f MB (%.1f%%)",
+            raw_bytes / 1024 / 1024,
+            encoded_bytes / 1024 / 1024,
+            encoded_bytes / raw_bytes * 100
+        )
+        with self._stats_lock:
+            self.upload_stats['raw_bytes'] += raw_bytes
+            self.upload_stats['encoded_bytes'] += encoded_bytes
+
+    def analyze_batch(
+        self,
+        batch_data: Dict[str, Any],
+        progress_bar=None,
+        on_chunk: Optional[Callable[[str], None]] = None
+    ) -> str:
         """
         バッチデータを解析
         """
         file_name = batch_data['file_name']
         batch_number = batch_data['batch_number']
         total_batches = batch_data['total_batches']
-        images = batch_data['images']
 
-        if total_batches > 1:
-            st.info(f"処理中: {file_name} - バッチ {batch_number}/{total_batches}")
+        if batch_data.get('load_error') or self._is_missing_images(batch_data):
+            # 図面ページの画像が無いまま送信・キャッシュしない（エラーの内容は画像化の側で通知済み）
+            if not batch_data.get('load_error'):
+                self.events.error(f"{file_name} - バッチ {batch_number}/{total_batches}: {self.RENDER_FAILED}")
+            with self._stats_lock:
+                self.failed_files.add(file_name)
+            if progress_bar:
+                progress_bar.progress(batch_number / total_batches)
+            return self.RENDER_FAILED
+
+        context, shared_text = self.resolve_shared_context(batch_data)
+        images = self.build_batch_contents(batch_data, shared_text)
 
-        result = self.analyze_images(images)
+        if total_batches > 1:
+            self.events.info(f"処理中: {file_name} - バッチ {batch_number}/{total_batches}")
+
+        # 画像の数がページ数と一致する場合のみ、分割再送時にページ番号を表示できる
+        page_numbers = batch_data['pages'] if len(images) == len(batch_data['pages']) else None
+        result, succeeded = self._analyze_images(
+            images,
+            on_chunk=on_chunk,
+            metric_labels={'file_name': file_name, 'batch_number': batch_number},
+            page_numbers=page_numbers,
+            context=context
+        )
+
+        # 一部のページでも失敗した結果はキャッシュしない
+        if succeeded:
+            self._store_result(batch_data, result)
+        else:
+            with self._stats_lock:
+                self.failed_files.add(file_name)
 
         if progress_bar:
             progress_bar.progress(batch_number / total_batches)
 
         return result
 
+    @staticmethod
+    def _is_missing_images(batch_data: Dict[str, Any]) -> bool:
+        """
+        画像として送るページ（テキストページ以外）があるのに、画像が1枚も無いかどうか
+        """
+        page_texts = batch_data.get('page_texts') or {}
+        has_drawing_pages = any(page not in page_texts for page in batch_data.get('pages', []))
+        return has_drawing_pages and not batch_data.get('images')
+
+    def build_batch_contents(
+        self, batch_data: Dict[str, Any], shared_text: bool = False
+    ) -> List[Union[Image.Image, str]]:
+        """
+        テキストページと図面ページの画像をページ順に並べた送信内容を作る
+        shared_textがTrueなら、テキストページは共通の内容（キャッシュ）に含まれるため本文を送らず、ページの見出しだけを置く
+        """
+        page_texts = batch_data.get('page_texts')
+        if not page_texts:
+            return batch_data['images']
+
+        images = iter(batch_data['images'])
+        contents = []
+        for page in batch_data['pages']:
+            if page in page_texts and shared_text:
+                contents.append(self.SHARED_TEXT_REFERENCE.format(page))
+            elif page in page_texts:
+                contents.append(f"--- {page}ページ（テキスト） ---\n{page_texts[page]}")
+            else:
+                image = next(images, None)
+                if image is not None:
+                    contents.append(image)
+        return contents
+
+    def build_shared_context(self, batch_data: Dict[str, Any]) -> List[str]:
+        """
+        ファイルの全バッチで共通の送信内容（解析プロンプトと、ファイルのテキストページ）
+        """
+        context = [Config.ANALYSIS_PROMPT]
+        file_page_texts = batch_data.get('file_page_texts')
+        if file_page_texts:
+            context.append(self.SHARED_TEXT_DESCRIPTION)
+            context.extend(
+                f"--- {page}ページ（テキスト） ---\n{text}" for page, text in sorted(file_page_texts.items())
+            )
+        return context
+
+    def resolve_shared_context(self, batch_data: Dict[str, Any]) -> Tuple[List[str], bool]:
+        """
+        バッチの送信に使う共通の内容と、ファイルのテキストページを共通の内容に含めたかどうかを返す
+        テキストページはモデル側のキャッシュに登録できた場合だけ共通の内容にする
+        （キャッシュが無ければ全バッチに同じテキストを送ることになるため、各バッチのページとしてだけ送る）
+        """
+        if batch_data.get('file_page_texts') and self.context_cache is not None:
+            context = self.build_shared_context(batch_data)
+            if self.context_cache.get(context, count=False) is not None:
+                return context, True
+        return [Config.ANALYSIS_PROMPT], False
+
+    def close(self) -> None:
+        """
+        ジョブの終了時に、作成したコンテキストキャッシュを削除する
+        """
+        if self.context_cache is not None:
+            self.context_cache.close()
+
+    def cache_settings(self) -> Dict[str, Any]:
+        """
+        解析結果に影響する設定（キャッシュキーに含める）
+        """
+        return {
+            'prompt': Config.ANALYSIS_PROMPT,
+            'model': Config.GEMINI_MODEL,
+            'dpi': Config.IMAGE_DPI,
+            'analysis_mode': Config.ANALYSIS_MODE,
+            'render_mode': Config.RENDER_MODE,
+            'image_encoding': Config.IMAGE_ENCODING,
+            'image_auto_lossy_format': Config.IMAGE_AUTO_LOSSY_FORMAT,
+            'image_color_mode': Config.IMAGE_COLOR_MODE,
+            'jpeg_quality': Config.JPEG_QUALITY,
+            'webp_quality': Config.WEBP_QUALITY,
+            'image_color_threshold': Config.IMAGE_COLOR_THRESHOLD,
+            'image_line_art_ratio': Config.IMAGE_LINE_ART_RATIO,
+            'bilevel': {
+                'background_margin': Config.BILEVEL_BACKGROUND_MARGIN,
+                'min_ink_retained': Config.BILEVEL_MIN_INK_RETAINED,
+            },
+            'max_width': Config.MAX_IMAGE_WIDTH,
+            'max_height': Config.MAX_IMAGE_HEIGHT,
+            'image_layout_mode': Config.IMAGE_LAYOUT_MODE,
+            'layout': {
+                'render_scale': Config.LAYOUT_RENDER_SCALE,
+                'crop_padding_ratio': Config.CROP_PADDING_RATIO,
+                'crop_min_ink_ratio': Config.CROP_MIN_INK_RATIO,
+                'tile_pixel_budget': Config.TILE_PIXEL_BUDGET,
+                'tile_max_tiles': Config.TILE_MAX_TILES,
+                'tile_overlap': Config.TILE_OVERLAP,
+                'tile_min_ink_ratio': Config.TILE_MIN_INK_RATIO,
+            } if Config.IMAGE_LAYOUT_MODE != 'fit' else None,
+            'text_layer': Config.TEXT_LAYER_ENABLED,
+            'text_page_min_chars': Config.TEXT_PAGE_MIN_CHARS,
+            'text_page_max_graphics': Config.TEXT_PAGE_MAX_GRAPHICS,
+            'shared_file_text': Config.CONTEXT_CACHE_ENABLED and Config.CONTEXT_CACHE_FILE_TEXT,
+        }
+
+    def _result_cache_key(self, batch_data: Dict[str, Any]) -> Optional[str]:
+        """
+        バッチの解析結果キャッシュキー（キャッシュ無効時やハッシュが無い場合はNone）
+        """
+        if self.result_cache is None or 'file_hash' not in batch_data:
+            return None
+        return self.result_cache.make_key(
+            batch_data['file_hash'], batch_data['pages'], self.cache_settings()
+        )
+
+    def _page_cache_key(self, batch_data: Dict[str, Any]) -> Optional[str]:
+        """
+        ページの内容（指紋）によるキャッシュキー（改訂版のファイルでも内容が同じバッチなら一致する）
+        """
+        if self.result_cache is None or not batch_data.get('page_fingerprints'):
+            return None
+        fingerprint = 'pages:' + ':'.join(batch_data['page_fingerprints'])
+        # ファイル共通の内容を送る場合は、その内容が同じときだけ一致させる
+        if batch_data.get('file_page_texts'):
+            fingerprint += ':' + ResultCache.hash_bytes(
+                json.dumps(batch_data['file_page_texts'], sort_keys=True, ensure_ascii=False).encode('utf-8')
+            )
+        return self.result_cache.make_key(fingerprint, batch_data['pages'], self.cache_settings())
+
+    def _lookup_result(self, batch_data: Dict[str, Any]) -> Optional[str]:
+        """
+        キャッシュ済みの結果（同じファイル、または前回の版の同じ内容のバッチ）を返す
+        2つのキーで探しても、ヒット・ミスはバッチごとに1件として数える
+        """
+        if 'cached_result' in batch_data:
+            # ファイル全体の結果を読み込み時にキャッシュから取得済みのバッチ
+            self.result_cache.record_lookup(True)
+            return batch_data['cached_result']
+
+        cache_key = self._result_cache_key(batch_data)
+        cached = self.result_cache.get(cache_key, count=False) if cache_key else None
+        if cached is None:
+            page_key = self._page_cache_key(batch_data)
+            cached = self.result_cache.get(page_key, count=False) if page_key else None
+            if cached is not None:
+                with self._stats_lock:
+                    self.reused_batches += 1
+                # 次に同じファイルを解析するときはファイルのキーで見つかるようにする
+                if cache_key:
+                    self.result_cache.put(cache_key, cached)
+
+        if cache_key:
+            self.result_cache.record_lookup(cached is not None)
+        return cached
+
+    def _store_result(self, batch_data: Dict[str, Any], result: str) -> None:
+        """
+        解析結果をファイルのキーとページ内容のキーの両方でキャッシュする
+        """
+        for key in (self._result_cache_key(batch_data), self._page_cache_key(batch_data)):
+            if key:
+                self.result_cache.put(key, result)
+
     def combine_batch_results(self, results: List[str], file_name: str) -> str:
         """
         複数のバッチ結果を統合
@@ -118,37 +680,119 @@ class GeminiAnalyzer:
 
         return combined
 
-    def analyze_all_batches(self, all_batches: List[Dict[str, Any]]) -> Dict[str, str]:
+    def analyze_all_batches(
+        self,
+        all_batches: Iterable[Dict[str, Any]],
+        iter_batch_images: Optional[
+            Callable[..., Iterator[Tuple[Dict[str, Any], List[Any]]]]
+        ] = None
+    ) -> Dict[str, str]:
         """
         すべてのバッチを解析して結果を返す
+        all_batchesはジェネレータでもよく、先に届いたバッチの解析中に後続のファイル・バッチを準備できる
+        iter_batch_imagesを渡すと、各バッチの画像は解析直前に先行して生成・エンコードされ、解析後に破棄される
+        バッチは最大Config.MAX_CONCURRENT_REQUESTS件まで並行してAPIへ送信する
         """
-        results_by_file = {}
-        total_batches = len(all_batches)
-
-        progress_bar = st.progress(0)
-        progress_text = st.empty()
-
-        for idx, batch_data in enumerate(all_batches):
-            file_name = batch_data['file_name']
-
-            progress_text.text(
-                Config.SUCCESS_MESSAGES['page_progress'].format(idx + 1, total_batches)
+        max_concurrency = max(1, Config.MAX_CONCURRENT_REQUESTS)
+
+        # 受け取った順（ファイル順・batch_number順）のバッチと、完了したバッチの結果
+        # （どちらも呼び出し元スレッドでのみ更新する）
+        seen_batches = []
+        batch_results = {}
+
+        # ストリーミング時はファイルごとに受信途中の結果を通知する
+        stream = Config.STREAM_RESPONSES
+        partial_results = {}
+        stream_lock = threading.Lock()
+
+        def _show_partial(file_name: str) -> None:
+            numbers = sorted(number for (name, number) in partial_results if name == file_name)
+            parts = [partial_results[(file_name, number)] for number in numbers]
+            self.events.partial_result(file_name, self.combine_batch_results(parts, file_name))
+
+        def _on_chunk(batch_data: Dict[str, Any], text: str) -> None:
+            with stream_lock:
+                partial_results[(batch_data['file_name'], batch_data['batch_number'])] = text
+                _show_partial(batch_data['file_name'])
+
+        def _report_progress() -> None:
+            # バッチは順次届くため、総数はその時点までに届いた数
+            completed = len(batch_results)
+            total = len(seen_batches)
+            self.events.progress(
+                completed, total, Config.SUCCESS_MESSAGES['page_progress'].format(completed, total)
             )
 
-            result = self.analyze_batch(batch_data)
-
-            if file_name not in results_by_file:
-                results_by_file[file_name] = []
-            results_by_file[file_name].append(result)
-
-            progress_bar.progress((idx + 1) / total_batches)
-            time.sleep(0.1)
-
-        progress_bar.empty()
-        progress_text.empty()
+        def _pending_batches() -> Iterator[Dict[str, Any]]:
+            # キャッシュ済みのバッチは画像化もAPI呼び出しも行わない
+            for batch_data in all_batches:
+                seen_batches.append(batch_data)
+                cached = self._lookup_result(batch_data)
+                if cached is None:
+                    yield batch_data
+                    continue
+
+                batch_results[(batch_data['file_name'], batch_data['batch_number'])] = cached
+                if stream:
+                    _on_chunk(batch_data, cached)
+                _report_progress()
+
+        if iter_batch_images is None:
+            batch_iterator = ((batch_data, batch_data['images']) for batch_data in _pending_batches())
+        else:
+            # 画像化に続けてエンコードも先行処理の側で行い、API呼び出しのスレッドは送信だけにする
+            batch_iterator = iter_batch_images(_pending_batches(), prepare=self.prepare_batch_images)
+
+        def _run(batch_data: Dict[str, Any]) -> str:
+            on_chunk = None
+            if stream:
+                on_chunk = lambda text: _on_chunk(batch_data, text)
+            return self.analyze_batch(batch_data, on_chunk=on_chunk)
+
+        in_flight = {}
+
+        def _collect(done_futures) -> None:
+            for future in done_futures:
+                batch_data = in_flight.pop(future)
+                batch_results[(batch_data['file_name'], batch_data['batch_number'])] = future.result()
+                if stream:
+                    _on_chunk(batch_data, future.result())
+                _report_progress()
+
+        # ワーカースレッドからも通知できるよう、スレッド開始時に通知先を準備する
+        with ThreadPoolExecutor(
+            max_workers=max_concurrency,
+            thread_name_prefix="gemini",
+            initializer=self.events.attach_thread
+        ) as executor:
+            for batch_data, images in batch_iterator:
+                future = executor.submit(profile_worker(_run), dict(batch_data, images=images))
+                in_flight[future] = batch_data
+                # 送信済みバッチの画像はワーカー側の参照のみとする
+                del images
+
+                # 次のバッチの準備を待つ間に完了したものは先に反映する
+                done = [future for future in in_flight if future.done()]
+                if len(in_flight) >= max_concurrency and not done:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                _collect(done)
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                _collect(done)
+
+        self.events.clear_progress()
+        self.events.clear_partial_results()
+
+        # 完了順ではなく、受け取った順（ファイル順・batch_number順）に戻して統合
+        results_by_file = {}
+        for batch_data in seen_batches:
+            key = (batch_data['file_name'], batch_data['batch_number'])
+            if key in batch_results:
+                results_by_file.setdefault(batch_data['file_name'], []).append(batch_results[key])
 
         final_results = {}
-        for file_name, batch_results in results_by_file.items():
-            final_results[file_name] = self.combine_batch_results(batch_results, file_name)
+        for file_name, file_batch_results in results_by_file.items():
+            final_results[file_name] = self.combine_batch_results(file_batch_results, file_name)
 
-        return final_results
\ No newline at end of file
+        return final_results
@@ -0,0 +1,299 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Set
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.event_sink import EventSink, set_event_sink
+from utils.result_store import get_result_store
+from utils.upload_store import StoredUpload, get_upload_store
+from config import Config
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobStore:
+    """
+    ジョブの状態・進捗・途中結果を保存するSQLiteのジョブテーブル
+    （Streamlitのプロセスとワーカープロセスの間で共有する）
+    """
+
+    def __init__(self, path: str = Config.JOB_DB_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " session_id TEXT,"
+                " status TEXT NOT NULL,"
+                " files TEXT NOT NULL,"
+                " completed INTEGER NOT NULL DEFAULT 0,"
+                " total INTEGER NOT NULL DEFAULT 0,"
+                " progress_message TEXT NOT NULL DEFAULT '',"
+                " partial_results TEXT NOT NULL DEFAULT '{}',"
+                " results TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_messages ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id TEXT NOT NULL,"
+                " level TEXT NOT NULL,"
+                " message TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_messages_job ON job_messages(job_id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, job_id: str, session_id: Optional[str], files: List[Dict[str, str]]) -> None:
+        """
+        ジョブを待機状態で登録
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, session_id, status, files, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, session_id, JOB_QUEUED, json.dumps(files, ensure_ascii=False), now, now)
+            )
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """
+        ジョブの列を更新（partial_results・resultsはJSONに変換して保存）
+        """
+        for key in ('partial_results', 'results'):
+            if key in fields and not isinstance(fields[key], str):
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        fields['updated_at'] = time.time()
+
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def add_message(self, job_id: str, level: str, message: str) -> None:
+        """
+        ジョブの実行中メッセージを追加
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO job_messages (job_id, level, message, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, level, message, time.time())
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        ジョブの状態を取得（存在しなければNone）
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            messages = conn.execute(
+                "SELECT level, message FROM job_messages WHERE job_id = ? ORDER BY seq",
+                (job_id,)
+            ).fetchall()
+
+        job = dict(row)
+        job['files'] = json.loads(job['files'])
+        job['partial_results'] = json.loads(job['partial_results'])
+        job['results'] = json.loads(job['results']) if job['results'] else None
+        job['messages'] = [dict(message) for message in messages]
+        return job
+
+    def active_upload_paths(self) -> Set[str]:
+        """
+        待機中・実行中のジョブが参照するアップロードファイルのパス
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT files FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall()
+        return {file['path'] for row in rows for file in json.loads(row['files'])}
+
+    def list_ids(self, statuses: List[str]) -> List[str]:
+        """
+        指定した状態のジョブIDを登録順に返す
+        """
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+                statuses
+            ).fetchall()
+        return [row['id'] for row in rows]
+
+
+class JobSink(EventSink):
+    """
+    ワーカープロセス内の通知をジョブテーブルへ書き込む通知先
+    """
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self._lock = threading.Lock()
+        self._partial_results: Dict[str, str] = {}
+        self._last_partial_write = 0.0
+
+    def info(self, message: str) -> None:
+        self.store.add_message(self.job_id, 'info', message)
+
+    def warning(self, message: str) -> None:
+        self.store.add_message(self.job_id, 'warning', message)
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        self.store.add_message(self.job_id, 'error', message if detail is None else f"{message}\n{detail}")
+
+    def caption(self, message: str) -> None:
+        self.store.add_message(self.job_id, 'caption', message)
+
+    def progress(self, completed: int, total: int, message: str = "") -> None:
+        self.store.update(self.job_id, completed=completed, total=total, progress_message=message)
+
+    def partial_result(self, file_name: str, text: str) -> None:
+        with self._lock:
+            self._partial_results[file_name] = text
+            # ストリーミングのチャンクごとに書き込むとDBが詰まるため間引く
+            now = time.monotonic()
+            if now - self._last_partial_write < Config.JOB_PARTIAL_WRITE_INTERVAL:
+                return
+            self._last_partial_write = now
+            self.store.update(self.job_id, partial_results=self._partial_results)
+
+    def clear_partial_results(self) -> None:
+        with self._lock:
+            self._partial_results = {}
+            self.store.update(self.job_id, partial_results={})
+
+
+def run_job(job_id: str) -> None:
+    """
+    ワーカープロセスでジョブを1件実行する
+    """
+    # ワーカープロセス内でのみ読み込む（Streamlitのプロセスでは不要）
+    from components.analysis_runner import AnalysisRunner
+
+    store = JobStore()
+    job = store.get(job_id)
+    if job is None or job['status'] not in (JOB_QUEUED, JOB_RUNNING):
+        return
+
+    sink = JobSink(store, job_id)
+    set_event_sink(sink)
+    store.update(job_id, status=JOB_RUNNING)
+
+    try:
+        uploaded_files = [StoredUpload.from_dict(file) for file in job['files']]
+        # 同じ画面のセッションから登録したジョブは、送信の制限で1つの順番として扱う
+        results = AnalysisRunner(sink, session_id=job['session_id'] or job_id).run(uploaded_files, label=job_id)
+        if results:
+            # 結果はジョブテーブルではなく結果の保存先へファイルごとに書き出す（ジョブIDで参照する）
+            get_result_store().save(job_id, results)
+            store.update(job_id, status=JOB_DONE, partial_results={})
+        else:
+            store.update(job_id, status=JOB_FAILED, error="解析結果がありません。")
+    except Exception as e:
+        store.update(job_id, status=JOB_FAILED, error=f"{str(e)}\n{traceback.format_exc()}")
+    finally:
+        set_event_sink(None)
+
+
+class JobManager:
+    """
+    バックグラウンドで解析ジョブを実行するワーカープロセスの集合
+    Streamlitサーバープロセスに1つだけ作り、全セッションで共有する
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = Config.JOB_WORKERS):
+        self.store = store or JobStore()
+        self.workers = workers
+        self._lock = threading.Lock()
+        # 待機中・実行中のジョブが参照するファイルは、アップロード置き場の容量を超えても削除しない
+        get_upload_store().in_use = self.store.active_upload_paths
+        self._executor = self._create_executor()
+        self._recover()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # Streamlitのスレッドを引き継がないよう、forkではなくspawnで起動する
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def _recover(self) -> None:
+        """
+        前回のサーバー停止で中断されたジョブを再投入
+        """
+        for job_id in self.store.list_ids([JOB_QUEUED, JOB_RUNNING]):
+            self.store.update(job_id, status=JOB_QUEUED)
+            self._dispatch(job_id)
+
+    def _dispatch(self, job_id: str) -> None:
+        with self._lock:
+            try:
+                self._executor.submit(run_job, job_id)
+            except BrokenProcessPool:
+                # ワーカーが異常終了していた場合はプールを作り直す
+                self._executor = self._create_executor()
+                self._executor.submit(run_job, job_id)
+
+    def submit(self, uploaded_files: List[Any], session_id: Optional[str] = None) -> str:
+        """
+        アップロードファイルをアップロード置き場へ保存してジョブを登録し、ジョブIDを返す
+        （保存済みのStoredUploadはそのパスをワーカーへ渡す）
+        """
+        job_id = uuid.uuid4().hex
+        upload_store = get_upload_store()
+        files = []
+        for uploaded_file in uploaded_files:
+            # ジョブの登録前は使用中に含まれないため、先に保存した同じジョブのファイルを削除しないようにする
+            stored = upload_store.add(uploaded_file, keep=[file['path'] for file in files])
+            files.append(stored.to_dict())
+
+        self.store.create(job_id, session_id, files)
+        self._dispatch(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        ジョブの状態・進捗・途中結果を取得
+        """
+        return self.store.get(job_id)
+
+
+_manager_lock = threading.Lock()
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """
+    プロセス共通のジョブマネージャーを取得
+    """
+    global _job_manager
+    with _manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
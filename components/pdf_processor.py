@@ -1,93 +1,834 @@
-import streamlit as st
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Iterable, Optional, Iterator, Set, Tuple, Union
 from PIL import Image
 import sys
 import os
+import io
+import hashlib
+import json
+import re
+import time
+from collections import Counter
+from PyPDF2 import PdfReader, PdfWriter
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.image_converter import ImageConverter
+from utils.parallel_renderer import ParallelRenderer
 from utils.error_handler import ErrorHandler
+from utils.event_sink import EventSink, get_event_sink
+from utils.render_cache import get_render_cache
+from utils.result_cache import ResultCache, get_result_cache
+from utils.upload_store import StoredUpload, get_upload_store
+from utils.batch_planner import BatchPlanner, TOKENS_PER_IMAGE_TILE
+from utils.metrics import get_metrics
+from utils.page_filter import PageFilter
+from utils.revision_store import document_key, get_revision_store
 from config import Config
 
+# 注釈のハッシュに含めないキー（親ページ・ポップアップ等への参照と、表示に影響しない更新日時）
+ANNOTATION_SKIPPED_KEYS = {'/P', '/Parent', '/Popup', '/IRT', '/M'}
+
+# テキストページの事前判定で、演算子と誤認しないようコンテンツストリームから取り除く文字列
+CONTENT_STRING_PATTERN = re.compile(rb"\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>")
+# 事前判定で数える演算子（テキスト・インライン画像・矩形・パスの描画）
+CONTENT_OPERATOR_PATTERN = re.compile(rb"(?<![^\s\]>)])(BT|BI|re|S|s|f\*?|F|B\*?|b\*?)(?![^\s\[(/<%])")
+PAINT_OPERATORS = (b'S', b's', b'f', b'f*', b'F', b'B', b'B*', b'b', b'b*')
+
+# ページサイズが取得できない場合に仮定するサイズ（A4縦、ポイント）
+DEFAULT_PAGE_SIZE = (595.0, 842.0)
+
 class PDFProcessor:
-    def __init__(self):
+    def __init__(self, events: Optional[EventSink] = None, cache_settings: Optional[Dict[str, Any]] = None):
+        """
+        cache_settingsは解析結果に影響する設定（GeminiAnalyzer.cache_settings）
+        渡すと、同じファイルの全バッチの解析結果がキャッシュにある場合はページを解析せずに再利用する
+        """
+        self.events = events or get_event_sink()
+        self.cache_settings = cache_settings
         self.image_converter = ImageConverter()
-        self.error_handler = ErrorHandler()
+        self.error_handler = ErrorHandler(self.events)
+        self.render_cache = get_render_cache() if Config.RENDER_CACHE_ENABLED else None
+        # 空白・重複ページの判定結果も解析結果キャッシュに保存し、同じファイルの再解析では縮小画像を作らない
+        self.result_cache = get_result_cache() if Config.RESULT_CACHE_ENABLED else None
+        self.upload_store = get_upload_store()
+        self.metrics = get_metrics()
+        self.revision_store = get_revision_store() if Config.INCREMENTAL_ENABLED else None
+        # ファイルごとの除外ページ（{ファイル名: {ページ番号: 'blank' または重複元のページ番号}}）
+        self.skipped_pages: Dict[str, Dict[int, Union[str, int]]] = {}
+        # 解析が終わってから改訂履歴へ保存するバッチ構成（{ファイル名: (図面セットの名前, ファイルハッシュ, バッチ構成)}）
+        self._pending_revisions: Dict[str, Tuple[str, str, List[Dict[str, Any]]]] = {}
+        # 解析が終わってから解析結果キャッシュへ保存するファイル全体のバッチ構成（{ファイル名: (ファイルハッシュ, 構成)}）
+        self._pending_file_plans: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        # このプロセッサーでアップロード置き場へ保存したファイル（後のファイルの保存で容量を超えても削除しない）
+        self._spooled_paths: Set[str] = set()
 
-    def process_pdf(self, uploaded_file) -> List[Image.Image]:
+    def process_pdf(self, uploaded_file) -> Optional[Dict[str, Any]]:
         """
-        PDFファイルを処理して画像リストを返す
+        PDFファイルのページ数・ページ情報と保存先のパスを返す（画像化はバッチ単位で後から行う）
+        StoredUpload以外が渡された場合はアップロード置き場へ保存してから処理する
         """
         try:
-            pdf_bytes = uploaded_file.read()
+            stored = self.spool(uploaded_file)
+            pdf_path = stored.path
+
+            # 全バッチの結果がキャッシュにあるファイルは、ページ数の取得も含めてPDFを解析しない
+            cached = self.lookup_cached_file(stored)
+            if cached is not None:
+                return cached
+
+            page_count = self.image_converter.get_pdf_page_count(pdf_path)
+
+            if page_count <= 0:
+                self.events.error(Config.ERROR_MESSAGES['file_corrupted'])
+                return None
+
+            analysis_mode = self.choose_analysis_mode(pdf_path, stored.size, page_count)
+
+            if analysis_mode == 'raster' and Config.TEXT_LAYER_ENABLED:
+                page_texts = self.classify_pages(pdf_path, stored.file_hash)
+            else:
+                page_texts = {}
+            page_sizes = self.read_page_sizes(pdf_path)
+            render_sizes = self.plan_render_sizes(page_sizes) if Config.RENDER_MODE == 'fit' else {}
 
-            images = self.image_converter.pdf_to_images(pdf_bytes)
+            skipped_pages = {}
+            if analysis_mode == 'raster' and Config.PAGE_FILTER_ENABLED:
+                drawing_pages = [page for page in range(1, page_count + 1) if page not in page_texts]
+                skipped_pages = self.find_skipped_pages(pdf_path, drawing_pages, stored.file_hash)
 
-            if not images:
-                st.error(Config.ERROR_MESSAGES['file_corrupted'])
-                return []
+            page_fingerprints = self.page_fingerprints(pdf_path) if self.revision_store else {}
 
-            return images
+            return {
+                'type': 'pdf',
+                'pdf_path': pdf_path,
+                'file_size': stored.size,
+                'page_count': page_count,
+                'file_hash': stored.file_hash,
+                'analysis_mode': analysis_mode,
+                'page_texts': page_texts,
+                'page_sizes': page_sizes,
+                'render_sizes': render_sizes,
+                'skipped_pages': skipped_pages,
+                'page_fingerprints': page_fingerprints,
+            }
 
         except Exception as e:
             self.error_handler.handle_error(e, "PDFの処理中にエラーが発生しました")
-            return []
+            return None
 
-    def process_image(self, uploaded_file) -> Optional[Image.Image]:
+    def file_cache_key(self, file_hash: str) -> str:
         """
-        画像ファイルを処理
+        ファイル全体のバッチ構成のキャッシュキー（解析・ページ除外・バッチ分割の設定を含む）
         """
-        return self.image_converter.process_uploaded_image(uploaded_file)
+        return ResultCache.make_key(file_hash, 'file', {
+            'stage': 'file',
+            'analysis': self.cache_settings,
+            'page_filter': self.page_filter_settings() if Config.PAGE_FILTER_ENABLED else None,
+            'max_pages_per_batch': Config.MAX_PAGES_PER_BATCH,
+            'batch_token_budget': Config.BATCH_TOKEN_BUDGET,
+            'batch_payload_budget': Config.BATCH_PAYLOAD_BUDGET,
+        })
 
-    def process_multiple_files(self, uploaded_files) -> Dict[str, List[Image.Image]]:
+    def lookup_cached_file(self, stored: StoredUpload) -> Optional[Dict[str, Any]]:
         """
-        複数のファイルを処理
+        前回解析したときのバッチ構成と、その全バッチの解析結果がキャッシュにあれば、
+        結果付きのファイルデータ（cached_batches）を返す（1つでも無ければNone）
         """
-        all_files_data = {}
+        if self.result_cache is None or self.cache_settings is None:
+            return None
+        cached = self.result_cache.get(self.file_cache_key(stored.file_hash), count=False)
+        if cached is None:
+            return None
 
-        for uploaded_file in uploaded_files:
-            file_name = uploaded_file.name
-            file_extension = file_name.lower().split('.')[-1]
+        plan = json.loads(cached)
+        cached_batches = []
+        for pages in plan['batches']:
+            result = self.result_cache.get(
+                ResultCache.make_key(stored.file_hash, pages, self.cache_settings), count=False
+            )
+            if result is None:
+                # 一部のバッチの結果が削除されていれば、通常どおりページを解析する
+                return None
+            cached_batches.append({'pages': pages, 'result': result})
+
+        return {
+            'type': 'pdf',
+            'pdf_path': stored.path,
+            'file_size': stored.size,
+            'page_count': plan['page_count'],
+            'file_hash': stored.file_hash,
+            'analysis_mode': plan['analysis_mode'],
+            'page_texts': {},
+            'page_sizes': {},
+            'render_sizes': {},
+            'skipped_pages': {int(page): reason for page, reason in plan['skipped_pages'].items()},
+            'page_fingerprints': {},
+            'cached_batches': cached_batches,
+        }
+
+    def choose_analysis_mode(self, pdf_path: str, file_size: int, page_count: int) -> str:
+        """
+        Config.ANALYSIS_MODEとPDFの内容から、'pdf'（そのまま送信）か'raster'（画像化）かを決める
+        """
+        if Config.ANALYSIS_MODE != 'pdf':
+            return 'raster'
+
+        # 1バッチあたりのおおよそのサイズが上限を超えるPDFは画像化する
+        batch_pages = min(page_count, Config.MAX_PAGES_PER_BATCH)
+        if file_size * batch_pages / page_count > Config.PDF_PASSTHROUGH_MAX_BYTES:
+            return 'raster'
+
+        # テキストレイヤーの無いスキャンPDFは画像化する
+        if not self.has_text_layer(pdf_path):
+            return 'raster'
 
-            if not self.error_handler.validate_file_type(file_name):
+        return 'pdf'
+
+    def has_text_layer(self, pdf_path: str) -> bool:
+        """
+        先頭Config.PDF_TEXT_SAMPLE_PAGESページのいずれかにテキストレイヤーがあるか
+        """
+        try:
+            reader = PdfReader(pdf_path)
+            for page in reader.pages[:Config.PDF_TEXT_SAMPLE_PAGES]:
+                if (page.extract_text() or '').strip():
+                    return True
+        except Exception:
+            pass
+        return False
+
+    def split_pdf_pages(self, pdf_path: str, pages: List[int]) -> bytes:
+        """
+        指定ページだけを含むPDFを作成して返す
+        """
+        reader = PdfReader(pdf_path)
+        writer = PdfWriter()
+        for page in pages:
+            writer.add_page(reader.pages[page - 1])
+
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        return buffer.getvalue()
+
+    def classify_pages(self, pdf_path: str, file_hash: Optional[str] = None) -> Dict[int, str]:
+        """
+        テキストレイヤーで内容が読み取れるページを判定し、{ページ番号: テキスト}を返す
+        （ここに含まれないページは図面ページとして画像化する）
+        pdfplumberでの抽出は、コンテンツストリームの事前判定で候補となったページだけに行う
+        file_hashを渡すと、同じファイル・同じしきい値での判定結果を解析結果キャッシュから再利用する
+        """
+        cache_key = None
+        if self.result_cache is not None and file_hash:
+            cache_key = ResultCache.make_key(file_hash, 'text_layer', self.text_layer_settings())
+            cached = self.result_cache.get(cache_key, count=False)
+            if cached is not None:
+                return {int(page): text for page, text in json.loads(cached).items()}
+
+        # 読み込みに時間のかかるモジュールのため、テキストレイヤーを解析するときに読み込む
+        import pdfplumber
+
+        page_texts = {}
+        try:
+            with self.metrics.span('text_layer') as span:
+                candidates = self.find_text_page_candidates(pdf_path)
+                span['candidates'] = len(candidates)
+                with pdfplumber.open(pdf_path) as pdf:
+                    span['pages'] = len(pdf.pages)
+                    for page_number in candidates:
+                        page = pdf.pages[page_number - 1]
+                        text = (page.extract_text() or '').strip()
+                        graphics = len(page.lines) + len(page.curves) + len(page.rects)
+                        # スキャン画像を含むページや図形の多いページは図面として扱う
+                        if (len(text) >= Config.TEXT_PAGE_MIN_CHARS
+                                and graphics <= Config.TEXT_PAGE_MAX_GRAPHICS
+                                and not page.images):
+                            page_texts[page_number] = text
+                        page.flush_cache()
+                span['text_pages'] = len(page_texts)
+        except Exception as e:
+            self.events.warning(f"テキストレイヤーの解析に失敗したため、全ページを画像として処理します: {str(e)}")
+            return {}
+
+        if cache_key is not None:
+            self.result_cache.put(cache_key, json.dumps(page_texts, ensure_ascii=False))
+        return page_texts
+
+    def find_text_page_candidates(self, pdf_path: str) -> List[int]:
+        """
+        コンテンツストリームの演算子を数えるだけで、テキストページになりうるページ番号を返す
+        テキストが無い・画像を含む・図形がTEXT_PAGE_MAX_GRAPHICSを確実に超えるページは候補にしない
+        （フォームの中身は数えないため、フォームを参照するページはテキストの有無に関わらず候補とする）
+        """
+        reader = PdfReader(pdf_path)
+        candidates = []
+        for page_number, page in enumerate(reader.pages, 1):
+            contents = page.get_contents()
+            if contents is None:
                 continue
+            data = CONTENT_STRING_PATTERN.sub(b'()', contents.get_data())
+            operators = Counter(CONTENT_OPERATOR_PATTERN.findall(data))
 
-            st.info(f"処理中: {file_name}")
+            subtypes = set()
+            resources = page.get('/Resources')
+            xobjects = resources.get_object().get('/XObject') if resources is not None else None
+            if xobjects is not None:
+                xobjects = xobjects.get_object()
+                subtypes = {xobjects[name].get_object().get('/Subtype') for name in xobjects}
 
-            if file_extension == 'pdf':
-                images = self.process_pdf(uploaded_file)
-                if images:
-                    all_files_data[file_name] = images
+            if '/Image' in subtypes or operators[b'BI']:
+                continue
+            if not operators[b'BT'] and '/Form' not in subtypes:
+                continue
+            # 描画したパス・矩形の数はpdfplumberの図形数の下限
+            graphics = max(operators[b're'], sum(operators[op] for op in PAINT_OPERATORS))
+            if graphics > Config.TEXT_PAGE_MAX_GRAPHICS:
+                continue
+            candidates.append(page_number)
+        return candidates
+
+    @staticmethod
+    def text_layer_settings() -> Dict[str, Any]:
+        """
+        テキストページの判定に影響する設定（判定結果のキャッシュキーに含める）
+        """
+        return {
+            'stage': 'text_layer',
+            'min_chars': Config.TEXT_PAGE_MIN_CHARS,
+            'max_graphics': Config.TEXT_PAGE_MAX_GRAPHICS,
+        }
+
+    def page_fingerprints(self, pdf_path: str) -> Dict[int, str]:
+        """
+        各ページの描画内容（ページサイズ・回転・コンテンツストリーム・参照する画像/フォーム・フォント・
+        注釈とその外観ストリーム）のハッシュを{ページ番号: ハッシュ}で返す
+        （レンダリングせずに、改訂版で変わったページを見分けるため）
+        取得できない場合は空（差分解析を行わない）
+        """
+        try:
+            reader = PdfReader(pdf_path)
+            fingerprints = {}
+            for page_number, page in enumerate(reader.pages, 1):
+                digest = hashlib.sha256()
+                digest.update(repr([float(value) for value in page.mediabox]).encode())
+                digest.update(repr(page.get('/Rotate', 0)).encode())
+                contents = page.get_contents()
+                if contents is not None:
+                    digest.update(contents.get_data())
+                self._hash_resources(page.get('/Resources'), digest, depth=0)
+                # 朱書き・雲マーク・スタンプ等の注釈だけを変更した改訂も別のページとみなす
+                annotations = page.get('/Annots')
+                if annotations is not None:
+                    for annotation in annotations.get_object():
+                        self._hash_object(annotation, digest, depth=0)
+                fingerprints[page_number] = digest.hexdigest()
+            return fingerprints
+        except Exception as e:
+            self.events.warning(f"ページの比較情報を取得できなかったため、前回の版との差分解析を行いません: {str(e)}")
+            return {}
+
+    def _hash_resources(self, resources: Any, digest: Any, depth: int) -> None:
+        """
+        ページ（フォーム）のリソースが参照する画像・フォームのデータとフォント名をハッシュに加える
+        """
+        if resources is None or depth > 8:
+            return
+        resources = resources.get_object()
+
+        fonts = resources.get('/Font')
+        if fonts is not None:
+            fonts = fonts.get_object()
+            for name in sorted(fonts):
+                digest.update(f"{name}={fonts[name].get_object().get('/BaseFont')}".encode())
+
+        xobjects = resources.get('/XObject')
+        if xobjects is None:
+            return
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            xobject = xobjects[name].get_object()
+            digest.update(name.encode())
+            # 画像は展開せず、圧縮されたままのデータで比較する
+            data = getattr(xobject, '_data', None)
+            if data is None:
+                data = xobject.get_data()
+            digest.update(data.encode('latin-1') if isinstance(data, str) else data)
+            if xobject.get('/Subtype') == '/Form':
+                self._hash_resources(xobject.get('/Resources'), digest, depth + 1)
+
+    def _hash_object(self, obj: Any, digest: Any, depth: int) -> None:
+        """
+        注釈の辞書・配列・ストリーム（外観ストリームを含む）を、参照先を展開しながらハッシュに加える
+        （オブジェクト番号は版ごとに変わるため、参照そのものではなく参照先の内容で比較する）
+        """
+        if depth > 8:
+            return
+        obj = obj.get_object() if hasattr(obj, 'get_object') else obj
+
+        if isinstance(obj, dict):
+            digest.update(b'<<')
+            for key in sorted(obj):
+                if key in ANNOTATION_SKIPPED_KEYS:
+                    continue
+                digest.update(str(key).encode())
+                if key == '/Resources':
+                    self._hash_resources(obj[key], digest, depth + 1)
+                else:
+                    self._hash_object(obj[key], digest, depth + 1)
+            digest.update(b'>>')
+            data = getattr(obj, '_data', None)
+            if data is not None:
+                digest.update(data.encode('latin-1') if isinstance(data, str) else data)
+        elif isinstance(obj, list):
+            digest.update(b'[')
+            for item in obj:
+                self._hash_object(item, digest, depth + 1)
+            digest.update(b']')
+        else:
+            digest.update(repr(obj).encode())
+
+    def read_page_sizes(self, pdf_path: str) -> Dict[int, Tuple[float, float]]:
+        """
+        各ページのサイズ（ポイント）を取得（取得できない場合は空）
+        """
+        try:
+            return self.image_converter.get_pdf_page_sizes(pdf_path)
+        except Exception as e:
+            self.events.warning(f"ページサイズを取得できなかったため、{Config.IMAGE_DPI} DPI・ページ数基準で処理します: {str(e)}")
+            return {}
+
+    def plan_render_sizes(
+        self, page_sizes: Dict[int, Tuple[float, float]]
+    ) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+        """
+        ページサイズから、縮小が必要なページの出力サイズを{ページ番号: size}で返す
+        """
+        render_sizes = {}
+        max_width, max_height = self.image_converter.layout_limits()
+        for page_number, page_size in page_sizes.items():
+            size = self.image_converter.fit_render_size(page_size, Config.IMAGE_DPI, max_width, max_height)
+            if size is not None:
+                render_sizes[page_number] = size
+        return render_sizes
+
+    def find_skipped_pages(
+        self, pdf_path: str, pages: List[int], file_hash: Optional[str] = None
+    ) -> Dict[int, Union[str, int]]:
+        """
+        図面ページの縮小画像から送信しなくてよいページを探し、
+        {ページ番号: 'blank'（空白）または重複元のページ番号}で返す
+        file_hashを渡すと、同じファイル・同じしきい値での判定結果を解析結果キャッシュから再利用する
+        """
+        cache_key = None
+        if self.result_cache is not None and file_hash:
+            cache_key = ResultCache.make_key(file_hash, pages, self.page_filter_settings())
+            cached = self.result_cache.get(cache_key, count=False)
+            if cached is not None:
+                return {int(page): reason for page, reason in json.loads(cached).items()}
+
+        page_filter = PageFilter()
+        thumbnail_size = (None, Config.PAGE_FILTER_THUMBNAIL_HEIGHT)
+        chunk_pages = max(1, Config.PAGE_FILTER_CHUNK_PAGES)
+        skipped = {}
+
+        try:
+            with self.metrics.span('page_filter', pages=len(pages)) as span:
+                # 縮小画像はまとめて作り、判定が済んだら破棄する
+                for i in range(0, len(pages), chunk_pages):
+                    chunk = pages[i:i + chunk_pages]
+                    thumbnails = ParallelRenderer.render_pages(
+                        pdf_path, chunk, render_sizes={page: thumbnail_size for page in chunk}
+                    )
+                    for page, thumbnail in zip(chunk, thumbnails):
+                        result = page_filter.check(page, thumbnail)
+                        if result is not None:
+                            skipped[page] = result
+                span['skipped'] = len(skipped)
+        except Exception as e:
+            self.events.warning(f"空白・重複ページの判定に失敗したため、全ページを送信します: {str(e)}")
+            return {}
+
+        if cache_key is not None:
+            self.result_cache.put(cache_key, json.dumps(skipped))
+        return skipped
+
+    @staticmethod
+    def page_filter_settings() -> Dict[str, Any]:
+        """
+        空白・重複ページの判定に影響する設定（判定結果のキャッシュキーに含める）
+        """
+        return {
+            'stage': 'page_filter',
+            'thumbnail_height': Config.PAGE_FILTER_THUMBNAIL_HEIGHT,
+            'ink_level': Config.PAGE_INK_LEVEL,
+            'blank_ink_ratio': Config.PAGE_BLANK_INK_RATIO,
+            'duplicate_max_distance': Config.PAGE_DUPLICATE_MAX_DISTANCE,
+            'duplicate_max_change': Config.PAGE_DUPLICATE_MAX_CHANGE,
+            'compare_size': Config.PAGE_FILTER_COMPARE_SIZE,
+        }
+
+    @staticmethod
+    def describe_skipped_pages(skipped_pages: Dict[int, Union[str, int]]) -> str:
+        """
+        除外ページの一覧（例: 3（空白）、7（2ページと重複））
+        """
+        return "、".join(
+            f"{page}（空白）" if reason == 'blank' else f"{page}（{reason}ページと重複）"
+            for page, reason in sorted(skipped_pages.items())
+        )
+
+    def estimate_page_costs(self, file_data: Dict[str, Any], pages: Optional[List[int]] = None) -> List[float]:
+        """
+        各ページ（pagesを指定した場合はそのページ）の送信コスト（トークン数・送信サイズの予算に対する割合）を見積もる
+        """
+        page_count = file_data['page_count']
+        page_sizes = file_data.get('page_sizes', {})
+        page_texts = file_data.get('page_texts', {})
+        if pages is None:
+            pages = list(range(1, page_count + 1))
+
+        costs = []
+        for page in pages:
+            if file_data.get('analysis_mode') == 'pdf':
+                # PDFのまま送る場合は1ページ=画像1枚分のトークンとして数える
+                tokens = TOKENS_PER_IMAGE_TILE
+                payload_bytes = file_data['file_size'] // page_count
+            elif page in page_texts:
+                text = page_texts[page]
+                tokens = len(text)
+                payload_bytes = len(text.encode('utf-8'))
             else:
-                image = self.process_image(uploaded_file)
-                if image:
-                    all_files_data[file_name] = [image]
+                # 'tile'では部分画像の合計（最大でレンダリングサイズ分）を見積もる
+                width, height = self.image_converter.estimate_output_size(
+                    page_sizes.get(page, DEFAULT_PAGE_SIZE), Config.IMAGE_DPI,
+                    *(self.image_converter.layout_limits() if Config.IMAGE_LAYOUT_MODE == 'tile'
+                      else (Config.MAX_IMAGE_WIDTH, Config.MAX_IMAGE_HEIGHT))
+                )
+                tokens = BatchPlanner.estimate_image_tokens(width, height)
+                payload_bytes = BatchPlanner.estimate_image_bytes(width, height)
+            costs.append(BatchPlanner.page_cost(tokens, payload_bytes))
+        return costs
+
+    def process_image(self, uploaded_file: StoredUpload) -> Optional[Image.Image]:
+        """
+        画像ファイルを処理
+        """
+        return self.image_converter.process_uploaded_image(uploaded_file.path)
+
+    def spool(self, uploaded_file) -> StoredUpload:
+        """
+        アップロード置き場へ保存する（このプロセッサーで保存済みのファイルは削除対象から外す）
+        """
+        stored = self.upload_store.add(uploaded_file, keep=self._spooled_paths)
+        self._spooled_paths.add(stored.path)
+        return stored
+
+    def process_file(self, uploaded_file) -> Optional[Dict[str, Any]]:
+        """
+        1ファイルを処理してファイルデータを返す（対応していない・読み込めないファイルはNone）
+        """
+        file_name = uploaded_file.name
+        file_extension = file_name.lower().split('.')[-1]
+
+        if not self.error_handler.validate_file_type(file_name):
+            return None
 
-        return all_files_data
+        self.events.info(f"処理中: {file_name}")
 
-    def prepare_batches(self, files_data: Dict[str, List[Image.Image]]) -> List[Dict[str, Any]]:
+        # ディスクへ1回だけ書き出し、以降はファイルのパスで処理する
+        uploaded_file = self.spool(uploaded_file)
+
+        if file_extension == 'pdf':
+            pdf_data = self.process_pdf(uploaded_file)
+            if pdf_data:
+                skipped_pages = pdf_data['skipped_pages']
+                if skipped_pages:
+                    self.skipped_pages[file_name] = skipped_pages
+                    self.events.caption(
+                        f"{file_name}: 空白・重複のため {len(skipped_pages)} ページを除外"
+                        f" - {self.describe_skipped_pages(skipped_pages)}"
+                    )
+                if len(skipped_pages) >= pdf_data['page_count']:
+                    self.events.warning(f"{file_name}: 解析対象のページがありません（すべて空白です）")
+                    return None
+                if pdf_data.get('cached_batches'):
+                    self.events.caption(
+                        f"{file_name}: 前回の解析結果を再利用 {len(pdf_data['cached_batches'])} バッチ"
+                    )
+                elif pdf_data['analysis_mode'] == 'pdf':
+                    self.events.caption(f"{file_name}: PDFのまま送信 {pdf_data['page_count']} ページ")
+                else:
+                    text_pages = len(pdf_data['page_texts'])
+                    self.events.caption(
+                        f"{file_name}: テキスト {text_pages} ページ / "
+                        f"図面（画像） {pdf_data['page_count'] - text_pages} ページ"
+                    )
+            return pdf_data
+
+        image = self.process_image(uploaded_file)
+        if not image:
+            return None
+        return {
+            'type': 'image',
+            'images': [image],
+            'page_count': 1,
+            'file_hash': uploaded_file.file_hash,
+        }
+
+    def iter_batches(self, uploaded_files) -> Iterator[Dict[str, Any]]:
+        """
+        ファイルを1つずつ処理し、そのファイルのバッチを順に返すジェネレータ
+        （全ファイルの処理を待たずに、先頭のファイルのバッチから解析を始められる）
+        """
+        for uploaded_file in uploaded_files:
+            file_data = self.process_file(uploaded_file)
+            if file_data:
+                yield from self.prepare_batches({uploaded_file.name: file_data})
+
+    def prepare_batches(self, files_data: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        ファイルデータをバッチに分割
+        ファイルデータをバッチに分割（PDFはページ範囲のみを持ち、画像化はload_batch_imagesで行う）
+        バッチの区切りはBatchPlannerがページごとの見積もりコストから決める
         """
         all_batches = []
 
-        for file_name, images in files_data.items():
-            if len(images) > Config.MAX_PAGES_PER_BATCH:
-                batched_images = self.image_converter.batch_images(images)
-                for batch_idx, batch in enumerate(batched_images):
+        for file_name, file_data in files_data.items():
+            if file_data['type'] != 'pdf':
+                all_batches.append({
+                    'file_name': file_name,
+                    'batch_number': 1,
+                    'total_batches': 1,
+                    'file_hash': file_data['file_hash'],
+                    'pages': [1],
+                    'images': file_data['images']
+                })
+                continue
+
+            cached_batches = file_data.get('cached_batches')
+            if cached_batches:
+                for batch_idx, batch in enumerate(cached_batches):
                     all_batches.append({
                         'file_name': file_name,
                         'batch_number': batch_idx + 1,
-                        'total_batches': len(batched_images),
-                        'images': batch
+                        'total_batches': len(cached_batches),
+                        'file_hash': file_data['file_hash'],
+                        'pdf_path': file_data['pdf_path'],
+                        'analysis_mode': file_data['analysis_mode'],
+                        'pages': batch['pages'],
+                        'cached_result': batch['result'],
                     })
-            else:
+                continue
+
+            # 空白・重複として除外したページはバッチに含めない
+            skipped_pages = file_data.get('skipped_pages', {})
+            send_pages = [
+                page for page in range(1, file_data['page_count'] + 1) if page not in skipped_pages
+            ]
+
+            page_groups = self.plan_page_groups(file_name, file_data, send_pages)
+            total_batches = len(page_groups)
+            if self.result_cache is not None and self.cache_settings is not None:
+                self._pending_file_plans[file_name] = (file_data['file_hash'], {
+                    'page_count': file_data['page_count'],
+                    'analysis_mode': file_data['analysis_mode'],
+                    'batches': page_groups,
+                    'skipped_pages': skipped_pages,
+                })
+            fingerprints = file_data.get('page_fingerprints', {})
+            # 複数バッチに分かれるファイルでは、テキストページを全バッチの共通の内容の候補にする
+            # （モデル側のキャッシュに登録できた場合だけ共通の内容として送る。解析時に判断する）
+            file_page_texts = None
+            if (Config.CONTEXT_CACHE_ENABLED and Config.CONTEXT_CACHE_FILE_TEXT
+                    and total_batches > 1 and file_data['page_texts']):
+                file_page_texts = file_data['page_texts']
+            for batch_idx, pages in enumerate(page_groups):
                 all_batches.append({
                     'file_name': file_name,
-                    'batch_number': 1,
-                    'total_batches': 1,
-                    'images': images
+                    'batch_number': batch_idx + 1,
+                    'total_batches': total_batches,
+                    'file_hash': file_data['file_hash'],
+                    'pdf_path': file_data['pdf_path'],
+                    'analysis_mode': file_data['analysis_mode'],
+                    'pages': pages,
+                    'page_texts': {
+                        page: file_data['page_texts'][page]
+                        for page in pages if page in file_data['page_texts']
+                    },
+                    'render_sizes': {
+                        page: file_data['render_sizes'][page]
+                        for page in pages if page in file_data['render_sizes']
+                    },
+                    'page_fingerprints': [fingerprints[page] for page in pages] if fingerprints else None,
+                    'file_page_texts': file_page_texts,
                 })
 
-        return all_batches
\ No newline at end of file
+        return all_batches
+
+    def plan_page_groups(
+        self, file_name: str, file_data: Dict[str, Any], send_pages: List[int]
+    ) -> List[List[int]]:
+        """
+        送信するページをバッチごとのページのリストに分ける
+        前回の版がある場合、内容の変わっていないバッチは前回と同じ区切りのまま残し（解析結果を再利用できる）、
+        変更・追加されたページだけを新しいバッチに分割する
+        """
+        fingerprints = file_data.get('page_fingerprints')
+        key = document_key(file_name)
+        previous = self.revision_store.get(key) if self.revision_store and fingerprints else None
+
+        unchanged_groups = []
+        if previous and previous['file_hash'] != file_data['file_hash']:
+            send_set = set(send_pages)
+            for batch in previous['batches']:
+                pages = batch['pages']
+                if all(page in send_set for page in pages) and [
+                    fingerprints.get(page) for page in pages
+                ] == batch['fingerprints']:
+                    unchanged_groups.append(pages)
+
+        covered = {page for pages in unchanged_groups for page in pages}
+        changed_pages = [page for page in send_pages if page not in covered]
+
+        # ページ数だけでなく見積もりコストも予算内に収まるよう、均等なバッチに分割
+        page_groups = list(unchanged_groups)
+        if changed_pages:
+            page_ranges = BatchPlanner.plan(
+                self.estimate_page_costs(file_data, changed_pages), max_pages=Config.MAX_PAGES_PER_BATCH
+            )
+            page_groups.extend(changed_pages[start:end] for start, end in page_ranges)
+        page_groups.sort(key=lambda pages: pages[0])
+
+        if previous and previous['file_hash'] != file_data['file_hash']:
+            changed_batches = len(page_groups) - len(unchanged_groups)
+            self.events.caption(
+                f"{file_name}: 前回の版（{previous['file_name']}）から変更・追加されたページ "
+                f"{len(changed_pages)} ページ - {changed_batches}/{len(page_groups)} バッチを解析"
+            )
+
+        if self.revision_store and fingerprints:
+            # 解析に失敗・中断した版を保存すると、次の版で解析していないバッチを変更なしとみなしてしまう
+            self._pending_revisions[file_name] = (key, file_data['file_hash'], [
+                {'pages': pages, 'fingerprints': [fingerprints[page] for page in pages]}
+                for pages in page_groups
+            ])
+        return page_groups
+
+    def record_completed_files(self, failed_files: Iterable[str] = ()) -> None:
+        """
+        全バッチの解析結果を保存できたファイルについて、バッチ構成を保存する（failed_filesのファイルは保存しない）
+        改訂履歴へは次の版との比較用に、解析結果キャッシュへは同じファイルの結果をページを解析せずに返すために保存する
+        """
+        failed_files = set(failed_files)
+        for file_name, (key, file_hash, batches) in self._pending_revisions.items():
+            if file_name not in failed_files:
+                self.revision_store.put(key, file_name, file_hash, batches)
+        for file_name, (file_hash, plan) in self._pending_file_plans.items():
+            if file_name not in failed_files:
+                self.result_cache.put(self.file_cache_key(file_hash), json.dumps(plan))
+        self._pending_revisions.clear()
+        self._pending_file_plans.clear()
+
+    def load_batch_images(self, batch_data: Dict[str, Any]) -> List[Image.Image]:
+        """
+        バッチに含まれる図面ページだけを画像化して返す（テキストページは画像化しない）
+        レンダリングキャッシュにあるページは読み込み、無いページだけをワーカープールで並列に変換する
+        """
+        if 'images' in batch_data:
+            return batch_data['images']
+
+        if batch_data.get('analysis_mode') == 'pdf':
+            pdf_part = self.split_pdf_pages(batch_data['pdf_path'], batch_data['pages'])
+            if len(pdf_part) <= Config.PDF_PASSTHROUGH_MAX_BYTES:
+                return [{'mime_type': 'application/pdf', 'data': pdf_part}]
+            # 分割後も大きすぎる場合は画像化して送信する
+
+        pages = [page for page in batch_data['pages'] if page not in batch_data.get('page_texts', {})]
+        if not pages:
+            return []
+
+        render_sizes = batch_data.get('render_sizes', {})
+        if self.render_cache is None:
+            return self._render_pages(batch_data, pages, Config.IMAGE_DPI, render_sizes)
+
+        file_hash = batch_data['file_hash']
+        dpi = Config.IMAGE_DPI
+
+        def _size_key(page: int) -> str:
+            size = render_sizes.get(page)
+            if size is None:
+                return 'auto'
+            return f"{size[0] or ''}x{size[1] or ''}"
+
+        start = time.perf_counter()
+        images_by_page = {}
+        for page in pages:
+            cached = self.render_cache.get(file_hash, page, dpi, _size_key(page))
+            if cached is not None:
+                images_by_page[page] = cached
+        if images_by_page:
+            self.render_cache.record_load(len(images_by_page), time.perf_counter() - start)
+
+        missing_pages = [page for page in pages if page not in images_by_page]
+        if missing_pages:
+            start = time.perf_counter()
+            rendered = self._render_pages(batch_data, missing_pages, dpi, render_sizes)
+            self.render_cache.record_render(len(rendered), time.perf_counter() - start)
+
+            for page, image in zip(missing_pages, rendered):
+                self.render_cache.put(file_hash, page, dpi, image, _size_key(page))
+                images_by_page[page] = image
+
+        return [images_by_page[page] for page in pages if page in images_by_page]
+
+    def _render_pages(
+        self,
+        batch_data: Dict[str, Any],
+        pages: List[int],
+        dpi: int,
+        render_sizes: Dict[int, Tuple[Optional[int], Optional[int]]]
+    ) -> List[Image.Image]:
+        """
+        指定ページをワーカープールで画像化する（所要時間をpdf_to_imagesとして計測）
+        """
+        with self.metrics.span(
+            'pdf_to_images',
+            file_name=batch_data['file_name'],
+            batch_number=batch_data['batch_number'],
+            pages=len(pages),
+            dpi=dpi
+        ):
+            return ParallelRenderer.render_pages(batch_data['pdf_path'], pages, dpi, render_sizes=render_sizes)
+
+    def _load_batch_safely(self, batch_data: Dict[str, Any]) -> Tuple[List[Image.Image], Optional[Exception]]:
+        """
+        ワーカースレッド用：例外を戻り値として返す（エラーの通知は呼び出し元スレッドで行う）
+        """
+        try:
+            return self.load_batch_images(batch_data), None
+        except Exception as e:
+            return [], e
+
+    def iter_batch_images(
+        self,
+        all_batches: Iterable[Dict[str, Any]],
+        prepare: Optional[Callable[[Dict[str, Any], List[Any]], List[Any]]] = None
+    ) -> Iterator[Tuple[Dict[str, Any], List[Any]]]:
+        """
+        バッチごとに画像化して順に返すジェネレータ（all_batchesはジェネレータでもよい）
+        解析中のバッチの後ろでConfig.RENDER_PREFETCH_BATCHES件まで先行してレンダリングする
+        prepareを渡すと、画像化に続けて同じワーカースレッドで送信用の変換（エンコード等）まで行う
+        画像化に失敗したバッチは、エラーの内容をload_errorに入れて画像なしで返す（解析側で送信せずに失敗とする）
+        """
+        def _load(batch_data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Any], Optional[Exception]]:
+            images, error = self._load_batch_safely(batch_data)
+            if error is None and prepare is not None:
+                try:
+                    images = prepare(batch_data, images)
+                except Exception as e:
+                    images, error = [], e
+            return batch_data, images, error
+
+        for batch_data, images, error in ParallelRenderer.map_prefetch(_load, all_batches):
+            if error is not None:
+                self.events.error(f"PDFの画像変換中にエラーが発生しました: {str(error)}")
+                batch_data = dict(batch_data, load_error=str(error))
+            yield batch_data, images
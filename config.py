@@ -1,25 +1,229 @@
 import os
-import streamlit as st
 from dotenv import load_dotenv
 
 load_dotenv()
 
+class _SecretSetting:
+    """
+    最初に参照されたときにStreamlitのSecrets（無ければ環境変数）から値を読み込む設定
+    （読み込み時にst.secretsを調べないため、CLI・ジョブのプロセスや画面の再実行でSecretsを読み直さない）
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._loaded = False
+        self._value = None
+
+    def __get__(self, instance, owner):
+        if not self._loaded:
+            self._value = self._load()
+            self._loaded = True
+        return self._value
+
+    def _load(self):
+        try:
+            import streamlit as st
+            return st.secrets[self.name]
+        except Exception:
+            return os.getenv(self.name)
+
 class Config:
     # Streamlit CloudではSecretsから、ローカルでは.envから取得
-    try:
-        GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-    except:
-        GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    GEMINI_API_KEY = _SecretSetting('GEMINI_API_KEY')
 
     GEMINI_MODEL = "gemini-2.5-pro-preview-03-25"
 
     MAX_PAGES_PER_BATCH = 50
 
+    # 1バッチあたりの入力トークン数・送信サイズの予算（見積もり値でバッチを分割）
+    BATCH_TOKEN_BUDGET = 200000
+    BATCH_PAYLOAD_BUDGET = 15 * 1024 * 1024
+    # エンコード後の1画素あたりのバイト数（見積もり用）
+    ESTIMATED_BYTES_PER_PIXEL = 0.1
+
+    # 解析方式
+    # 'raster': 各ページを画像化して送信
+    # 'pdf': ページ範囲ごとに分割したPDFをそのまま送信（スキャンPDFや大きすぎるPDFは自動的に'raster'）
+    ANALYSIS_MODE = 'raster'
+    # 'pdf'方式で1バッチとして送信できるPDFの最大サイズ
+    PDF_PASSTHROUGH_MAX_BYTES = 15 * 1024 * 1024
+    # スキャンPDF判定で確認するページ数
+    PDF_TEXT_SAMPLE_PAGES = 5
+
     IMAGE_DPI = 200
 
+    # Geminiへ送る画像の最大サイズ（これを超える画像は縮小する）
+    MAX_IMAGE_WIDTH = 1920
+    MAX_IMAGE_HEIGHT = 1080
+
+    # レンダリング方式
+    # 'fit': ページサイズからMAX_IMAGE_WIDTH/HEIGHTに収まる出力サイズを計算して直接レンダリング
+    # 'dpi': 従来どおりIMAGE_DPIでレンダリングしてから縮小
+    RENDER_MODE = 'fit'
+
+    # 送信する画像のレイアウト処理
+    # 'fit': ページ全体をMAX_IMAGE_WIDTH/HEIGHTに縮小
+    # 'crop': 周囲の余白を切り取ってから縮小（同じ画素数で図面部分を大きく写せる）
+    # 'tile': 余白を切り取り、描き込みの多いページは重なりのある部分画像に分割して送信
+    IMAGE_LAYOUT_MODE = 'fit'
+    # 'crop'/'tile'のときのレンダリングサイズの上限（MAX_IMAGE_WIDTH/HEIGHTに対する倍率）
+    LAYOUT_RENDER_SCALE = 2.0
+    # 切り取り後に残す余白（切り取った範囲の辺の長さに対する割合）
+    CROP_PADDING_RATIO = 0.01
+    # インクの画素がこの割合未満の行・列は余白とみなす（孤立した汚れを無視するため）
+    CROP_MIN_INK_RATIO = 0.001
+    # 'tile'で1枚の画像（部分画像）に使う画素数の上限
+    TILE_PIXEL_BUDGET = MAX_IMAGE_WIDTH * MAX_IMAGE_HEIGHT
+    # 1ページを分割する部分画像の最大数
+    TILE_MAX_TILES = 4
+    # 隣り合う部分画像の重なり（部分画像の辺の長さに対する割合）
+    TILE_OVERLAP = 0.1
+    # 分割するページのインクの最小割合（描き込みの少ないページは縮小のみ）
+    TILE_MIN_INK_RATIO = 0.02
+
+    # Geminiへ送る画像のエンコード方式
+    # 'auto': ページ内容で判定（線画→1bit PNG（インクが欠ける場合はグレースケールPNG）、無彩色→グレースケール、その他→IMAGE_AUTO_LOSSY_FORMAT）
+    # 'png' / 'jpeg' / 'webp': 指定形式で送信
+    # 'none': PIL画像のまま渡す（エンコードはSDK任せ）
+    IMAGE_ENCODING = 'auto'
+    IMAGE_AUTO_LOSSY_FORMAT = 'jpeg'
+    # 'auto'以外のときの色変換: 'rgb' / 'gray' / '1bit'
+    IMAGE_COLOR_MODE = 'rgb'
+    JPEG_QUALITY = 85
+    WEBP_QUALITY = 80
+    # 自動判定のしきい値（チャンネル間の平均差、黒白画素の割合）
+    IMAGE_COLOR_THRESHOLD = 8
+    IMAGE_LINE_ART_RATIO = 0.97
+    # 線画を1bitにするしきい値（背景の明るさよりこの値だけ暗い画素を黒にする。縮小で薄くなった細線を残す）
+    BILEVEL_BACKGROUND_MARGIN = 6
+    # 1bitにした画像が元の画像のインク量（暗さの合計）のこの割合を下回る場合は、グレースケールのまま送信する
+    BILEVEL_MIN_INK_RETAINED = 0.9
+
+    # PDFレンダリングの並列数（popplerプロセス数）
+    RENDER_WORKERS = os.cpu_count() or 1
+
+    # 1ワーカーに割り当てる最小ページ数（プロセス起動コストとの兼ね合い）
+    RENDER_MIN_PAGES_PER_WORKER = 4
+
+    # 解析待ちの間に先行してレンダリング・エンコードしておくバッチ数
+    RENDER_PREFETCH_BATCHES = 2
+
+    # 読み込み・分割済みで画像化を待つバッチの上限数（ファイルの読み込みを先行させる量）
+    PIPELINE_QUEUE_SIZE = 4
+
+    # テキストレイヤーを持つページは画像化せずテキストとして送信する
+    TEXT_LAYER_ENABLED = True
+    # テキストページと判定する最小文字数
+    TEXT_PAGE_MIN_CHARS = 200
+    # テキストページと判定する図形（線・曲線・矩形）の最大数
+    TEXT_PAGE_MAX_GRAPHICS = 50
+
+    # 空白ページ・ほぼ同じページ（表紙の繰り返し・図面枠だけが異なる改訂版等）を送信前に除外する
+    PAGE_FILTER_ENABLED = True
+    # 判定用の縮小画像の高さ（ピクセル）と、一度に縮小画像を作るページ数
+    PAGE_FILTER_THUMBNAIL_HEIGHT = 1024
+    PAGE_FILTER_CHUNK_PAGES = 32
+    # この値より暗い画素をインクとみなし、インクの割合がPAGE_BLANK_INK_RATIO未満なら空白ページ
+    PAGE_INK_LEVEL = 230
+    PAGE_BLANK_INK_RATIO = 0.0005
+    # 知覚ハッシュのハミング距離（64ビット中）がこれ以下のページを重複候補とし、
+    # PAGE_FILTER_COMPARE_SIZE四方に縮小した画像のインクの差がPAGE_DUPLICATE_MAX_CHANGE以下なら重複とする
+    PAGE_DUPLICATE_MAX_DISTANCE = 6
+    PAGE_DUPLICATE_MAX_CHANGE = 0.03
+    PAGE_FILTER_COMPARE_SIZE = 256
+
+    # Gemini APIへ同時に送信するバッチ数の上限（1で逐次実行）
+    MAX_CONCURRENT_REQUESTS = 4
+
+    # Geminiの応答をストリーミングで受信し、受信途中の結果を表示する
+    STREAM_RESPONSES = True
+
     MAX_RETRY_ATTEMPTS = 3
 
+    # 再試行の待ち時間（秒）：初回の待ち時間から失敗ごとに倍にし、上限で打ち切る
     RETRY_DELAY = 2
+    RETRY_MAX_DELAY = 60
+
+    # 送信サイズ超過で失敗したバッチを半分に分割して再送する
+    BISECT_ON_PAYLOAD_ERROR = True
+
+    # モデル側のコンテキストキャッシュ（解析プロンプトとファイル共通の内容を1回だけ登録し、各バッチから参照する）
+    CONTEXT_CACHE_ENABLED = False
+    # キャッシュの有効期限（秒）。長いジョブでは期限の前に作り直す
+    CONTEXT_CACHE_TTL = 3600
+    # キャッシュを作成する最小の量（モデルの最小トークン数に合わせる。目安はテキストの文字数）
+    CONTEXT_CACHE_MIN_TOKENS = 4096
+    # 複数バッチに分かれるファイルでは、テキストページ（特記仕様・凡例等）を全バッチの共通の内容にする
+    # （キャッシュを作成できなかった場合は、テキストページはそのページのバッチでだけ送信する）
+    CONTEXT_CACHE_FILE_TEXT = True
+
+    # キャッシュの保存先ディレクトリ
+    CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+    # 解析結果キャッシュ（同一ファイル・同一設定の再解析をスキップ）
+    RESULT_CACHE_ENABLED = True
+    RESULT_CACHE_PATH = os.path.join(CACHE_DIR, 'results.sqlite3')
+    RESULT_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+    # 改訂版の差分解析（前回の版とページの内容を比較し、変更されたページを含むバッチだけを解析する）
+    # 変更の無いバッチは前回の版と同じ区切りで作り、解析結果キャッシュから結果を再利用する
+    INCREMENTAL_ENABLED = True
+    REVISION_STORE_PATH = os.path.join(CACHE_DIR, 'revisions.sqlite3')
+    # 同じ図面セットの版とみなすため、ファイル名（拡張子を除く）の末尾から取り除く改訂記号
+    # 例: 図面_revB / 図面 Rev.C / 図面-R2 / 図面_改訂3 → 図面
+    # 区切り記号の後の改訂記号と番号（rは数字のみ）だけを取り除く（preview・構造図_RC・sheet-rev等は取り除かない）
+    REVISION_NAME_PATTERN = r'[\s_\-.](?:(?:rev|改訂?)[\s_\-.]*(?:\d{1,3}|[a-z])|r[\s_\-.]*\d{1,3})$'
+
+    # レンダリング済みページのキャッシュ（同一PDFの再ラスタライズをスキップ）
+    RENDER_CACHE_ENABLED = True
+    RENDER_CACHE_DIR = os.path.join(CACHE_DIR, 'pages')
+    RENDER_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    RENDER_CACHE_FORMAT = 'PNG'
+
+    # アップロードファイルの保存先（同じ内容のファイルは1つだけ保存）
+    UPLOAD_STORE_DIR = os.path.join(CACHE_DIR, 'uploads')
+    UPLOAD_STORE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+    # ディスクへ書き出す・ハッシュを計算するときの読み込み単位
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+    # バックグラウンドジョブ（画面の再実行・再読み込みで解析が中断されないようにする）
+    JOB_ENGINE_ENABLED = True
+    JOB_WORKERS = 2
+    JOB_DB_PATH = os.path.join(CACHE_DIR, 'jobs.sqlite3')
+    # 画面がジョブの状態を確認する間隔（秒）
+    JOB_POLL_INTERVAL = 2
+    # 途中結果をジョブテーブルへ書き込む最小間隔（秒）
+    JOB_PARTIAL_WRITE_INTERVAL = 1.0
+
+    # Gemini APIの送信の制限（同じAPIキーを使う全セッション・全ワーカープロセスで共有する）
+    # 上限はAPIキーのクォータ（1分あたりのリクエスト数・入力トークン数）に合わせる（Noneで制限しない）
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_REQUESTS_PER_MINUTE = 150
+    RATE_LIMIT_TOKENS_PER_MINUTE = 2000000
+    RATE_LIMIT_DB_PATH = os.path.join(CACHE_DIR, 'rate_limit.sqlite3')
+    # 送信待ちの要求が順番・上限の余裕を確認する間隔（秒）
+    RATE_LIMIT_POLL_INTERVAL = 0.5
+
+    # 解析結果の保存先（ファイルごとのMarkdown。画面は選択したファイルの結果だけを読み込む）
+    RESULT_STORE_DIR = os.path.join(CACHE_DIR, 'results')
+    # 保存しておく解析（ジョブ）の数
+    RESULT_STORE_MAX_RUNS = 100
+    # 結果一覧の1ページに表示するファイル数
+    RESULTS_PAGE_SIZE = 20
+
+    # 処理段階ごとの計測（所要時間・バイト数・トークン数）をJSONログへ出力する
+    METRICS_ENABLED = True
+    METRICS_LOG_PATH = os.path.join(CACHE_DIR, 'metrics.jsonl')
+    # ログがこのサイズを超えたら.1へ移して新しく書き始める（直前の1世代だけを残す）
+    METRICS_LOG_MAX_BYTES = 50 * 1024 * 1024
+    # Prometheus形式（node_exporterのtextfileコレクター向け）の出力先ディレクトリ（Noneで出力しない）
+    METRICS_PROMETHEUS_DIR = None
+
+    # cProfile・tracemallocによるジョブ単位のプロファイル（--profileまたはTrueで有効）
+    PROFILE_ENABLED = False
+    PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+    PROFILE_TOP_N = 30
+    PROFILE_TRACEMALLOC_FRAMES = 5
 
     SUPPORTED_FILE_TYPES = ['pdf', 'png', 'jpg', 'jpeg']
 
@@ -0,0 +1,211 @@
+import io
+import os
+import shutil
+import sys
+import threading
+from typing import List, Optional, Tuple
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from utils import metrics, render_cache, result_cache, result_store, revision_store, upload_store  # noqa: E402
+from utils.event_sink import EventSink  # noqa: E402
+from utils.image_converter import ImageConverter  # noqa: E402
+
+
+class RecordingSink(EventSink):
+    """
+    通知されたメッセージを(レベル, メッセージ)として記録する通知先
+    """
+
+    def __init__(self):
+        self.messages: List[Tuple[str, str]] = []
+
+    def info(self, message: str) -> None:
+        self.messages.append(('info', message))
+
+    def warning(self, message: str) -> None:
+        self.messages.append(('warning', message))
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        self.messages.append(('error', message))
+
+    def caption(self, message: str) -> None:
+        self.messages.append(('caption', message))
+
+    def levels(self) -> List[str]:
+        return [level for level, _ in self.messages]
+
+
+class FakeClock:
+    """
+    time.time・time.monotonicの代わりに使う時計（sleepを呼ぶと待った分だけ進む）
+    """
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+        self.sleeps: List[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+class StubModel:
+    """
+    送信内容を記録するモデル（cachedを渡すとキャッシュを参照するモデル）
+    """
+
+    def __init__(self, cached=None):
+        self.cached = cached
+        self.requests: List[list] = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False):
+        with self._lock:
+            self.requests.append(contents)
+        return StubResponse("解析結果")
+
+
+@pytest.fixture(autouse=True)
+def metrics_without_log(monkeypatch):
+    """
+    テスト中の計測はログファイルへ書き出さない
+    """
+    monkeypatch.setattr(metrics, '_metrics', metrics.MetricsRecorder())
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path, monkeypatch):
+    """
+    キャッシュ・アップロード置き場はテストごとの一時ディレクトリに作る
+    """
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(Config, 'CACHE_DIR', str(cache_dir))
+    monkeypatch.setattr(Config, 'RESULT_CACHE_PATH', str(cache_dir / 'results.sqlite3'))
+    monkeypatch.setattr(Config, 'REVISION_STORE_PATH', str(cache_dir / 'revisions.sqlite3'))
+    monkeypatch.setattr(Config, 'RENDER_CACHE_DIR', str(cache_dir / 'pages'))
+    monkeypatch.setattr(Config, 'UPLOAD_STORE_DIR', str(cache_dir / 'uploads'))
+    monkeypatch.setattr(Config, 'JOB_DB_PATH', str(cache_dir / 'jobs.sqlite3'))
+    monkeypatch.setattr(Config, 'RATE_LIMIT_DB_PATH', str(cache_dir / 'rate_limit.sqlite3'))
+    monkeypatch.setattr(Config, 'RESULT_STORE_DIR', str(cache_dir / 'results'))
+    monkeypatch.setattr(Config, 'PROFILE_DIR', str(cache_dir / 'profiles'))
+    monkeypatch.setattr(result_cache, '_result_cache', None)
+    monkeypatch.setattr(revision_store, '_revision_store', None)
+    monkeypatch.setattr(render_cache, '_render_cache', None)
+    monkeypatch.setattr(upload_store, '_upload_store', None)
+    monkeypatch.setattr(result_store, '_result_store', None)
+    return cache_dir
+
+
+@pytest.fixture(autouse=True)
+def page_count_without_poppler(monkeypatch):
+    """
+    popplerの無い環境では、ページ数をPyPDF2で数える
+    """
+    if shutil.which('pdfinfo') is not None:
+        return
+
+    def _get_pdf_page_count(pdf_path: str) -> int:
+        from PyPDF2 import PdfReader
+        return len(PdfReader(pdf_path).pages)
+
+    monkeypatch.setattr(ImageConverter, 'get_pdf_page_count', staticmethod(_get_pdf_page_count))
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """
+    ページごとのコンテンツストリームからPDFを作成してパスを返す（フォントはHelvetica 1つ）
+    """
+    from PyPDF2 import PdfWriter
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    def _make_pdf(name: str, streams: List[bytes], size: Tuple[float, float] = (595, 842)) -> str:
+        writer = PdfWriter()
+        font = writer._add_object(DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        }))
+        for data in streams:
+            writer.add_blank_page(*size)
+            page = writer.pages[-1]
+            content = DecodedStreamObject()
+            content.set_data(data)
+            page[NameObject('/Contents')] = writer._add_object(content)
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/Font'): DictionaryObject({NameObject('/F1'): font}),
+            })
+        path = tmp_path / name
+        with open(path, 'wb') as f:
+            writer.write(f)
+        return str(path)
+
+    return _make_pdf
+
+
+def text_stream(lines: int = 30) -> bytes:
+    """
+    仕様書のような文字だけのページ
+    """
+    return b"".join(
+        b"BT /F1 10 Tf 50 %d Td (Specification line %d for the structural drawings) Tj ET\n" % (800 - i * 14, i)
+        for i in range(lines)
+    )
+
+
+def drawing_stream(lines: int = 500) -> bytes:
+    """
+    図面枠の文字と多数の線分を描いたページ
+    """
+    segments = b"".join(
+        b"%d %d m %d %d l S\n" % (i % 500, (i * 7) % 800, (i * 13) % 500, (i * 3) % 800) for i in range(lines)
+    )
+    return text_stream(3) + segments
+
+
+@pytest.fixture
+def events() -> RecordingSink:
+    return RecordingSink()
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+class UploadedFile(io.BytesIO):
+    """
+    Streamlitのアップロードファイルと同じくname・sizeを持つファイルオブジェクト
+    """
+
+    def __init__(self, path: str, name: Optional[str] = None):
+        with open(path, 'rb') as f:
+            super().__init__(f.read())
+        self.name = name or os.path.basename(path)
+        self.size = len(self.getbuffer())
+
+
+@pytest.fixture
+def runner_config(monkeypatch):
+    """
+    スタブのモデルで通しの解析を行うための設定（ストリーミング・プロファイルを使わない）
+    """
+    monkeypatch.setattr(Config, 'STREAM_RESPONSES', False)
+    monkeypatch.setattr(Config, 'CONTEXT_CACHE_ENABLED', False)
+    monkeypatch.setattr(Config, 'RESULT_CACHE_ENABLED', True)
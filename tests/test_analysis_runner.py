@@ -0,0 +1,46 @@
+import pytest
+
+from components.analysis_runner import AnalysisRunner
+from components.pdf_processor import PDFProcessor
+from conftest import StubModel, UploadedFile, text_stream
+from utils.image_converter import ImageConverter
+
+pytest.importorskip('pdfplumber')
+
+
+def test_cached_file_returns_without_parsing_pages(runner_config, events, make_pdf, monkeypatch):
+    pdf_path = make_pdf('spec.pdf', [text_stream(), text_stream(40)])
+    model = StubModel()
+
+    first = AnalysisRunner(events, model=model, profile=False).run([UploadedFile(pdf_path)])
+    assert len(model.requests) == 1
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("a cached file should not be parsed")
+
+    # 全バッチの結果がキャッシュにあるファイルは、ページ数・ページ分類・ページサイズも取得しない
+    monkeypatch.setattr(ImageConverter, 'get_pdf_page_count', staticmethod(_fail))
+    monkeypatch.setattr(PDFProcessor, 'classify_pages', _fail)
+    monkeypatch.setattr(PDFProcessor, 'read_page_sizes', _fail)
+    monkeypatch.setattr(PDFProcessor, 'page_fingerprints', _fail)
+    second = AnalysisRunner(events, model=model, profile=False).run([UploadedFile(pdf_path, 'copy.pdf')])
+
+    assert len(model.requests) == 1
+    assert second == {'copy.pdf': first['spec.pdf']}
+    assert any("前回の解析結果を再利用 1 バッチ" in message for _, message in events.messages)
+
+
+def test_failed_file_is_not_reused(runner_config, events, make_pdf, monkeypatch):
+    pdf_path = make_pdf('spec.pdf', [text_stream()])
+
+    class FailingModel(StubModel):
+        def generate_content(self, contents, stream=False):
+            super().generate_content(contents, stream)
+            raise ValueError("invalid request")
+
+    AnalysisRunner(events, model=FailingModel(), profile=False).run([UploadedFile(pdf_path)])
+
+    model = StubModel()
+    AnalysisRunner(events, model=model, profile=False).run([UploadedFile(pdf_path)])
+
+    assert len(model.requests) == 1
@@ -0,0 +1,41 @@
+import pytest
+
+from utils.batch_planner import BatchPlanner
+
+
+def batch_costs(costs, ranges):
+    return [sum(costs[start:end]) for start, end in ranges]
+
+
+def test_pages_are_split_within_the_budget():
+    costs = [0.3] * 10
+
+    ranges = BatchPlanner.plan(costs, max_pages=20)
+
+    assert ranges == [(0, 2), (2, 5), (5, 7), (7, 10)]
+    assert all(cost <= 1.0 for cost in batch_costs(costs, ranges))
+
+
+def test_max_pages_limits_each_batch():
+    ranges = BatchPlanner.plan([0.01] * 10, max_pages=4)
+
+    assert ranges == [(0, 3), (3, 7), (7, 10)]
+
+
+def test_over_budget_page_gets_its_own_batch():
+    # 予算を超えるページがあっても、前後のページは1ページずつに分けない
+    costs = [0.1] * 5 + [2.0] + [0.1] * 5
+
+    ranges = BatchPlanner.plan(costs, max_pages=20)
+
+    assert ranges == [(0, 5), (5, 6), (6, 11)]
+
+
+@pytest.mark.parametrize('costs, expected', [
+    ([2.0], [(0, 1)]),
+    ([2.0, 0.1, 0.1], [(0, 1), (1, 3)]),
+    ([0.1, 0.1, 3.0, 1.5], [(0, 2), (2, 3), (3, 4)]),
+    ([], []),
+])
+def test_over_budget_pages_at_the_edges(costs, expected):
+    assert BatchPlanner.plan(costs, max_pages=20) == expected
@@ -0,0 +1,295 @@
+import datetime
+import sys
+import types
+
+import pytest
+
+from components.gemini_analyzer import GeminiAnalyzer
+from config import Config
+from conftest import StubModel
+from utils.context_cache import ContextCache, GenaiContextClient
+
+PROMPT = "図面を解析してください。" * 10
+
+
+class StubCachedContent:
+    """
+    作成されたキャッシュ（CachedContentの代わり）
+    """
+
+    def __init__(self, model_name, contents, ttl_seconds, display_name):
+        self.model_name = model_name
+        self.contents = contents
+        self.ttl_seconds = ttl_seconds
+        self.display_name = display_name
+        self.deleted = False
+
+
+class StubContextClient:
+    """
+    作成・削除を記録するコンテキストキャッシュのクライアント（fail=Trueなら作成に失敗する）
+    """
+
+    def __init__(self, tokens=5000, fail=False):
+        self.tokens = tokens
+        self.fail = fail
+        self.created = []
+        self.deleted = []
+
+    def create(self, model_name, contents, ttl_seconds, display_name):
+        if self.fail:
+            raise RuntimeError("CachedContent is not supported")
+        handle = StubCachedContent(model_name, contents, ttl_seconds, display_name)
+        self.created.append(handle)
+        return handle
+
+    def model_for(self, cached):
+        return StubModel(cached)
+
+    def token_count(self, cached):
+        return self.tokens
+
+    def delete(self, cached):
+        cached.deleted = True
+        self.deleted.append(cached)
+
+
+def make_cache(clock, events, client=None, min_tokens=10):
+    return ContextCache(
+        client or StubContextClient(), model_name='gemini-test', ttl_seconds=600,
+        min_tokens=min_tokens, events=events, clock=clock
+    )
+
+
+def test_creates_once_and_reuses(clock, events):
+    client = StubContextClient(tokens=5000)
+    cache = make_cache(clock, events, client)
+
+    first = cache.get([PROMPT])
+    second = cache.get([PROMPT])
+
+    assert first is second
+    assert len(client.created) == 1
+    assert client.created[0].model_name == 'gemini-test'
+    assert client.created[0].ttl_seconds == 600
+    assert first.model.cached is client.created[0]
+    assert cache.stats == {'created': 1, 'uses': 2, 'saved_tokens': 10000}
+
+
+def test_different_contents_use_different_caches(clock, events):
+    client = StubContextClient()
+    cache = make_cache(clock, events, client)
+
+    assert cache.get([PROMPT]) is not cache.get([PROMPT, "テキストページ"])
+    assert len(client.created) == 2
+
+
+def test_different_model_uses_a_different_key(clock, events):
+    cache = make_cache(clock, events)
+    other = ContextCache(StubContextClient(), model_name='gemini-other', events=events, clock=clock)
+
+    assert cache.make_key([PROMPT]) != other.make_key([PROMPT])
+
+
+def test_recreates_before_expiry(clock, events):
+    client = StubContextClient()
+    cache = make_cache(clock, events, client)
+    first = cache.get([PROMPT])
+
+    # 有効期限の9割までは同じキャッシュを使う
+    clock.advance(600 * 0.9 - 1)
+    assert cache.get([PROMPT]) is first
+
+    clock.advance(1)
+    second = cache.get([PROMPT])
+
+    assert second is not first
+    assert client.deleted == [first.handle]
+    assert len(client.created) == 2
+    assert cache.stats['created'] == 2
+
+
+def test_small_contents_are_not_cached(clock, events):
+    client = StubContextClient()
+    cache = make_cache(clock, events, client, min_tokens=len(PROMPT) + 1)
+
+    assert cache.get([PROMPT]) is None
+    assert cache.get([PROMPT]) is None
+    assert client.created == []
+    assert cache.stats == {'created': 0, 'uses': 0, 'saved_tokens': 0}
+
+
+def test_create_failure_falls_back_to_sending_contents(clock, events):
+    client = StubContextClient(fail=True)
+    cache = make_cache(clock, events, client)
+
+    assert cache.get([PROMPT]) is None
+    # 失敗した内容は作成を繰り返さない
+    assert cache.get([PROMPT]) is None
+    assert events.levels() == ['warning']
+    assert cache.stats['created'] == 0
+
+
+def test_close_deletes_created_caches(clock, events):
+    client = StubContextClient()
+    cache = make_cache(clock, events, client)
+    first = cache.get([PROMPT])
+    second = cache.get([PROMPT, "テキストページ"])
+
+    cache.close()
+
+    assert sorted(map(id, client.deleted)) == sorted([id(first.handle), id(second.handle)])
+    assert cache.get([PROMPT]) is not first
+
+
+def test_delete_failure_is_ignored(clock, events):
+    client = StubContextClient()
+    cache = make_cache(clock, events, client)
+    cache.get([PROMPT])
+
+    def _fail(cached):
+        raise RuntimeError("already expired")
+
+    client.delete = _fail
+    cache.close()
+
+
+def test_genai_client_uses_cached_content(monkeypatch):
+    calls = {}
+
+    class CachedContent:
+        usage_metadata = types.SimpleNamespace(total_token_count=4321)
+
+        @classmethod
+        def create(cls, **kwargs):
+            calls['create'] = kwargs
+            return cls()
+
+        def delete(self):
+            calls['delete'] = True
+
+    class GenerativeModel:
+        @classmethod
+        def from_cached_content(cls, cached):
+            calls['model_for'] = cached
+            return cls()
+
+    genai = types.ModuleType('google.generativeai')
+    genai.caching = types.SimpleNamespace(CachedContent=CachedContent)
+    genai.GenerativeModel = GenerativeModel
+    google = types.ModuleType('google')
+    google.generativeai = genai
+    monkeypatch.setitem(sys.modules, 'google', google)
+    monkeypatch.setitem(sys.modules, 'google.generativeai', genai)
+
+    client = GenaiContextClient()
+    cached = client.create('gemini-test', [PROMPT], 600, 'pdf-analyzer-test')
+
+    assert calls['create'] == {
+        'model': 'gemini-test',
+        'display_name': 'pdf-analyzer-test',
+        'contents': [PROMPT],
+        'ttl': datetime.timedelta(seconds=600),
+    }
+    assert isinstance(client.model_for(cached), GenerativeModel)
+    assert calls['model_for'] is cached
+    assert client.token_count(cached) == 4321
+    client.delete(cached)
+    assert calls['delete']
+
+
+@pytest.fixture
+def analyzer_config(monkeypatch):
+    monkeypatch.setattr(Config, 'CONTEXT_CACHE_ENABLED', True)
+    monkeypatch.setattr(Config, 'RESULT_CACHE_ENABLED', False)
+
+
+def test_analyzer_sends_only_the_batch_with_a_cached_context(analyzer_config, events):
+    model = StubModel()
+    client = StubContextClient()
+    analyzer = GeminiAnalyzer(model=model, events=events, context_client=client)
+    analyzer.context_cache.min_tokens = 0
+
+    assert analyzer.analyze_images(["1ページ目"], prompt=PROMPT) == "解析結果"
+    assert analyzer.analyze_images(["2ページ目"], prompt=PROMPT) == "解析結果"
+
+    # 共通の内容（プロンプト）は1回だけ登録し、各リクエストはバッチの内容だけを送信する
+    assert len(client.created) == 1
+    assert client.created[0].contents == [PROMPT]
+    assert model.requests == []
+    cached_model = analyzer.context_cache.get([PROMPT]).model
+    assert cached_model.requests == [["1ページ目"], ["2ページ目"]]
+
+
+def test_analyzer_falls_back_to_the_full_request(analyzer_config, events):
+    model = StubModel()
+    analyzer = GeminiAnalyzer(model=model, events=events, context_client=StubContextClient(fail=True))
+    analyzer.context_cache.min_tokens = 0
+
+    assert analyzer.analyze_images(["1ページ目"], prompt=PROMPT) == "解析結果"
+
+    assert model.requests == [[PROMPT, "1ページ目"]]
+    assert 'warning' in events.levels()
+
+
+def test_analyzer_without_context_client_does_not_cache(analyzer_config, events):
+    # テスト用のモデルを渡した場合は、クライアントも渡したときだけキャッシュを使う
+    analyzer = GeminiAnalyzer(model=StubModel(), events=events)
+
+    assert analyzer.context_cache is None
+
+
+def text_batch(batch_number, pages, images, page_texts):
+    return {
+        'file_name': 'set.pdf',
+        'batch_number': batch_number,
+        'total_batches': 2,
+        'pages': pages,
+        'images': images,
+        'page_texts': {page: page_texts[page] for page in pages if page in page_texts},
+        'file_page_texts': page_texts,
+    }
+
+
+FILE_TEXTS = {1: "特記仕様 " * 50, 3: "凡例 " * 50}
+
+
+def test_file_text_is_sent_once_with_a_cached_context(analyzer_config, events):
+    client = StubContextClient()
+    analyzer = GeminiAnalyzer(model=StubModel(), events=events, context_client=client)
+    analyzer.context_cache.min_tokens = 0
+
+    analyzer.analyze_batch(text_batch(1, [1, 2], ["2ページ目"], FILE_TEXTS))
+    analyzer.analyze_batch(text_batch(2, [3, 4], ["4ページ目"], FILE_TEXTS))
+
+    # テキストページはキャッシュにだけ含め、バッチでは見出しだけを送る
+    assert len(client.created) == 1
+    assert analyzer.context_cache.stats['uses'] == 2
+    assert client.created[0].contents[2:] == [
+        f"--- 1ページ（テキスト） ---\n{FILE_TEXTS[1]}",
+        f"--- 3ページ（テキスト） ---\n{FILE_TEXTS[3]}",
+    ]
+    cached_model = analyzer.context_cache.get(client.created[0].contents).model
+    assert cached_model.requests == [
+        ["--- 1ページ（テキスト：共通の内容に記載） ---", "2ページ目"],
+        ["--- 3ページ（テキスト：共通の内容に記載） ---", "4ページ目"],
+    ]
+
+
+@pytest.mark.parametrize('client, min_tokens', [
+    (StubContextClient(fail=True), 0),
+    (StubContextClient(), 10 ** 6),
+])
+def test_file_text_is_sent_only_in_its_batch_without_a_cache(analyzer_config, events, client, min_tokens):
+    model = StubModel()
+    analyzer = GeminiAnalyzer(model=model, events=events, context_client=client)
+    analyzer.context_cache.min_tokens = min_tokens
+
+    analyzer.analyze_batch(text_batch(1, [1, 2], ["2ページ目"], FILE_TEXTS))
+    analyzer.analyze_batch(text_batch(2, [3, 4], ["4ページ目"], FILE_TEXTS))
+
+    # キャッシュが無ければ共通の内容はプロンプトだけにし、テキストページはそのページのバッチでだけ送る
+    assert model.requests == [
+        [Config.ANALYSIS_PROMPT, f"--- 1ページ（テキスト） ---\n{FILE_TEXTS[1]}", "2ページ目"],
+        [Config.ANALYSIS_PROMPT, f"--- 3ページ（テキスト） ---\n{FILE_TEXTS[3]}", "4ページ目"],
+    ]
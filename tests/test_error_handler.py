@@ -0,0 +1,174 @@
+import time
+import types
+
+import pytest
+
+from config import Config
+from utils.error_handler import ERROR_FATAL, ERROR_PAYLOAD, ERROR_RETRYABLE, ErrorHandler
+
+
+class APIError(Exception):
+    """
+    google.api_core.exceptionsと同じくcode・detailsを持つ例外
+    """
+
+    def __init__(self, message, code=None, details=None):
+        super().__init__(message)
+        self.code = code
+        self.details = details
+
+
+class HTTPError(Exception):
+    """
+    requestsと同じくresponse（status_code・headers）を持つ例外
+    """
+
+    def __init__(self, message, status_code, headers=None):
+        super().__init__(message)
+        self.response = types.SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def retry_info(seconds, nanos=0):
+    return types.SimpleNamespace(retry_delay=types.SimpleNamespace(seconds=seconds, nanos=nanos))
+
+
+@pytest.fixture
+def handler(events):
+    handler = ErrorHandler(events)
+    handler.sleeps = []
+    handler.sleep = handler.sleeps.append
+    handler.random = lambda: 0.0
+    return handler
+
+
+@pytest.mark.parametrize('error, expected', [
+    (APIError("Request Entity Too Large", code=413), ERROR_PAYLOAD),
+    (APIError("Request payload size exceeds the limit", code=400), ERROR_PAYLOAD),
+    (APIError("The input token count exceeds the maximum", code=400), ERROR_PAYLOAD),
+    (APIError("Invalid argument", code=400), ERROR_FATAL),
+    (APIError("API key not valid", code=401), ERROR_FATAL),
+    (APIError("Permission denied", code=403), ERROR_FATAL),
+    (APIError("Model not found", code=404), ERROR_FATAL),
+    (APIError("Unknown client error", code=418), ERROR_FATAL),
+    (APIError("Request timeout", code=408), ERROR_RETRYABLE),
+    (APIError("Resource exhausted", code=429), ERROR_RETRYABLE),
+    (APIError("Internal error", code=500), ERROR_RETRYABLE),
+    (APIError("Service unavailable", code=503), ERROR_RETRYABLE),
+    (APIError("Unknown server error", code=520), ERROR_RETRYABLE),
+    (HTTPError("Bad gateway", 502), ERROR_RETRYABLE),
+    (HTTPError("Payload too large", 413), ERROR_PAYLOAD),
+    (HTTPError("Unauthorized", 401), ERROR_FATAL),
+    (ConnectionError("Connection reset"), ERROR_RETRYABLE),
+    (TimeoutError("Read timed out"), ERROR_RETRYABLE),
+    (ValueError("Invalid image"), ERROR_FATAL),
+    (TypeError("unexpected keyword"), ERROR_FATAL),
+    (KeyError('data'), ERROR_FATAL),
+    (AttributeError("'NoneType' object has no attribute 'text'"), ERROR_FATAL),
+    (RuntimeError("Unknown transport error"), ERROR_RETRYABLE),
+])
+def test_classify_error(error, expected):
+    assert ErrorHandler.classify_error(error) == expected
+
+
+@pytest.mark.parametrize('error, expected', [
+    (APIError("Resource exhausted", code=429, details=[retry_info(12, 500000000)]), 12.5),
+    (HTTPError("Too many requests", 429, headers={'Retry-After': '30'}), 30.0),
+    (HTTPError("Too many requests", 429, headers={'Retry-After': 'soon'}), None),
+    (APIError("Quota exceeded. Please retry in 7.25s.", code=429), 7.25),
+    (APIError("Service unavailable", code=503), None),
+])
+def test_retry_hint(error, expected):
+    assert ErrorHandler.retry_hint(error) == expected
+
+
+@pytest.mark.parametrize('attempt', [0, 1, 2, 3, 10])
+def test_backoff_delay_bounds(handler, attempt):
+    base_delay = 2
+    full = min(Config.RETRY_MAX_DELAY, base_delay * (2 ** attempt))
+
+    # ジッターは指数バックオフの0.5〜1倍
+    handler.random = lambda: 0.0
+    assert handler.backoff_delay(attempt, base_delay) == pytest.approx(full * 0.5)
+    handler.random = lambda: 1.0
+    assert handler.backoff_delay(attempt, base_delay) == pytest.approx(full)
+    assert handler.backoff_delay(attempt, base_delay) <= Config.RETRY_MAX_DELAY
+
+
+def test_backoff_delay_waits_at_least_the_retry_hint(handler):
+    error = APIError("Quota exceeded. Please retry in 20s.", code=429)
+
+    assert handler.backoff_delay(0, 2, error) == pytest.approx(20.0)
+    # 指数バックオフの方が長ければそちらを使う
+    handler.random = lambda: 1.0
+    assert handler.backoff_delay(5, 2, error) == pytest.approx(min(Config.RETRY_MAX_DELAY, 64))
+
+
+def test_backoff_delay_caps_the_retry_hint(handler):
+    error = APIError("Resource exhausted", code=429, details=[retry_info(3600)])
+
+    assert handler.backoff_delay(0, 2, error) == pytest.approx(Config.RETRY_MAX_DELAY)
+
+
+def test_random_and_sleep_are_per_instance(handler):
+    # 差し替えは他のインスタンスに影響しない
+    other = ErrorHandler(handler.events)
+
+    assert other.random is not handler.random
+    assert other.sleep is time.sleep
+
+
+def test_retries_retryable_errors_with_backoff(handler, events):
+    calls = []
+
+    def _func():
+        calls.append(len(calls))
+        if len(calls) < 3:
+            raise APIError("Service unavailable", code=503)
+        return "ok"
+
+    assert handler.retry_on_failure(_func, max_attempts=3, delay=2) == "ok"
+
+    assert len(calls) == 3
+    assert handler.sleeps == [pytest.approx(1.0), pytest.approx(2.0)]
+    assert events.levels() == ['warning', 'warning']
+
+
+def test_gives_up_after_max_attempts(handler, events):
+    def _func():
+        raise APIError("Resource exhausted", code=429)
+
+    with pytest.raises(APIError):
+        handler.retry_on_failure(_func, max_attempts=3, delay=2)
+
+    assert len(handler.sleeps) == 2
+    assert events.levels() == ['warning', 'warning', 'error']
+
+
+def test_fatal_errors_are_not_retried(handler, events):
+    calls = []
+
+    def _func():
+        calls.append(1)
+        raise APIError("API key not valid", code=401)
+
+    with pytest.raises(APIError):
+        handler.retry_on_failure(_func, max_attempts=3, delay=2)
+
+    assert len(calls) == 1
+    assert handler.sleeps == []
+    assert events.levels() == ['error']
+
+
+def test_payload_errors_are_raised_without_notice(handler, events):
+    calls = []
+
+    def _func():
+        calls.append(1)
+        raise APIError("Request Entity Too Large", code=413)
+
+    with pytest.raises(APIError):
+        handler.retry_on_failure(_func, max_attempts=3, delay=2)
+
+    assert len(calls) == 1
+    assert handler.sleeps == []
+    assert events.messages == []
@@ -0,0 +1,79 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from config import Config
+from utils.image_converter import ImageConverter
+
+
+def drawing(line_width: int, size=(7680, 4320), spacing=150) -> Image.Image:
+    """
+    白地に黒の格子を描いた大判の図面
+    """
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for x in range(0, size[0], spacing):
+        draw.line([(x, 0), (x, size[1])], fill='black', width=line_width)
+    for y in range(0, size[1], spacing):
+        draw.line([(0, y), (size[0], y)], fill='black', width=line_width)
+    return image
+
+
+def decode(encoded) -> Image.Image:
+    return Image.open(io.BytesIO(encoded['data']))
+
+
+@pytest.fixture
+def auto_encoding(monkeypatch):
+    monkeypatch.setattr(Config, 'IMAGE_ENCODING', 'auto')
+
+
+@pytest.mark.parametrize('line_width', [1, 3])
+def test_thin_lines_survive_line_art_encoding(auto_encoding, line_width):
+    # 縮小で薄いグレーになった細線も、送信する画像で消えない
+    resized = ImageConverter.resize_image_if_needed(drawing(line_width))
+    ink = np.asarray(resized.convert('L')) < Config.PAGE_INK_LEVEL
+    assert ImageConverter.classify_image_content(resized) == 'line_art'
+
+    encoded = ImageConverter.encode_for_upload(resized)
+    sent = decode(encoded)
+
+    assert encoded['mime_type'] == 'image/png'
+    assert sent.mode == '1'
+    sent_ink = np.asarray(sent.convert('L')) < Config.PAGE_INK_LEVEL
+    assert not np.any(ink & ~sent_ink)
+
+
+def test_bilevel_threshold_follows_the_background():
+    # 色の付いた用紙でも、背景は白・線は黒になる
+    image = Image.new('L', (400, 400), 235)
+    ImageDraw.Draw(image).line([(0, 200), (400, 200)], fill=0, width=2)
+
+    bilevel = np.asarray(ImageConverter.to_bilevel(image).convert('L'))
+
+    assert np.count_nonzero(bilevel == 0) == 800
+
+
+def test_faint_content_falls_back_to_grayscale():
+    # 背景に近い薄い描き込みは1bitにすると消えるため、グレースケールのまま送信する
+    image = Image.new('L', (400, 400), 255)
+    ImageDraw.Draw(image).rectangle([50, 50, 150, 150], fill=252)
+
+    reduced = ImageConverter.reduce_line_art(image)
+
+    assert reduced.mode == 'L'
+    assert reduced.getextrema() == (252, 255)
+
+
+def test_line_art_in_1bit_color_mode(monkeypatch):
+    monkeypatch.setattr(Config, 'IMAGE_ENCODING', 'png')
+    monkeypatch.setattr(Config, 'IMAGE_COLOR_MODE', '1bit')
+    resized = ImageConverter.resize_image_if_needed(drawing(1))
+
+    sent = decode(ImageConverter.encode_for_upload(resized))
+
+    assert sent.mode == '1'
+    ink = np.asarray(resized.convert('L')) < Config.PAGE_INK_LEVEL
+    assert not np.any(ink & (np.asarray(sent.convert('L')) >= Config.PAGE_INK_LEVEL))
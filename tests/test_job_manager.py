@@ -0,0 +1,63 @@
+import pytest
+
+from components import job_manager
+from components.job_manager import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobManager, JobStore
+
+
+class RecordingExecutor:
+    """
+    投入されたジョブを実行せずに記録するワーカープール
+    """
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args):
+        self.submitted.append((func, args))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.sqlite3'))
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = RecordingExecutor()
+    monkeypatch.setattr(JobManager, '_create_executor', lambda self: executor)
+    return executor
+
+
+def files(name):
+    return [{'name': name, 'path': f'/uploads/{name}', 'size': 1, 'file_hash': None}]
+
+
+def test_recovers_interrupted_jobs(store, executor):
+    # 前回のサーバー停止時に実行中・待機中だったジョブ
+    store.create('running', 'session-a', files('a.pdf'))
+    store.update('running', status=JOB_RUNNING, completed=1, total=3)
+    store.create('queued', 'session-b', files('b.pdf'))
+    store.create('done', 'session-a', files('c.pdf'))
+    store.update('done', status=JOB_DONE)
+    store.create('failed', 'session-a', files('d.pdf'))
+    store.update('failed', status=JOB_FAILED)
+
+    JobManager(store=store, workers=1)
+
+    assert executor.submitted == [
+        (job_manager.run_job, ('running',)),
+        (job_manager.run_job, ('queued',)),
+    ]
+    assert store.get('running')['status'] == JOB_QUEUED
+    assert store.get('done')['status'] == JOB_DONE
+    assert store.get('failed')['status'] == JOB_FAILED
+
+
+def test_interrupted_job_uploads_are_kept(store, executor):
+    store.create('running', 'session-a', files('a.pdf'))
+    store.update('running', status=JOB_RUNNING)
+
+    JobManager(store=store, workers=1)
+
+    # 再開したジョブのファイルはアップロード置き場の容量を超えても削除しない
+    assert job_manager.get_upload_store().in_use() == {'/uploads/a.pdf'}
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+from PyPDF2 import PdfReader
+
+from components.analysis_runner import AnalysisRunner
+from components.pdf_processor import PDFProcessor
+from config import Config
+from conftest import StubModel, UploadedFile
+
+
+def numbered_pages(count: int):
+    return [b"BT /F1 12 Tf 72 720 Td (Sheet %d) Tj ET" % page for page in range(1, count + 1)]
+
+
+@pytest.fixture
+def passthrough_config(runner_config, monkeypatch):
+    monkeypatch.setattr(Config, 'ANALYSIS_MODE', 'pdf')
+    monkeypatch.setattr(Config, 'MAX_PAGES_PER_BATCH', 4)
+
+
+def test_sends_page_range_pdfs_without_rendering(passthrough_config, events, make_pdf, monkeypatch):
+    pdf_path = make_pdf('specs.pdf', numbered_pages(10))
+    model = StubModel()
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("passthrough mode should not rasterize")
+
+    monkeypatch.setattr(PDFProcessor, '_render_pages', _fail)
+    results = AnalysisRunner(events, model=model, profile=False).run([UploadedFile(pdf_path)])
+
+    assert list(results) == ['specs.pdf']
+    assert len(model.requests) == 3
+
+    batches = []
+    for prompt, part in model.requests:
+        assert prompt == Config.ANALYSIS_PROMPT
+        assert part['mime_type'] == 'application/pdf'
+        reader = PdfReader(io.BytesIO(part['data']))
+        batches.append([int(page.extract_text().split()[-1]) for page in reader.pages])
+
+    # バッチは並行して送信されるため、先頭ページの順に並べて確認する
+    # 各バッチは4ページ以下の連続したページで、全ページが重複・欠落なく送信される
+    batches.sort()
+    assert all(1 <= len(pages) <= 4 for pages in batches)
+    assert [page for pages in batches for page in pages] == list(range(1, 11))
+
+
+def test_single_batch_file(passthrough_config, events, make_pdf):
+    pdf_path = make_pdf('small.pdf', numbered_pages(3))
+    model = StubModel()
+
+    AnalysisRunner(events, model=model, profile=False).run([UploadedFile(pdf_path)])
+
+    assert len(model.requests) == 1
+    assert len(PdfReader(io.BytesIO(model.requests[0][1]['data'])).pages) == 3
+
+
+def test_scanned_pdf_falls_back_to_raster(passthrough_config, events, make_pdf):
+    # テキストレイヤーの無いPDFは画像化する
+    pdf_path = make_pdf('scan.pdf', [b"0 0 m 100 100 l S"] * 3)
+
+    assert PDFProcessor(events).choose_analysis_mode(pdf_path, 10000, 3) == 'raster'
+
+
+def test_oversized_pdf_falls_back_to_raster(passthrough_config, events, make_pdf, monkeypatch):
+    pdf_path = make_pdf('specs.pdf', numbered_pages(10))
+    processor = PDFProcessor(events)
+    assert processor.choose_analysis_mode(pdf_path, 10 * 1024 * 1024, 10) == 'pdf'
+
+    # 1バッチあたりのおおよそのサイズが上限を超えるPDFは画像化する
+    monkeypatch.setattr(Config, 'PDF_PASSTHROUGH_MAX_BYTES', 1024 * 1024)
+
+    assert processor.choose_analysis_mode(pdf_path, 10 * 1024 * 1024, 10) == 'raster'
+
+
+def test_raster_mode_is_the_default(runner_config, events, make_pdf):
+    pdf_path = make_pdf('specs.pdf', numbered_pages(2))
+
+    assert PDFProcessor(events).choose_analysis_mode(pdf_path, 10000, 2) == 'raster'
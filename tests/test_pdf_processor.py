@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from components.pdf_processor import PDFProcessor
+from config import Config
+from conftest import UploadedFile, drawing_stream, text_stream
+
+pytest.importorskip('pdfplumber')
+
+
+@pytest.fixture
+def processor(events):
+    return PDFProcessor(events)
+
+
+def test_text_page_candidates_skip_drawings(processor, make_pdf):
+    pdf_path = make_pdf('set.pdf', [drawing_stream(), text_stream(), b"", drawing_stream(20)])
+
+    # 図形の多いページ・空のページはpdfplumberで解析しない（図形の少ないページは候補に残す）
+    assert processor.find_text_page_candidates(pdf_path) == [2, 4]
+
+
+def test_strings_are_not_counted_as_operators(processor, make_pdf):
+    text = b"BT /F1 10 Tf 50 700 Td (S S S f f re B b) Tj ET\n" * 60
+    pdf_path = make_pdf('spec.pdf', [text])
+
+    assert processor.find_text_page_candidates(pdf_path) == [1]
+
+
+def test_classify_pages(processor, make_pdf):
+    pdf_path = make_pdf('set.pdf', [drawing_stream(), text_stream(), drawing_stream(20)])
+
+    page_texts = processor.classify_pages(pdf_path)
+
+    assert list(page_texts) == [2]
+    assert page_texts[2].startswith("Specification line 0")
+
+
+def test_classification_is_cached_by_file_hash(processor, make_pdf, monkeypatch):
+    pdf_path = make_pdf('set.pdf', [drawing_stream(), text_stream()])
+    first = processor.classify_pages(pdf_path, 'hash-1')
+
+    def _fail(pdf_path):
+        raise AssertionError("cached classification should not parse the PDF")
+
+    monkeypatch.setattr(processor, 'find_text_page_candidates', _fail)
+
+    assert processor.classify_pages(pdf_path, 'hash-1') == first
+    assert processor.result_cache.stats()['hits'] == 0
+
+
+def test_spooled_files_are_kept_until_the_run_ends(events, make_pdf, monkeypatch):
+    # 置き場の容量が1ファイル分しか無くても、同じ解析で保存したファイルは削除しない
+    first = make_pdf('a.pdf', [text_stream()])
+    second = make_pdf('b.pdf', [text_stream(40)])
+    monkeypatch.setattr(Config, 'UPLOAD_STORE_MAX_BYTES', os.path.getsize(first) + 1)
+    processor = PDFProcessor(events)
+
+    stored = [processor.spool(UploadedFile(path)) for path in (first, second)]
+
+    assert all(os.path.exists(upload.path) for upload in stored)
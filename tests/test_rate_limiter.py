@@ -0,0 +1,191 @@
+import threading
+import time
+
+import pytest
+
+from utils import rate_limiter
+from utils.rate_limiter import RateLimiter
+
+
+def make_limiter(tmp_path, clock, requests_per_minute=None, tokens_per_minute=None) -> RateLimiter:
+    return RateLimiter(
+        str(tmp_path / 'rate_limit.sqlite3'),
+        requests_per_minute,
+        tokens_per_minute,
+        poll_interval=0.5,
+        clock=clock,
+        sleep=clock.sleep
+    )
+
+
+def test_requests_are_paced_per_minute(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, requests_per_minute=6)
+
+    # 1分分（6件）はすぐに送信でき、7件目は1件分が補充される10秒後
+    for _ in range(6):
+        assert not limiter.acquire('a', 0)['waited']
+    grant = limiter.acquire('a', 0)
+
+    assert grant['waited']
+    assert grant['wait_seconds'] == pytest.approx(10.0)
+    assert max(clock.sleeps) <= 0.5
+
+
+def test_tokens_are_paced_per_minute(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, tokens_per_minute=600)
+
+    assert not limiter.acquire('a', 500)['waited']
+    # 残り100トークン、不足する200トークンは毎秒10トークンの補充で20秒
+    grant = limiter.acquire('a', 300)
+
+    assert grant['wait_seconds'] == pytest.approx(20.0)
+
+
+def test_request_larger_than_the_bucket_waits_for_a_full_bucket(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, tokens_per_minute=600)
+
+    limiter.acquire('a', 600)
+    grant = limiter.acquire('a', 10000)
+
+    assert grant['wait_seconds'] == pytest.approx(60.0)
+
+
+def test_bucket_refills_while_idle(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, requests_per_minute=2)
+    limiter.acquire('a', 0)
+    limiter.acquire('a', 0)
+
+    clock.advance(60)
+
+    assert not limiter.acquire('a', 0)['waited']
+    assert not limiter.acquire('a', 0)['waited']
+
+
+def test_no_limits_never_wait(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock)
+
+    for _ in range(100):
+        assert not limiter.acquire('a', 10 ** 6)['waited']
+    assert clock.sleeps == []
+
+
+def test_settle_charges_tokens_used_beyond_the_estimate(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, tokens_per_minute=600)
+
+    limiter.acquire('a', 100)
+    # 見積もり100に対して実際は400：残りは200
+    limiter.settle(100, 400)
+    grant = limiter.acquire('a', 300)
+
+    assert grant['wait_seconds'] == pytest.approx(10.0)
+
+
+def test_settle_refunds_an_overestimate(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, tokens_per_minute=600)
+
+    limiter.acquire('a', 500)
+    limiter.settle(500, 100)
+
+    assert not limiter.acquire('a', 500)['waited']
+
+
+def test_settle_without_token_limit_is_ignored(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, requests_per_minute=60)
+
+    limiter.settle(100, 10 ** 6)
+
+    assert not limiter.acquire('a', 10 ** 6)['waited']
+
+
+def test_sessions_take_turns(tmp_path, clock, monkeypatch):
+    # スレッドが共通の偽の時計を速く進めるため、確認の遅れたスレッドの要求を取り除かない
+    monkeypatch.setattr(rate_limiter, 'TICKET_TIMEOUT', 10 ** 6)
+    limiter = make_limiter(tmp_path, clock, requests_per_minute=1)
+    # 1件分を使い切り、以降は60秒に1件だけ送信できる状態にする
+    limiter.acquire('warmup', 0)
+
+    clock_lock = threading.Lock()
+    all_queued = threading.Event()
+
+    def _sleep(seconds: float) -> None:
+        # すべての要求が並ぶまで時計を止め、並んだ後は全スレッド共通の時計を進める
+        all_queued.wait()
+        with clock_lock:
+            clock.advance(seconds)
+        time.sleep(0.001)
+
+    limiter.sleep = _sleep
+    # 送信できた順（待った秒数, セッション）
+    granted = []
+    granted_lock = threading.Lock()
+
+    def _acquire(session_id: str) -> None:
+        grant = limiter.acquire(session_id, 0)
+        with granted_lock:
+            granted.append((grant['wait_seconds'], session_id))
+
+    threads = []
+    # 大きなジョブの3件が先に並び、その後に小さなジョブの1件が並ぶ
+    for session_id in ['large', 'large', 'large', 'small']:
+        thread = threading.Thread(target=_acquire, args=(session_id,), daemon=True)
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 5
+        while limiter.stats()['queue_depth'] < len(threads):
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+
+    stats = limiter.stats()
+    assert stats['queue_depth'] == 4
+    assert stats['sessions'] == 2
+
+    all_queued.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    # 小さなジョブは大きなジョブの1件の後に送信され、残りの3件を待たない
+    assert [session_id for _, session_id in sorted(granted)] == ['large', 'small', 'large', 'large']
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_cancelled_wait_leaves_the_queue(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, requests_per_minute=1)
+    limiter.acquire('a', 0)
+
+    def _interrupt(seconds: float) -> None:
+        raise KeyboardInterrupt
+
+    limiter.sleep = _interrupt
+    with pytest.raises(KeyboardInterrupt):
+        limiter.acquire('b', 0)
+
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_stale_ticket_rejoins_in_its_place(tmp_path, clock):
+    limiter = make_limiter(tmp_path, clock, requests_per_minute=1)
+    with limiter._connect() as conn:
+        conn.execute(
+            "INSERT INTO rate_tickets (session_id, tokens, enqueued, heartbeat) VALUES ('a', 0, ?, ?)",
+            (clock(), clock())
+        )
+        ticket = conn.execute("SELECT MAX(id) FROM rate_tickets").fetchone()[0]
+
+    # 確認が遅れて取り除かれた要求も、並び直して送信できる
+    clock.advance(rate_limiter.TICKET_TIMEOUT + 1)
+    with limiter._connect() as conn:
+        conn.execute("DELETE FROM rate_tickets")
+
+    assert limiter._try_grant(ticket, 'a', 0) is None
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_queue_shared_between_instances(tmp_path, clock):
+    # 同じデータベースを使う別のインスタンス（別のワーカープロセス）とも上限を共有する
+    first = make_limiter(tmp_path, clock, requests_per_minute=1)
+    second = make_limiter(tmp_path, clock, requests_per_minute=1)
+
+    first.acquire('a', 0)
+    grant = second.acquire('b', 0)
+
+    assert grant['wait_seconds'] == pytest.approx(60.0)
@@ -0,0 +1,28 @@
+import pytest
+
+from utils.revision_store import document_key
+
+
+@pytest.mark.parametrize('file_name, expected', [
+    ('図面_revB.pdf', '図面'),
+    ('図面 Rev.C.pdf', '図面'),
+    ('図面-R2.pdf', '図面'),
+    ('図面_r12.pdf', '図面'),
+    ('図面_改訂3.pdf', '図面'),
+    ('図面_改A.pdf', '図面'),
+    ('/uploads/Plan-rev.10.pdf', 'plan'),
+])
+def test_revision_marks_are_removed(file_name, expected):
+    assert document_key(file_name) == expected
+
+
+@pytest.mark.parametrize('file_name, expected', [
+    ('preview.pdf', 'preview'),
+    ('構造図_RC.pdf', '構造図_rc'),
+    ('sheet-rev.pdf', 'sheet-rev'),
+    ('floor_r.pdf', 'floor_r'),
+    ('review.pdf', 'review'),
+    ('改訂3.pdf', '改訂3'),
+])
+def test_ordinary_names_are_kept(file_name, expected):
+    assert document_key(file_name) == expected
@@ -0,0 +1,116 @@
+import math
+from typing import List, Optional, Tuple
+from config import Config
+
+# Geminiは画像を768x768のタイル単位で課金する（1タイル=258トークン）
+IMAGE_TILE_SIZE = 768
+TOKENS_PER_IMAGE_TILE = 258
+
+
+class BatchPlanner:
+    @staticmethod
+    def estimate_image_tokens(width: int, height: int) -> int:
+        """
+        画像1枚あたりの入力トークン数を見積もる
+        """
+        tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+        return max(1, tiles) * TOKENS_PER_IMAGE_TILE
+
+    @staticmethod
+    def estimate_image_bytes(width: int, height: int) -> int:
+        """
+        エンコード後の画像サイズを画素数から見積もる
+        """
+        return int(width * height * Config.ESTIMATED_BYTES_PER_PIXEL)
+
+    @staticmethod
+    def page_cost(tokens: int, payload_bytes: int) -> float:
+        """
+        トークン予算・送信サイズ予算に対する割合のうち大きい方をページのコストとする（1.0で予算いっぱい）
+        """
+        return max(
+            tokens / Config.BATCH_TOKEN_BUDGET,
+            payload_bytes / Config.BATCH_PAYLOAD_BUDGET
+        )
+
+    @staticmethod
+    def plan(
+        costs: List[float],
+        max_pages: int = Config.MAX_PAGES_PER_BATCH,
+        max_cost: float = 1.0
+    ) -> List[Tuple[int, int]]:
+        """
+        ページごとのコストから、ページ順を保ったままバッチを分割し、(開始index, 終了index+1)のリストを返す
+        1ページで予算を超えるページは単独のバッチとし、その前後のページはそれぞれ通常どおり分割する
+        """
+        ranges = []
+        start = 0
+        for index, cost in enumerate(costs):
+            if cost > max_cost:
+                ranges.extend(BatchPlanner._plan_run(costs, start, index, max_pages, max_cost))
+                ranges.append((index, index + 1))
+                start = index + 1
+        ranges.extend(BatchPlanner._plan_run(costs, start, len(costs), max_pages, max_cost))
+        return ranges
+
+    @staticmethod
+    def _plan_run(
+        costs: List[float],
+        start: int,
+        end: int,
+        max_pages: int,
+        max_cost: float
+    ) -> List[Tuple[int, int]]:
+        """
+        costs[start:end]（各ページが予算内）を分割する
+        バッチ数はページ数・コストの上限を満たす最小数とし、各バッチのコストがなるべく均等になるよう分割する
+        """
+        run_costs = costs[start:end]
+        page_count = len(run_costs)
+        if page_count == 0:
+            return []
+
+        total_cost = sum(run_costs)
+        batch_count = max(
+            math.ceil(page_count / max_pages),
+            math.ceil(total_cost / max_cost) if max_cost > 0 else 1,
+            1
+        )
+
+        while batch_count < page_count:
+            ranges = BatchPlanner._split_evenly(run_costs, batch_count)
+            if ranges is not None and all(
+                run_end - run_start <= max_pages and sum(run_costs[run_start:run_end]) <= max_cost
+                for run_start, run_end in ranges
+            ):
+                return [(start + run_start, start + run_end) for run_start, run_end in ranges]
+            batch_count += 1
+
+        return [(i, i + 1) for i in range(start, end)]
+
+    @staticmethod
+    def _split_evenly(costs: List[float], batch_count: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        累積コストがbatch_count等分の境界を越えた位置で区切る（各バッチ最低1ページ）
+        """
+        page_count = len(costs)
+        if batch_count > page_count:
+            return None
+
+        total_cost = sum(costs)
+        ranges = []
+        start = 0
+        accumulated = 0.0
+        for batch_index in range(1, batch_count):
+            target = total_cost * batch_index / batch_count
+            # 残りのバッチに最低1ページずつ残す
+            last_allowed = page_count - (batch_count - batch_index)
+            end = start + 1
+            accumulated += costs[start]
+            while end < last_allowed and accumulated + costs[end] / 2 <= target:
+                accumulated += costs[end]
+                end += 1
+            ranges.append((start, end))
+            start = end
+        ranges.append((start, page_count))
+        return ranges
@@ -0,0 +1,149 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from config import Config
+from utils.event_sink import EventSink, get_event_sink
+
+
+class GenaiContextClient:
+    """
+    google.generativeaiのCachedContentでモデル側のキャッシュを作成・削除するクライアント
+    （テストでは同じメソッドを持つスタブに差し替える）
+    """
+
+    def create(self, model_name: str, contents: List[Any], ttl_seconds: int, display_name: str) -> Any:
+        import google.generativeai as genai
+        return genai.caching.CachedContent.create(
+            model=model_name,
+            display_name=display_name,
+            contents=contents,
+            ttl=datetime.timedelta(seconds=ttl_seconds)
+        )
+
+    def model_for(self, cached: Any) -> Any:
+        """
+        キャッシュを前提として送信するモデル
+        """
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(cached)
+
+    def token_count(self, cached: Any) -> int:
+        return cached.usage_metadata.total_token_count
+
+    def delete(self, cached: Any) -> None:
+        cached.delete()
+
+
+class CachedContext:
+    """
+    作成済みのキャッシュ（送信に使うモデルとキャッシュしたトークン数）
+    """
+
+    def __init__(self, handle: Any, model: Any, tokens: int, created: float):
+        self.handle = handle
+        self.model = model
+        self.tokens = tokens
+        self.created = created
+
+
+class ContextCache:
+    """
+    ジョブ内のすべてのバッチで共通する送信内容（解析プロンプト・ファイル共通の内容）を
+    モデル側のキャッシュとして1回だけ登録し、各バッチはキャッシュを参照して差分だけを送信する
+    キャッシュはモデル名と内容から決まるため、プロンプトやモデルを変更すると別のキャッシュになる
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        model_name: str = Config.GEMINI_MODEL,
+        ttl_seconds: int = Config.CONTEXT_CACHE_TTL,
+        min_tokens: int = Config.CONTEXT_CACHE_MIN_TOKENS,
+        events: Optional[EventSink] = None,
+        clock=time.monotonic
+    ):
+        self.client = client
+        self.model_name = model_name
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.events = events or get_event_sink()
+        self.clock = clock
+        # 内容のキー → 作成済みのキャッシュ（作成しない・できなかった内容はNone）
+        self._entries: Dict[str, Optional[CachedContext]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'uses': 0, 'saved_tokens': 0}
+
+    def make_key(self, contents: List[Any]) -> str:
+        """
+        モデル名と共通の内容から決まるキャッシュのキー
+        """
+        payload = json.dumps(
+            {'model': self.model_name, 'contents': contents}, sort_keys=True, ensure_ascii=False, default=repr
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def estimate_tokens(contents: List[Any]) -> int:
+        """
+        キャッシュできる量かどうかの目安（テキストの文字数）
+        """
+        return sum(len(content) for content in contents if isinstance(content, str))
+
+    def get(self, contents: List[Any], count: bool = True) -> Optional[CachedContext]:
+        """
+        共通の内容のキャッシュを返す（未作成なら作成する）
+        最小トークン数に満たない・作成に失敗した場合はNoneを返し、呼び出し側は内容をそのまま送信する
+        countがFalseの参照（送信前の確認）は利用回数に数えない
+        """
+        key = self.make_key(contents)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry.created >= self.ttl_seconds * 0.9:
+                # 有効期限が近いキャッシュは作り直す
+                self._delete(entry)
+                del self._entries[key]
+
+            if key not in self._entries:
+                entry = None
+                if self.estimate_tokens(contents) >= self.min_tokens:
+                    entry = self._create(key, contents)
+                self._entries[key] = entry
+
+            if entry is not None and count:
+                self.stats['uses'] += 1
+                self.stats['saved_tokens'] += entry.tokens
+            return entry
+
+    def _create(self, key: str, contents: List[Any]) -> Optional[CachedContext]:
+        try:
+            handle = self.client.create(
+                self.model_name, contents, self.ttl_seconds, f"pdf-analyzer-{key[:16]}"
+            )
+            entry = CachedContext(
+                handle, self.client.model_for(handle), self.client.token_count(handle), self.clock()
+            )
+            self.stats['created'] += 1
+            return entry
+        except Exception as e:
+            self.events.warning(f"共通の送信内容をキャッシュできなかったため、毎回送信します: {str(e)}")
+            return None
+
+    def _delete(self, entry: CachedContext) -> None:
+        try:
+            self.client.delete(entry.handle)
+        except Exception:
+            # 期限切れで削除済みの場合等は無視する
+            pass
+
+    def close(self) -> None:
+        """
+        作成したキャッシュをすべて削除する（ジョブの終了時）
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry is not None:
+                    self._delete(entry)
+            self._entries.clear()
@@ -1,70 +1,192 @@
-import streamlit as st
+import random
+import re
 import time
-from typing import Optional, Any, Callable
+from typing import Optional, Any, Callable, Dict
 from config import Config
+from utils.event_sink import EventSink, get_event_sink
+from utils.metrics import get_metrics
+
+# エラーの分類
+ERROR_RETRYABLE = 'retryable'  # 時間をおけば成功する可能性がある（レート制限・一時的な障害）
+ERROR_FATAL = 'fatal'          # 同じリクエストを再送しても失敗する（引数・認証の誤り等）
+ERROR_PAYLOAD = 'payload'      # 送信内容が大きすぎる（内容を分割すれば成功する可能性がある）
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+FATAL_STATUS_CODES = {400, 401, 403, 404, 405, 409, 412, 422}
+PAYLOAD_STATUS_CODES = {413}
+
+# 400エラーのうち、送信サイズ・トークン数の超過を示すメッセージ
+PAYLOAD_ERROR_PATTERN = re.compile(
+    r"payload|too large|request size|exceeds the maximum|input token|token count|too many (images|pages)",
+    re.IGNORECASE
+)
+# エラーメッセージ中の再試行までの待ち時間（例: "Please retry in 12.5s"）
+RETRY_HINT_PATTERN = re.compile(r"retry in ([0-9.]+)\s*s", re.IGNORECASE)
+
+# 再送しても結果が変わらない（プログラム・データの誤りによる）例外
+FATAL_EXCEPTION_TYPES = (TypeError, ValueError, KeyError, AttributeError, NotImplementedError)
+
 
 class ErrorHandler:
-    @staticmethod
-    def handle_error(error: Exception, custom_message: Optional[str] = None) -> None:
+    def __init__(self, events: Optional[EventSink] = None):
+        self.events = events or get_event_sink()
+        # テストで待ち時間・乱数を差し替えられるようにする
+        self.sleep = time.sleep
+        self.random = random.random
+
+    def handle_error(self, error: Exception, custom_message: Optional[str] = None) -> None:
         """
-        エラーをStreamlitで表示
+        エラーを通知先（既定ではStreamlit）へ表示
         """
         error_msg = custom_message or Config.ERROR_MESSAGES.get(
             'processing_error', '処理中にエラーが発生しました: {}'
         ).format(str(error))
-        st.error(error_msg)
+        self.events.error(error_msg)
+
+    @staticmethod
+    def status_code(error: Exception) -> Optional[int]:
+        """
+        例外からHTTPステータスコードを取り出す（google.api_core.exceptionsのcode、requestsのresponse等）
+        """
+        code = getattr(error, 'code', None)
+        if isinstance(code, int):
+            return code
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+        if isinstance(status, int):
+            return status
+        return None
+
+    @staticmethod
+    def classify_error(error: Exception) -> str:
+        """
+        例外を再試行可能（ERROR_RETRYABLE）・再試行不要（ERROR_FATAL）・
+        送信サイズ超過（ERROR_PAYLOAD）に分類する
+        """
+        code = ErrorHandler.status_code(error)
+        message = str(error)
+
+        if code in PAYLOAD_STATUS_CODES:
+            return ERROR_PAYLOAD
+        if code in RETRYABLE_STATUS_CODES:
+            return ERROR_RETRYABLE
+        if code in FATAL_STATUS_CODES:
+            if code == 400 and PAYLOAD_ERROR_PATTERN.search(message):
+                return ERROR_PAYLOAD
+            return ERROR_FATAL
+        if code is not None:
+            return ERROR_RETRYABLE if code >= 500 else ERROR_FATAL
+
+        if isinstance(error, (ConnectionError, TimeoutError)):
+            return ERROR_RETRYABLE
+        if isinstance(error, FATAL_EXCEPTION_TYPES):
+            return ERROR_FATAL
+        # 分類できない例外（ネットワーク系のライブラリ固有の例外等）は再試行する
+        return ERROR_RETRYABLE
 
     @staticmethod
+    def retry_hint(error: Exception) -> Optional[float]:
+        """
+        サーバーが指定した再試行までの待ち時間（秒）を取り出す（指定が無ければNone）
+        """
+        # gRPCのRetryInfo（google.api_core.exceptionsのdetailsに含まれる）
+        for detail in getattr(error, 'details', None) or []:
+            retry_delay = getattr(detail, 'retry_delay', None)
+            if retry_delay is not None:
+                return retry_delay.seconds + retry_delay.nanos / 1e9
+
+        # HTTPのRetry-Afterヘッダー
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        retry_after = headers.get('Retry-After') if hasattr(headers, 'get') else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+        match = RETRY_HINT_PATTERN.search(str(error))
+        if match:
+            return float(match.group(1))
+        return None
+
+    def backoff_delay(self, attempt: int, base_delay: float, error: Optional[Exception] = None) -> float:
+        """
+        attempt回目（0始まり）の失敗後の待ち時間
+        指数バックオフにジッター（0.5〜1倍）をかけ、サーバーの指定があればそれ以上待つ
+        """
+        delay = min(Config.RETRY_MAX_DELAY, base_delay * (2 ** attempt))
+        delay *= 0.5 + self.random() / 2
+        hint = self.retry_hint(error) if error is not None else None
+        if hint is not None:
+            delay = max(delay, min(hint, Config.RETRY_MAX_DELAY))
+        return delay
+
     def retry_on_failure(
+        self,
         func: Callable,
         max_attempts: int = Config.MAX_RETRY_ATTEMPTS,
-        delay: int = Config.RETRY_DELAY,
-        custom_error_msg: Optional[str] = None
+        delay: float = Config.RETRY_DELAY,
+        custom_error_msg: Optional[str] = None,
+        metric_labels: Optional[Dict[str, Any]] = None
     ) -> Any:
         """
-        失敗時に自動リトライを行う
+        失敗時に自動リトライを行う（再試行可能なエラーのみ、指数バックオフで待機）
+        送信サイズ超過のエラーは再送せず、通知もせずにそのまま送出する（呼び出し元で分割して再送する）
+        各試行はretry_attemptスパンとして計測する（metric_labelsはスパンに付ける属性）
         """
-        last_error = None
+        metrics = get_metrics()
 
         for attempt in range(max_attempts):
             try:
-                return func()
+                with metrics.span('retry_attempt', attempt=attempt + 1, **(metric_labels or {})) as span:
+                    try:
+                        return func()
+                    except Exception as e:
+                        span['error_class'] = self.classify_error(e)
+                        raise
             except Exception as e:
-                last_error = e
-                if attempt < max_attempts - 1:
-                    st.warning(f"エラーが発生しました。再試行中... ({attempt + 1}/{max_attempts})")
-                    time.sleep(delay)
+                error_class = self.classify_error(e)
+                if error_class == ERROR_PAYLOAD:
+                    raise
+                if error_class == ERROR_RETRYABLE and attempt < max_attempts - 1:
+                    wait = self.backoff_delay(attempt, delay, e)
+                    self.events.warning(
+                        f"エラーが発生しました。{wait:.1f}秒後に再試行します... ({attempt + 1}/{max_attempts})"
+                    )
+                    self.sleep(wait)
+                    continue
+
+                if error_class == ERROR_FATAL:
+                    error_msg = custom_error_msg or f"再試行できないエラーが発生しました: {str(e)}"
                 else:
                     error_msg = custom_error_msg or f"最大試行回数に達しました: {str(e)}"
-                    ErrorHandler.handle_error(e, error_msg)
-                    raise e
+                self.handle_error(e, error_msg)
+                raise
 
         return None
 
-    @staticmethod
-    def validate_api_key() -> bool:
+    def validate_api_key(self) -> bool:
         """
         API キーの存在を確認
         """
         if not Config.GEMINI_API_KEY:
-            st.error(Config.ERROR_MESSAGES['no_api_key'])
+            self.events.error(Config.ERROR_MESSAGES['no_api_key'])
             return False
         return True
 
-    @staticmethod
-    def validate_file_type(file_name: str) -> bool:
+    def validate_file_type(self, file_name: str) -> bool:
         """
         ファイルタイプの検証
         """
         file_extension = file_name.lower().split('.')[-1]
         if file_extension not in Config.SUPPORTED_FILE_TYPES:
-            st.error(Config.ERROR_MESSAGES['unsupported_file'])
+            self.events.error(Config.ERROR_MESSAGES['unsupported_file'])
             return False
         return True
 
-    @staticmethod
-    def show_page_error(page_num: int) -> None:
+    def show_page_error(self, page_num: int) -> None:
         """
         ページ読み取りエラーの表示
         """
-        st.warning(Config.ERROR_MESSAGES['page_read_error'].format(page_num))
\ No newline at end of file
+        self.events.warning(Config.ERROR_MESSAGES['page_read_error'].format(page_num))
@@ -0,0 +1,235 @@
+import json
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+
+class EventSink:
+    """
+    処理中のメッセージ・進捗・途中結果の通知先（既定では何もしない）
+    PDFProcessorやGeminiAnalyzerはStreamlitを直接呼ばず、このインターフェース経由で通知する
+    """
+
+    def info(self, message: str) -> None:
+        pass
+
+    def warning(self, message: str) -> None:
+        pass
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        pass
+
+    def caption(self, message: str) -> None:
+        pass
+
+    def progress(self, completed: int, total: int, message: str = "") -> None:
+        pass
+
+    def clear_progress(self) -> None:
+        pass
+
+    def partial_result(self, file_name: str, text: str) -> None:
+        pass
+
+    def clear_partial_results(self) -> None:
+        pass
+
+    def attach_thread(self) -> None:
+        """
+        ワーカースレッドの開始時に呼ばれる（スレッドから通知するための準備）
+        """
+        pass
+
+
+class ConsoleSink(EventSink):
+    """
+    標準エラー出力へ表示する通知先（コマンドライン用）
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def _write(self, label: str, message: str) -> None:
+        with self._lock:
+            print(f"[{label}] {message}", file=self.stream, flush=True)
+
+    def info(self, message: str) -> None:
+        self._write("INFO", message)
+
+    def warning(self, message: str) -> None:
+        self._write("WARN", message)
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        self._write("ERROR", message if detail is None else f"{message}\n{detail}")
+
+    def caption(self, message: str) -> None:
+        self._write("STAT", message)
+
+    def progress(self, completed: int, total: int, message: str = "") -> None:
+        self._write("PROGRESS", f"{completed}/{total} {message}".rstrip())
+
+
+class JsonlSink(EventSink):
+    """
+    通知を1行1イベントのJSONとしてファイルへ追記する通知先（途中結果は出力しない）
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, event: str, **fields: Any) -> None:
+        record = {'time': time.time(), 'event': event, **fields}
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def info(self, message: str) -> None:
+        self._write('info', message=message)
+
+    def warning(self, message: str) -> None:
+        self._write('warning', message=message)
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        self._write('error', message=message, detail=detail)
+
+    def caption(self, message: str) -> None:
+        self._write('caption', message=message)
+
+    def progress(self, completed: int, total: int, message: str = "") -> None:
+        self._write('progress', completed=completed, total=total, message=message)
+
+
+class MultiSink(EventSink):
+    """
+    複数の通知先へ同じ通知を送る
+    """
+
+    def __init__(self, sinks: List[EventSink]):
+        self.sinks = sinks
+
+    def info(self, message: str) -> None:
+        for sink in self.sinks:
+            sink.info(message)
+
+    def warning(self, message: str) -> None:
+        for sink in self.sinks:
+            sink.warning(message)
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        for sink in self.sinks:
+            sink.error(message, detail)
+
+    def caption(self, message: str) -> None:
+        for sink in self.sinks:
+            sink.caption(message)
+
+    def progress(self, completed: int, total: int, message: str = "") -> None:
+        for sink in self.sinks:
+            sink.progress(completed, total, message)
+
+    def clear_progress(self) -> None:
+        for sink in self.sinks:
+            sink.clear_progress()
+
+    def partial_result(self, file_name: str, text: str) -> None:
+        for sink in self.sinks:
+            sink.partial_result(file_name, text)
+
+    def clear_partial_results(self) -> None:
+        for sink in self.sinks:
+            sink.clear_partial_results()
+
+    def attach_thread(self) -> None:
+        for sink in self.sinks:
+            sink.attach_thread()
+
+
+class StreamlitSink(EventSink):
+    """
+    Streamlitの画面へ表示する通知先（スクリプト実行スレッドで生成すること）
+    """
+
+    def __init__(self):
+        import streamlit as st
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        self._st = st
+        self._script_ctx = get_script_run_ctx()
+        self._lock = threading.Lock()
+        self._progress_bar = None
+        self._progress_text = None
+        self._placeholders: Dict[str, object] = {}
+
+    def info(self, message: str) -> None:
+        self._st.info(message)
+
+    def warning(self, message: str) -> None:
+        self._st.warning(message)
+
+    def error(self, message: str, detail: Optional[str] = None) -> None:
+        self._st.error(message)
+        if detail:
+            self._st.code(detail)
+
+    def caption(self, message: str) -> None:
+        self._st.caption(message)
+
+    def progress(self, completed: int, total: int, message: str = "") -> None:
+        with self._lock:
+            if self._progress_bar is None:
+                self._progress_bar = self._st.progress(0)
+                self._progress_text = self._st.empty()
+            self._progress_bar.progress(completed / total if total else 0)
+            if message:
+                self._progress_text.text(message)
+
+    def clear_progress(self) -> None:
+        with self._lock:
+            if self._progress_bar is not None:
+                self._progress_bar.empty()
+                self._progress_text.empty()
+            self._progress_bar = None
+            self._progress_text = None
+
+    def partial_result(self, file_name: str, text: str) -> None:
+        with self._lock:
+            if file_name not in self._placeholders:
+                self._placeholders[file_name] = self._st.empty()
+            self._placeholders[file_name].markdown(text)
+
+    def clear_partial_results(self) -> None:
+        with self._lock:
+            for placeholder in self._placeholders.values():
+                placeholder.empty()
+            self._placeholders = {}
+
+    def attach_thread(self) -> None:
+        """
+        生成元スクリプトの実行コンテキストを引き継ぎ、ワーカースレッドからもst.*を呼べるようにする
+        """
+        if self._script_ctx is not None:
+            from streamlit.runtime.scriptrunner import add_script_run_ctx
+            add_script_run_ctx(threading.current_thread(), self._script_ctx)
+
+
+_default_sink: Optional[EventSink] = None
+
+
+def set_event_sink(sink: Optional[EventSink]) -> None:
+    """
+    このプロセスの既定の通知先を設定（Noneで既定に戻す）
+    """
+    global _default_sink
+    _default_sink = sink
+
+
+def get_event_sink() -> EventSink:
+    """
+    既定の通知先を取得（未設定の場合はStreamlitへ表示する）
+    """
+    if _default_sink is None:
+        return StreamlitSink()
+    return _default_sink
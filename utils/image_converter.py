@@ -1,35 +1,232 @@
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
 import io
-from typing import List, Optional, Union
-import streamlit as st
-from pdf2image import convert_from_bytes
+import math
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple, Union
+from PyPDF2 import PdfReader
 from config import Config
+from utils.event_sink import get_event_sink
 
 class ImageConverter:
     @staticmethod
-    def pdf_to_images(pdf_bytes: bytes, dpi: int = Config.IMAGE_DPI) -> List[Image.Image]:
+    def pdf_to_images(
+        pdf_path: str,
+        dpi: int = Config.IMAGE_DPI,
+        first_page: Optional[int] = None,
+        last_page: Optional[int] = None
+    ) -> List[Image.Image]:
         """
-        PDFバイトデータを画像のリストに変換
+        PDFファイルを画像のリストに変換（first_page/last_pageで範囲指定可、1始まり）
         """
         try:
-            images = convert_from_bytes(pdf_bytes, dpi=dpi)
-            return images
+            return ImageConverter.render_page_range(pdf_path, dpi, first_page, last_page)
         except Exception as e:
-            st.error(f"PDFの画像変換中にエラーが発生しました: {str(e)}")
+            get_event_sink().error(f"PDFの画像変換中にエラーが発生しました: {str(e)}")
             return []
 
     @staticmethod
-    def image_to_bytes(image: Image.Image, format: str = 'PNG') -> bytes:
+    def render_page_range(
+        pdf_path: str,
+        dpi: int = Config.IMAGE_DPI,
+        first_page: Optional[int] = None,
+        last_page: Optional[int] = None,
+        size: Optional[Tuple[Optional[int], Optional[int]]] = None
+    ) -> List[Image.Image]:
         """
-        PIL Imageをバイトデータに変換
+        PDFの指定範囲を画像化（例外はそのまま送出するため、ワーカースレッドからも利用可能）
+        sizeを指定するとDPIではなく出力ピクセル数で直接レンダリングする
+        （ディスク上のファイルをpopplerへ直接渡すため、PDFの内容をメモリへ読み込まない）
+        """
+        # 画面の表示だけでは使わないため、初めて画像化するときに読み込む
+        from pdf2image import convert_from_path
+
+        return convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            size=size
+        )
+
+    @staticmethod
+    def get_pdf_page_sizes(pdf_path: str) -> Dict[int, Tuple[float, float]]:
+        """
+        各ページのレンダリングされるサイズ（ポイント、回転を考慮）を{ページ番号: (幅, 高さ)}で返す
+        pdftoppmは既定でMediaBoxを描画するため、CropBoxではなくMediaBoxの大きさを使う
+        """
+        reader = PdfReader(pdf_path)
+        page_sizes = {}
+        for page_number, page in enumerate(reader.pages, 1):
+            width = float(page.mediabox.width)
+            height = float(page.mediabox.height)
+            if int(page.get('/Rotate', 0) or 0) % 180 == 90:
+                width, height = height, width
+            page_sizes[page_number] = (width, height)
+        return page_sizes
+
+    @staticmethod
+    def fit_render_size(
+        page_size: Tuple[float, float],
+        dpi: int = Config.IMAGE_DPI,
+        max_width: int = Config.MAX_IMAGE_WIDTH,
+        max_height: int = Config.MAX_IMAGE_HEIGHT
+    ) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        """
+        dpiでレンダリングするとmax_width/max_heightを超えるページについて、
+        resize_image_if_neededと同じ縮小後サイズで直接レンダリングするためのsizeを返す（超えない場合はNone）
+        """
+        width = page_size[0] / 72 * dpi
+        height = page_size[1] / 72 * dpi
+        if width <= max_width and height <= max_height:
+            return None
+
+        # 制約となる辺だけを指定し、もう一方は縦横比から決める
+        if max_width / width <= max_height / height:
+            return (max_width, None)
+        return (None, max_height)
+
+    @staticmethod
+    def estimate_output_size(
+        page_size: Tuple[float, float],
+        dpi: int = Config.IMAGE_DPI,
+        max_width: int = Config.MAX_IMAGE_WIDTH,
+        max_height: int = Config.MAX_IMAGE_HEIGHT
+    ) -> Tuple[int, int]:
+        """
+        ページをdpiでレンダリングし、最大サイズに収めた後の画素数（幅, 高さ）を返す
+        """
+        width = page_size[0] / 72 * dpi
+        height = page_size[1] / 72 * dpi
+        ratio = min(1.0, max_width / width, max_height / height)
+        return int(width * ratio), int(height * ratio)
+
+    @staticmethod
+    def get_pdf_page_count(pdf_path: str) -> int:
+        """
+        PDFをラスタライズせずにページ数を取得
+        """
+        from pdf2image import pdfinfo_from_path
+
+        try:
+            info = pdfinfo_from_path(pdf_path)
+            return int(info.get('Pages', 0))
+        except Exception as e:
+            get_event_sink().error(f"PDFの情報取得中にエラーが発生しました: {str(e)}")
+            return 0
+
+    @staticmethod
+    def image_to_bytes(image: Image.Image, format: str = 'PNG', **save_options) -> bytes:
+        """
+        PIL Imageをバイトデータに変換（save_optionsはPIL.Image.saveにそのまま渡す）
         """
         img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format=format)
+        image.save(img_byte_arr, format=format, **save_options)
         img_byte_arr = img_byte_arr.getvalue()
         return img_byte_arr
 
     @staticmethod
-    def resize_image_if_needed(image: Image.Image, max_width: int = 1920, max_height: int = 1080) -> Image.Image:
+    def to_bilevel(image: Image.Image, margin: int = Config.BILEVEL_BACKGROUND_MARGIN) -> Image.Image:
+        """
+        1bitに変換する（誤差拡散のディザリングは小さな寸法文字の周りに点を散らすため、しきい値で白黒にする）
+        しきい値は背景（最も多い明るさ）よりmarginだけ暗い値とし、縮小で薄いグレーになった細線も黒として残す
+        """
+        gray = image.convert('L')
+        threshold = ImageConverter.background_level(gray) - margin
+        return gray.point(lambda value: 255 if value > threshold else 0, mode='1')
+
+    @staticmethod
+    def background_level(gray: Image.Image) -> int:
+        """
+        グレースケール画像の背景の明るさ（明るい側で最も多い値）
+        """
+        histogram = gray.histogram()
+        return max(range(128, 256), key=lambda value: histogram[value])
+
+    @staticmethod
+    def reduce_line_art(image: Image.Image) -> Image.Image:
+        """
+        線画を1bitに変換し、インク量が保てない場合（背景に近い薄い描き込みが消える等）はグレースケールを返す
+        """
+        gray = image.convert('L')
+        bilevel = ImageConverter.to_bilevel(gray)
+
+        # インク量は背景からの暗さの合計（背景と黒の差を1画素分とする）
+        background = ImageConverter.background_level(gray)
+        darkness = np.clip(background - np.asarray(gray, dtype=np.float32), 0, None)
+        ink = darkness.sum() / max(background, 1)
+        kept = np.count_nonzero(~np.asarray(bilevel, dtype=bool))
+        if kept < ink * Config.BILEVEL_MIN_INK_RETAINED:
+            return gray
+        return bilevel
+
+    @staticmethod
+    def classify_image_content(image: Image.Image) -> str:
+        """
+        画像の内容を判定して 'line_art'（白黒の線画）/'gray'（無彩色）/'color' のいずれかを返す
+        """
+        sample = image.convert('RGB')
+        sample.thumbnail((512, 512))
+
+        # RGB各チャンネルの差が小さければ無彩色とみなす
+        r, g, b = sample.split()
+        colorfulness = max(
+            ImageStat.Stat(ImageChops.difference(r, g)).mean[0],
+            ImageStat.Stat(ImageChops.difference(g, b)).mean[0],
+        )
+        if colorfulness > Config.IMAGE_COLOR_THRESHOLD:
+            return 'color'
+
+        # ほぼ黒と白だけで構成されていれば線画とみなす
+        histogram = sample.convert('L').histogram()
+        total = sum(histogram)
+        extremes = sum(histogram[:64]) + sum(histogram[192:])
+        if total and extremes / total >= Config.IMAGE_LINE_ART_RATIO:
+            return 'line_art'
+        return 'gray'
+
+    @staticmethod
+    def encode_for_upload(image: Image.Image) -> Dict[str, Any]:
+        """
+        Gemini APIへ送信する画像をConfig.IMAGE_ENCODINGに従ってエンコードし、{'mime_type', 'data'}を返す
+        """
+        encoding = Config.IMAGE_ENCODING
+        if encoding == 'auto':
+            content = ImageConverter.classify_image_content(image)
+            if content == 'line_art':
+                # 線画は1bit PNGにすると細線を残したまま大幅に小さくなる
+                return {
+                    'mime_type': 'image/png',
+                    'data': ImageConverter.image_to_bytes(ImageConverter.reduce_line_art(image), 'PNG', optimize=True),
+                }
+            if content == 'gray':
+                image = image.convert('L')
+            encoding = Config.IMAGE_AUTO_LOSSY_FORMAT
+        elif Config.IMAGE_COLOR_MODE == 'gray':
+            image = image.convert('L')
+        elif Config.IMAGE_COLOR_MODE == '1bit':
+            image = ImageConverter.reduce_line_art(image)
+
+        if encoding == 'jpeg':
+            if image.mode not in ('L', 'RGB'):
+                image = image.convert('RGB')
+            data = ImageConverter.image_to_bytes(image, 'JPEG', quality=Config.JPEG_QUALITY, optimize=True)
+            return {'mime_type': 'image/jpeg', 'data': data}
+        if encoding == 'webp':
+            if image.mode not in ('L', 'RGB'):
+                image = image.convert('RGB')
+            data = ImageConverter.image_to_bytes(image, 'WEBP', quality=Config.WEBP_QUALITY)
+            return {'mime_type': 'image/webp', 'data': data}
+        return {
+            'mime_type': 'image/png',
+            'data': ImageConverter.image_to_bytes(image, 'PNG', optimize=True),
+        }
+
+    @staticmethod
+    def resize_image_if_needed(
+        image: Image.Image,
+        max_width: int = Config.MAX_IMAGE_WIDTH,
+        max_height: int = Config.MAX_IMAGE_HEIGHT
+    ) -> Image.Image:
         """
         画像が大きすぎる場合はリサイズ
         """
@@ -43,6 +240,118 @@ class ImageConverter:
 
         return image
 
+    @staticmethod
+    def layout_limits() -> Tuple[int, int]:
+        """
+        レンダリング・読み込み時の最大サイズ（'crop'/'tile'では切り取り・分割に使う画素を残すため大きくする）
+        """
+        if Config.IMAGE_LAYOUT_MODE == 'fit':
+            return Config.MAX_IMAGE_WIDTH, Config.MAX_IMAGE_HEIGHT
+        scale = max(1.0, Config.LAYOUT_RENDER_SCALE)
+        return int(Config.MAX_IMAGE_WIDTH * scale), int(Config.MAX_IMAGE_HEIGHT * scale)
+
+    @staticmethod
+    def crop_margins(
+        image: Image.Image,
+        ink_level: int = Config.PAGE_INK_LEVEL,
+        min_ink_ratio: float = Config.CROP_MIN_INK_RATIO,
+        padding_ratio: float = Config.CROP_PADDING_RATIO
+    ) -> Image.Image:
+        """
+        インク（ink_levelより暗い画素）を含む範囲の外側の余白を切り取る（インクが無い場合はそのまま返す）
+        """
+        ink = np.asarray(image.convert('L'), dtype=np.uint8) < ink_level
+        rows = np.flatnonzero(ink.sum(axis=1) > ink.shape[1] * min_ink_ratio)
+        columns = np.flatnonzero(ink.sum(axis=0) > ink.shape[0] * min_ink_ratio)
+        if not len(rows) or not len(columns):
+            return image
+
+        top, bottom = rows[0], rows[-1] + 1
+        left, right = columns[0], columns[-1] + 1
+        pad_y = int((bottom - top) * padding_ratio)
+        pad_x = int((right - left) * padding_ratio)
+        box = (
+            max(0, left - pad_x), max(0, top - pad_y),
+            min(image.width, right + pad_x), min(image.height, bottom + pad_y),
+        )
+        if box == (0, 0, image.width, image.height):
+            return image
+        return image.crop(box)
+
+    @staticmethod
+    def fit_pixel_budget(image: Image.Image, pixel_budget: int) -> Image.Image:
+        """
+        画素数がpixel_budgetを超える画像を縦横比を保って縮小
+        """
+        pixels = image.width * image.height
+        if pixels <= pixel_budget:
+            return image
+        ratio = math.sqrt(pixel_budget / pixels)
+        size = (max(1, int(image.width * ratio)), max(1, int(image.height * ratio)))
+        return image.resize(size, Image.Resampling.LANCZOS)
+
+    @staticmethod
+    def tile_grid(width: int, height: int, tile_count: int) -> Tuple[int, int]:
+        """
+        tile_count枚以下で、部分画像がなるべく正方形に近くなる（行数, 列数）
+        """
+        best = (1, 1)
+        best_score = None
+        for rows in range(1, tile_count + 1):
+            columns = tile_count // rows
+            # 部分画像の縦横比の歪み（1に近いほどよい）
+            aspect = (width / columns) / (height / rows)
+            score = abs(math.log(aspect))
+            if best_score is None or score < best_score:
+                best, best_score = (rows, columns), score
+        return best
+
+    @staticmethod
+    def split_into_tiles(
+        image: Image.Image,
+        pixel_budget: int = Config.TILE_PIXEL_BUDGET,
+        max_tiles: int = Config.TILE_MAX_TILES,
+        overlap: float = Config.TILE_OVERLAP
+    ) -> Tuple[List[Image.Image], Tuple[int, int]]:
+        """
+        画像を、それぞれpixel_budget以下の画素数になる重なりのある部分画像に分割し、
+        （左上から行ごとの順の部分画像, (行数, 列数)）を返す
+        max_tiles枚で足りない場合は、各部分画像をpixel_budgetに収まるよう縮小する
+        """
+        width, height = image.size
+        tile_count = min(max(1, max_tiles), math.ceil(width * height * (1 + overlap) ** 2 / pixel_budget))
+        rows, columns = ImageConverter.tile_grid(width, height, tile_count)
+        if rows * columns == 1:
+            return [ImageConverter.fit_pixel_budget(image, pixel_budget)], (1, 1)
+
+        tile_width = math.ceil(width / columns * (1 + overlap)) if columns > 1 else width
+        tile_height = math.ceil(height / rows * (1 + overlap)) if rows > 1 else height
+        tiles = []
+        for row in range(rows):
+            top = round((height - tile_height) * row / (rows - 1)) if rows > 1 else 0
+            for column in range(columns):
+                left = round((width - tile_width) * column / (columns - 1)) if columns > 1 else 0
+                tile = image.crop((left, top, left + tile_width, top + tile_height))
+                tiles.append(ImageConverter.fit_pixel_budget(tile, pixel_budget))
+        return tiles, (rows, columns)
+
+    @staticmethod
+    def layout_page(image: Image.Image) -> Tuple[List[Image.Image], Tuple[int, int]]:
+        """
+        Config.IMAGE_LAYOUT_MODEに従ってページ画像を送信用の画像（1枚または部分画像）にし、
+        （画像のリスト, (行数, 列数)）を返す
+        """
+        mode = Config.IMAGE_LAYOUT_MODE
+        if mode == 'fit':
+            return [ImageConverter.resize_image_if_needed(image)], (1, 1)
+
+        cropped = ImageConverter.crop_margins(image)
+        if mode == 'tile':
+            ink = np.asarray(cropped.convert('L'), dtype=np.uint8) < Config.PAGE_INK_LEVEL
+            if ink.mean() >= Config.TILE_MIN_INK_RATIO:
+                return ImageConverter.split_into_tiles(cropped)
+        return [ImageConverter.resize_image_if_needed(cropped)], (1, 1)
+
     @staticmethod
     def process_uploaded_image(uploaded_file) -> Optional[Image.Image]:
         """
@@ -50,19 +359,26 @@ class ImageConverter:
         """
         try:
             image = Image.open(uploaded_file)
-            image = ImageConverter.resize_image_if_needed(image)
+            image = ImageConverter.resize_image_if_needed(image, *ImageConverter.layout_limits())
             return image
         except Exception as e:
-            st.error(f"画像の読み込み中にエラーが発生しました: {str(e)}")
+            get_event_sink().error(f"画像の読み込み中にエラーが発生しました: {str(e)}")
             return None
 
     @staticmethod
     def batch_images(images: List[Image.Image], batch_size: int = Config.MAX_PAGES_PER_BATCH) -> List[List[Image.Image]]:
         """
-        画像リストをバッチに分割
+        画像リストをバッチに分割（batch_size以下で、各バッチの枚数がなるべく均等になるように分割）
         """
+        if not images:
+            return []
+
+        batch_count = -(-len(images) // batch_size)
+        base, extra = divmod(len(images), batch_count)
         batches = []
-        for i in range(0, len(images), batch_size):
-            batch = images[i:i + batch_size]
-            batches.append(batch)
-        return batches
\ No newline at end of file
+        start = 0
+        for i in range(batch_count):
+            end = start + base + (1 if i < extra else 0)
+            batches.append(images[start:end])
+            start = end
+        return batches
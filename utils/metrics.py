@@ -0,0 +1,272 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+from config import Config
+
+# Prometheusのメトリクス名の接頭辞
+METRIC_PREFIX = 'pdf_analyzer'
+
+# 段階ごとに合計する数値属性（Prometheusのカウンターとして出力する）
+COUNTED_ATTRIBUTES = (
+    'pages', 'bytes', 'raw_bytes', 'encoded_bytes',
+    'prompt_tokens', 'candidates_tokens', 'total_tokens', 'cached_tokens',
+)
+
+_metrics_lock = threading.Lock()
+_metrics: Optional["MetricsRecorder"] = None
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+# profile_runで計測中の区間（ワーカースレッドのプロファイルを集める）
+_profile_lock = threading.Lock()
+_active_profile: Optional["_RunProfile"] = None
+_worker_state = threading.local()
+
+
+def get_metrics() -> "MetricsRecorder":
+    """
+    プロセス共通の計測レコーダーを取得
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRecorder(
+                Config.METRICS_LOG_PATH if Config.METRICS_ENABLED else None,
+                Config.METRICS_PROMETHEUS_DIR if Config.METRICS_ENABLED else None
+            )
+        return _metrics
+
+
+class MetricsRecorder:
+    """
+    処理段階（スパン）ごとの所要時間・バイト数・トークン数を集計する
+    スパンは1行1件のJSONとしてログファイルへ追記し、集計値はPrometheusのテキスト形式で書き出せる
+    """
+
+    def __init__(
+        self,
+        log_path: Optional[str] = None,
+        prometheus_dir: Optional[str] = None,
+        log_max_bytes: int = Config.METRICS_LOG_MAX_BYTES
+    ):
+        self.log_path = log_path
+        self.prometheus_dir = prometheus_dir
+        self.log_max_bytes = log_max_bytes
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+
+        for path in (os.path.dirname(log_path) if log_path else None, prometheus_dir):
+            if path:
+                os.makedirs(path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """
+        with文の区間を1スパンとして記録する
+        返される辞書に属性（pages・bytes・トークン数等）を追加すると一緒に記録される
+        例外で抜けた場合はerrorにエラーの種類を記録する
+        """
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **attributes)
+
+    def record(self, stage: str, seconds: float, **attributes: Any) -> None:
+        """
+        1スパン分の計測値を集計し、ログへ出力する
+        """
+        with self._lock:
+            totals = self._stages.setdefault(stage, {'count': 0, 'errors': 0, 'seconds': 0.0})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            if attributes.get('error'):
+                totals['errors'] += 1
+            for key in COUNTED_ATTRIBUTES:
+                value = attributes.get(key)
+                if isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+
+            if self.log_path:
+                record = {
+                    'time': time.time(),
+                    'stage': stage,
+                    'seconds': round(seconds, 6),
+                    'pid': os.getpid(),
+                    'thread': threading.current_thread().name,
+                    **attributes,
+                }
+                self._rotate_log()
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def _rotate_log(self) -> None:
+        """
+        ログがlog_max_bytesを超えていれば.1へ移す（以前の.1は置き換える）
+        """
+        try:
+            if os.path.getsize(self.log_path) < self.log_max_bytes:
+                return
+            os.replace(self.log_path, self.log_path + ".1")
+        except FileNotFoundError:
+            # 初回、または他のプロセスが移した直後
+            pass
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        段階ごとの集計値のコピーを返す
+        """
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self._stages.items()}
+
+    @staticmethod
+    def diff(
+        after: Dict[str, Dict[str, float]], before: Dict[str, Dict[str, float]]
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        2つのスナップショットの差（その間に記録された分）を返す
+        """
+        result = {}
+        for stage, totals in after.items():
+            previous = before.get(stage, {})
+            delta = {key: value - previous.get(key, 0) for key, value in totals.items()}
+            if delta['count']:
+                result[stage] = delta
+        return result
+
+    def to_prometheus(self) -> str:
+        """
+        集計値をPrometheusのテキスト形式で返す
+        """
+        stages = self.snapshot()
+        pid = os.getpid()
+        lines = []
+
+        def _metric(name: str, help_text: str, key: str) -> None:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for stage, totals in sorted(stages.items()):
+                if key in totals:
+                    lines.append(
+                        f'{METRIC_PREFIX}_{name}{{stage="{stage}",pid="{pid}"}} {totals[key]:g}'
+                    )
+
+        _metric('stage_calls_total', "Number of spans recorded per stage.", 'count')
+        _metric('stage_errors_total', "Number of spans that ended with an exception.", 'errors')
+        _metric('stage_seconds_total', "Total wall time spent per stage.", 'seconds')
+        for key in COUNTED_ATTRIBUTES:
+            _metric(f'stage_{key}_total', f"Total {key.replace('_', ' ')} processed per stage.", key)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self) -> Optional[str]:
+        """
+        node_exporterのtextfileコレクター向けに、プロセスごとの.promファイルを書き出す
+        （書き出し先が未設定の場合は何もしない）
+        """
+        if not self.prometheus_dir:
+            return None
+
+        path = os.path.join(self.prometheus_dir, f"{METRIC_PREFIX}_{os.getpid()}.prom")
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        # 読み取り途中のファイルを見せないよう、書き終えてから置き換える
+        os.replace(temp_path, path)
+        return path
+
+
+class _RunProfile:
+    """
+    profile_run 1回分の、ワーカースレッドで計測したプロファイルの集まり
+    """
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.profilers: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def add(self, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            self.profilers.append(profiler)
+
+
+def profile_worker(func: F) -> F:
+    """
+    ワーカースレッドで実行する関数を包み、profile_runの計測中であれば
+    その呼び出しをcProfileで計測して計測中の区間のプロファイルへ加える
+    （cProfileは有効にしたスレッドの呼び出ししか記録しないため、画像化・API呼び出し等の入口に付ける）
+    """
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        run = _active_profile
+        if (run is None or threading.get_ident() == run.thread_id
+                or getattr(_worker_state, 'profiling', False)):
+            return func(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        _worker_state.profiling = True
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _worker_state.profiling = False
+            run.add(profiler)
+    return wrapper  # type: ignore[return-value]
+
+
+@contextlib.contextmanager
+def profile_run(label: str, directory: str = Config.PROFILE_DIR) -> Iterator[None]:
+    """
+    with文の区間をcProfileとtracemallocで計測し、
+    {label}.prof（pstats形式）と{label}.txt（上位の関数・メモリ確保箇所）を保存する
+    cProfileは呼び出し元スレッドに加え、profile_workerで包んだワーカースレッドの処理を計測して合算する
+    （同じプロセスで計測区間が重なった場合、ワーカースレッドの計測は後から始めた区間に加える）
+    """
+    global _active_profile
+    os.makedirs(directory, exist_ok=True)
+    profiler = cProfile.Profile()
+    run = _RunProfile()
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(Config.PROFILE_TRACEMALLOC_FRAMES)
+
+    with _profile_lock:
+        previous_profile, _active_profile = _active_profile, run
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _profile_lock:
+            _active_profile = previous_profile
+        memory_snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+        stats = pstats.Stats(profiler)
+        for worker_profiler in run.profilers:
+            stats.add(worker_profiler)
+
+        base_path = os.path.join(directory, label)
+        stats.dump_stats(base_path + ".prof")
+        with open(base_path + ".txt", 'w', encoding='utf-8') as f:
+            f.write(f"peak traced memory: {peak / 1024 / 1024:.1f} MB\n")
+            f.write(f"profiled worker calls: {len(run.profilers)}\n\n")
+            f.write("== top allocations ==\n")
+            for stat in memory_snapshot.statistics('lineno')[:Config.PROFILE_TOP_N]:
+                f.write(f"{stat}\n")
+            f.write("\n== cumulative time ==\n")
+            stats.stream = f
+            stats.sort_stats('cumulative').print_stats(Config.PROFILE_TOP_N)
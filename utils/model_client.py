@@ -0,0 +1,22 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+from config import Config
+
+_model_lock = threading.Lock()
+_models: Dict[Tuple[str, str], Any] = {}
+
+
+def get_generative_model(model_name: Optional[str] = None) -> Any:
+    """
+    プロセス共通のGeminiモデルを取得（APIの設定とモデルの作成は、APIキー・モデル名ごとに最初の1回だけ行う）
+    google.generativeaiは初めて必要になったときに読み込む
+    """
+    api_key = Config.GEMINI_API_KEY
+    model_name = model_name or Config.GEMINI_MODEL
+    with _model_lock:
+        key = (api_key, model_name)
+        if key not in _models:
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+            _models[key] = genai.GenerativeModel(model_name)
+        return _models[key]
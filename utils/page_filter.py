@@ -0,0 +1,108 @@
+import numpy as np
+from PIL import Image
+from typing import List, Optional, Union
+from config import Config
+
+# 知覚ハッシュ（pHash）：HASH_SAMPLE_SIZE四方に縮小した画像のDCT低周波成分HASH_SIZE四方から作る
+HASH_SAMPLE_SIZE = 32
+HASH_SIZE = 8
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """
+    DCT-II の変換行列
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT_MATRIX = _dct_matrix(HASH_SAMPLE_SIZE)
+
+
+class PageFilter:
+    """
+    ページ画像（縮小版）から空白ページと、先に現れたページとほぼ同じページを見つける
+    重複の判定は、知覚ハッシュのハミング距離で候補を絞り込んでから、縮小画像の差分で確認する
+    """
+
+    def __init__(
+        self,
+        blank_ink_ratio: float = Config.PAGE_BLANK_INK_RATIO,
+        ink_level: int = Config.PAGE_INK_LEVEL,
+        duplicate_max_distance: int = Config.PAGE_DUPLICATE_MAX_DISTANCE,
+        duplicate_max_change: float = Config.PAGE_DUPLICATE_MAX_CHANGE,
+        compare_size: int = Config.PAGE_FILTER_COMPARE_SIZE
+    ):
+        self.blank_ink_ratio = blank_ink_ratio
+        self.ink_level = ink_level
+        self.duplicate_max_distance = duplicate_max_distance
+        self.duplicate_max_change = duplicate_max_change
+        self.compare_size = compare_size
+
+        # 残したページの番号・ハッシュ・比較用の縮小画像（インクの濃さ）
+        self._pages: List[int] = []
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._inks: List[np.ndarray] = []
+
+    def ink_coverage(self, image: Image.Image) -> float:
+        """
+        インク（ink_levelより暗い画素）がページに占める割合
+        """
+        gray = np.asarray(image.convert('L'), dtype=np.uint8)
+        return float(np.count_nonzero(gray < self.ink_level)) / gray.size
+
+    def ink_intensity(self, image: Image.Image) -> np.ndarray:
+        """
+        compare_size四方に縮小した、画素ごとのインクの濃さ（白=0）
+        """
+        gray = image.convert('L').resize((self.compare_size, self.compare_size), Image.BOX)
+        return 255 - np.asarray(gray, dtype=np.int16)
+
+    @staticmethod
+    def perceptual_hash(image: Image.Image) -> int:
+        """
+        64ビットの知覚ハッシュ（DCT低周波成分が中央値より大きいかどうか）
+        """
+        small = image.convert('L').resize((HASH_SAMPLE_SIZE, HASH_SAMPLE_SIZE), Image.LANCZOS)
+        pixels = np.asarray(small, dtype=np.float64)
+        low = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+        # 直流成分（全体の明るさ）を除いて中央値と比較する
+        bits = low > np.median(low[1:])
+        bits[0] = False
+        return int(np.packbits(bits).view('>u8')[0])
+
+    def check(self, page: int, image: Image.Image) -> Optional[Union[str, int]]:
+        """
+        ページを判定し、残す場合はNone、空白なら'blank'、重複なら元のページ番号を返す
+        """
+        if self.ink_coverage(image) < self.blank_ink_ratio:
+            return 'blank'
+
+        page_hash = self.perceptual_hash(image)
+        ink = self.ink_intensity(image)
+
+        if self._pages:
+            # 残したページ全てとのハミング距離をまとめて計算し、近いものだけ画素で確認する
+            xor = self._hashes ^ np.uint64(page_hash)
+            distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            for index in np.flatnonzero(distances <= self.duplicate_max_distance):
+                if self._change_ratio(ink, self._inks[index]) <= self.duplicate_max_change:
+                    return self._pages[index]
+
+        self._pages.append(page)
+        self._hashes = np.append(self._hashes, np.uint64(page_hash))
+        self._inks.append(ink)
+        return None
+
+    @staticmethod
+    def _change_ratio(ink: np.ndarray, other: np.ndarray) -> float:
+        """
+        2つのページのインクの濃さの差（どちらかのページにあるインクの量に対する割合）
+        """
+        total = np.maximum(ink, other).sum()
+        if not total:
+            return 0.0
+        return float(np.abs(ink - other).sum() / total)
@@ -0,0 +1,115 @@
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from collections import deque
+import threading
+from utils.image_converter import ImageConverter
+from utils.metrics import profile_worker
+from config import Config
+
+T = TypeVar('T')
+R = TypeVar('R')
+RenderSize = Tuple[Optional[int], Optional[int]]
+
+_executor_lock = threading.Lock()
+_page_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_page_executor() -> ThreadPoolExecutor:
+    """
+    ページレンダリング用のプロセス共通スレッドプールを取得
+    （各スレッドはpdftoppmの子プロセスを待つだけなので、GILの影響を受けない）
+    """
+    global _page_executor
+    with _executor_lock:
+        if _page_executor is None:
+            _page_executor = ThreadPoolExecutor(
+                max_workers=max(1, Config.RENDER_WORKERS),
+                thread_name_prefix="pdf-render"
+            )
+        return _page_executor
+
+
+class ParallelRenderer:
+    @staticmethod
+    def split_pages(
+        pages: List[int],
+        workers: int,
+        min_pages: int = Config.RENDER_MIN_PAGES_PER_WORKER,
+        render_sizes: Optional[Dict[int, RenderSize]] = None
+    ) -> List[List[int]]:
+        """
+        ページ番号リストを、連続しかつ出力サイズ指定が同じページ範囲のチャンクに分割
+        """
+        if not pages:
+            return []
+
+        render_sizes = render_sizes or {}
+
+        # 連続したページの塊（ラン）にまとめる
+        runs = [[pages[0]]]
+        for page in pages[1:]:
+            previous = runs[-1][-1]
+            if page == previous + 1 and render_sizes.get(page) == render_sizes.get(previous):
+                runs[-1].append(page)
+            else:
+                runs.append([page])
+
+        chunk_count = max(1, min(workers, len(pages) // max(1, min_pages)))
+        chunk_size = -(-len(pages) // chunk_count)
+
+        chunks = []
+        for run in runs:
+            for i in range(0, len(run), chunk_size):
+                chunks.append(run[i:i + chunk_size])
+        return chunks
+
+    @staticmethod
+    def render_pages(
+        pdf_path: str,
+        pages: List[int],
+        dpi: int = Config.IMAGE_DPI,
+        render_sizes: Optional[Dict[int, RenderSize]] = None
+    ) -> List[Image.Image]:
+        """
+        指定ページをワーカープールで並列に画像化し、ページ順に並べて返す
+        render_sizesで指定したページはDPIではなくその出力サイズで直接レンダリングする
+        """
+        render_sizes = render_sizes or {}
+        chunks = ParallelRenderer.split_pages(pages, Config.RENDER_WORKERS, render_sizes=render_sizes)
+
+        def _render_chunk(chunk: List[int]) -> List[Image.Image]:
+            return ImageConverter.render_page_range(
+                pdf_path, dpi, chunk[0], chunk[-1], size=render_sizes.get(chunk[0])
+            )
+
+        if len(chunks) <= 1:
+            return [image for chunk in chunks for image in _render_chunk(chunk)]
+
+        executor = _get_page_executor()
+        futures = [executor.submit(profile_worker(_render_chunk), chunk) for chunk in chunks]
+
+        images = []
+        for future in futures:
+            images.extend(future.result())
+        return images
+
+    @staticmethod
+    def map_prefetch(func: Callable[[T], R], items: Iterable[T], prefetch: int = Config.RENDER_PREFETCH_BATCHES) -> Iterator[R]:
+        """
+        itemsにfuncを適用した結果を入力順に返す。最大prefetch件を先行して処理する
+        """
+        if prefetch <= 0:
+            for item in items:
+                yield func(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix="batch-prefetch") as executor:
+            pending = deque()
+            profiled_func = profile_worker(func)
+            for item in items:
+                pending.append(executor.submit(profiled_func, item))
+                if len(pending) > prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,65 @@
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+from utils.metrics import profile_worker
+
+T = TypeVar('T')
+
+# 列挙の終了を示す目印
+_DONE = object()
+
+
+def iter_in_background(
+    items: Iterable[T],
+    maxsize: int = 1,
+    initializer: Optional[Callable[[], None]] = None,
+    name: str = "pipeline"
+) -> Iterator[T]:
+    """
+    itemsの列挙を別スレッドで進め、上限maxsize件のキューを通して順に返す
+    受け取り側が処理している間も次の要素を準備できる（キューが一杯になると列挙側は待つ）
+    列挙側で発生した例外は受け取り側で送出し、受け取り側が途中で終了した場合は列挙を打ち切る
+    initializerは列挙スレッドの開始時に呼ばれる（通知先の準備等）
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+
+    def _put(entry) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @profile_worker
+    def _produce() -> None:
+        if initializer is not None:
+            initializer()
+        try:
+            for item in items:
+                if not _put((item, None)):
+                    return
+        except BaseException as e:
+            _put((_DONE, e))
+            return
+        _put((_DONE, None))
+
+    # 呼び出した時点で列挙を始める（最初の要素を要求されるまで待たない）
+    thread = threading.Thread(target=_produce, name=name, daemon=True)
+    thread.start()
+
+    def _consume() -> Iterator[T]:
+        try:
+            while True:
+                item, error = buffer.get()
+                if item is _DONE:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    return _consume()
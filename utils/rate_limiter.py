@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from config import Config
+
+# この秒数の間、状態の確認が無い送信待ち（終了したプロセスの要求）は待ち行列から取り除く
+TICKET_TIMEOUT = 60
+# この秒数の間、送信の無いセッションは送信順の記録を消す（次に送信するときは新しいセッションとして扱う）
+SESSION_TIMEOUT = 3600
+
+_limiter_lock = threading.Lock()
+_rate_limiter: Optional["RateLimiter"] = None
+
+
+def get_rate_limiter() -> Optional["RateLimiter"]:
+    """
+    プロセス共通のAPIレート制限を取得（Config.RATE_LIMIT_ENABLEDがFalseならNone）
+    """
+    global _rate_limiter
+    if not Config.RATE_LIMIT_ENABLED:
+        return None
+    with _limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(
+                Config.RATE_LIMIT_DB_PATH,
+                Config.RATE_LIMIT_REQUESTS_PER_MINUTE,
+                Config.RATE_LIMIT_TOKENS_PER_MINUTE
+            )
+        return _rate_limiter
+
+
+class RateLimiter:
+    """
+    同じAPIキーを使う全セッション・全ワーカープロセスで共有する、Gemini APIの送信の制限
+    1分あたりのリクエスト数・入力トークン数を、それぞれトークンバケット（1分分まで貯まり、毎秒1/60ずつ補充）で制限する
+    送信待ちの要求はセッションごとに並べ、最後に送信してから最も時間の経ったセッションの要求から送信する
+    （大きなジョブの後ろで小さなジョブが待たされ続けないようにする）
+    状態はSQLiteに保存し、Streamlitのプロセスとワーカープロセスの間で共有する
+    """
+
+    def __init__(
+        self,
+        path: str,
+        requests_per_minute: Optional[int],
+        tokens_per_minute: Optional[int],
+        poll_interval: float = Config.RATE_LIMIT_POLL_INTERVAL,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        上限がNone・0のバケットは制限しない
+        clock・sleepはテストで偽の時計に差し替える（プロセス間で比較するため、既定は壁時計）
+        """
+        self.path = path
+        self.limits = {'requests': requests_per_minute or 0, 'tokens': tokens_per_minute or 0}
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                " name TEXT PRIMARY KEY,"
+                " level REAL NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_tickets ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " session_id TEXT NOT NULL,"
+                " tokens INTEGER NOT NULL,"
+                " enqueued REAL NOT NULL,"
+                " heartbeat REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " last_granted REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def acquire(self, session_id: str, tokens: int) -> Dict[str, Any]:
+        """
+        入力トークン数の見積もりがtokensのリクエストを1件送信できるまで待つ
+        待ったかどうか（waited）・待った秒数（wait_seconds）・並んだときの待ち行列の長さ（queue_depth）を返す
+        """
+        start = self.clock()
+        with self._connect() as conn:
+            ticket = conn.execute(
+                "INSERT INTO rate_tickets (session_id, tokens, enqueued, heartbeat) VALUES (?, ?, ?, ?)",
+                (session_id, tokens, start, start)
+            ).lastrowid
+            queue_depth = conn.execute("SELECT COUNT(*) FROM rate_tickets").fetchone()[0]
+
+        waited = False
+        try:
+            while True:
+                delay = self._try_grant(ticket, session_id, tokens)
+                if delay is None:
+                    break
+                waited = True
+                self.sleep(min(delay, self.poll_interval))
+        except BaseException:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM rate_tickets WHERE id = ?", (ticket,))
+            raise
+
+        return {'waited': waited, 'wait_seconds': self.clock() - start, 'queue_depth': queue_depth}
+
+    def _try_grant(self, ticket: int, session_id: str, tokens: int) -> Optional[float]:
+        """
+        順番が来ていて上限に余裕があれば送信を許可してNoneを返し、そうでなければ次に確認するまでの秒数を返す
+        """
+        now = self.clock()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM rate_tickets WHERE heartbeat < ? AND id != ?", (now - TICKET_TIMEOUT, ticket))
+            updated = conn.execute("UPDATE rate_tickets SET heartbeat = ? WHERE id = ?", (now, ticket)).rowcount
+            if not updated:
+                # 確認が遅れて別のプロセスに取り除かれた要求は、同じ番号で並び直す（順番は変わらない）
+                conn.execute(
+                    "INSERT INTO rate_tickets (id, session_id, tokens, enqueued, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                    (ticket, session_id, tokens, now, now)
+                )
+
+            # 最後に送信してから最も時間の経ったセッション（初めてのセッションを優先）の、最も古い要求の番
+            head = conn.execute(
+                "SELECT t.id FROM rate_tickets t"
+                " LEFT JOIN rate_sessions s ON s.session_id = t.session_id"
+                " ORDER BY COALESCE(s.last_granted, 0), t.id LIMIT 1"
+            ).fetchone()
+            if head[0] != ticket:
+                return self.poll_interval
+
+            levels = self._levels(conn, now)
+            needs = {'requests': 1, 'tokens': tokens}
+            delay = max(
+                (self._shortfall(name, levels[name], needs[name]) for name in levels),
+                default=0.0
+            )
+            if delay > 0:
+                return delay
+
+            for name, level in levels.items():
+                self._set_level(conn, name, level - min(needs[name], self.limits[name]), now)
+            conn.execute("DELETE FROM rate_tickets WHERE id = ?", (ticket,))
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_sessions (session_id, last_granted) VALUES (?, ?)",
+                (session_id, now)
+            )
+            conn.execute("DELETE FROM rate_sessions WHERE last_granted < ?", (now - SESSION_TIMEOUT,))
+        return None
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        送信後に分かった実際の入力トークン数と見積もりとの差を、トークン数のバケットへ反映する
+        """
+        limit = self.limits['tokens']
+        if not limit or actual_tokens == estimated_tokens:
+            return
+
+        now = self.clock()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            level = self._levels(conn, now)['tokens']
+            used = min(actual_tokens, limit) - min(estimated_tokens, limit)
+            self._set_level(conn, 'tokens', level - used, now)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        現在の送信待ち（全プロセス）：待ち行列の長さ・待っているセッション数・最も長く待っている秒数
+        """
+        now = self.clock()
+        with self._connect() as conn:
+            depth, sessions, oldest = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT session_id), MIN(enqueued) FROM rate_tickets"
+                " WHERE heartbeat >= ?",
+                (now - TICKET_TIMEOUT,)
+            ).fetchone()
+        return {
+            'queue_depth': depth,
+            'sessions': sessions,
+            'oldest_wait_seconds': now - oldest if oldest is not None else 0.0,
+        }
+
+    def _levels(self, conn: sqlite3.Connection, now: float) -> Dict[str, float]:
+        """
+        制限するバケットごとの、現在の残量（前回の更新から補充された分を含む）
+        """
+        levels = {}
+        for name, limit in self.limits.items():
+            if not limit:
+                continue
+            row = conn.execute("SELECT level, updated FROM rate_buckets WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                levels[name] = float(limit)
+            else:
+                level, updated = row
+                levels[name] = min(float(limit), level + max(0.0, now - updated) * limit / 60)
+        return levels
+
+    def _shortfall(self, name: str, level: float, amount: int) -> float:
+        """
+        バケットからamount（上限を超える量は上限まで）を取り出せるようになるまでの秒数
+        """
+        limit = self.limits[name]
+        return max(0.0, (min(amount, limit) - level) * 60 / limit)
+
+    def _set_level(self, conn: sqlite3.Connection, name: str, level: float, now: float) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_buckets (name, level, updated) VALUES (?, ?, ?)",
+            (name, min(level, float(self.limits[name])), now)
+        )
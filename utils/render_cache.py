@@ -0,0 +1,153 @@
+from PIL import Image
+import io
+import os
+import threading
+from typing import Dict, Optional
+from config import Config
+
+_cache_lock = threading.Lock()
+_render_cache: Optional["RenderCache"] = None
+
+
+def get_render_cache() -> "RenderCache":
+    """
+    プロセス共通のレンダリング済みページキャッシュを取得
+    """
+    global _render_cache
+    with _cache_lock:
+        if _render_cache is None:
+            _render_cache = RenderCache(
+                Config.RENDER_CACHE_DIR,
+                Config.RENDER_CACHE_MAX_BYTES,
+                Config.RENDER_CACHE_FORMAT
+            )
+        return _render_cache
+
+
+class RenderCache:
+    """
+    ページ画像をエンコードしてローカルディスクに保存するキャッシュ
+    （合計サイズ上限を超えたら更新日時が古いファイルから削除）
+    """
+
+    def __init__(self, directory: str, max_bytes: int, image_format: str = 'PNG'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.image_format = image_format
+        self.extension = image_format.lower()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        # コールド（popplerでの変換）とウォーム（キャッシュ読み込み）の累計時間
+        self.rendered_pages = 0
+        self.render_seconds = 0.0
+        self.loaded_pages = 0
+        self.load_seconds = 0.0
+
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(
+            entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()
+        )
+
+    def _path(self, doc_hash: str, page: int, dpi: int, size: str) -> str:
+        """
+        キャッシュファイルのパス（文書ハッシュ・ページ番号・DPI・出力サイズで一意）
+        """
+        file_name = f"{doc_hash}_{page}_{dpi}_{size}.{self.extension}"
+        return os.path.join(self.directory, file_name)
+
+    def get(self, doc_hash: str, page: int, dpi: int, size: str = 'auto') -> Optional[Image.Image]:
+        """
+        キャッシュからページ画像を取得（見つからなければNone）
+        """
+        path = self._path(doc_hash, page, dpi, size)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return image
+
+    def put(self, doc_hash: str, page: int, dpi: int, image: Image.Image, size: str = 'auto') -> None:
+        """
+        ページ画像をエンコードして保存し、上限を超えた分を古い順に削除
+        """
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format)
+        data = buffer.getvalue()
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path(doc_hash, page, dpi, size)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+
+        with self._lock:
+            # 同じキーを上書きする場合は、置き換える画像のサイズを合計から除く
+            try:
+                replaced_bytes = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced_bytes = 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - replaced_bytes
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        合計サイズがmax_bytes以下になるまで更新日時の古いファイルを削除
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(f".{self.extension}"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def record_render(self, pages: int, seconds: float) -> None:
+        """
+        popplerでの変換（コールド）時間を記録
+        """
+        with self._lock:
+            self.rendered_pages += pages
+            self.render_seconds += seconds
+
+    def record_load(self, pages: int, seconds: float) -> None:
+        """
+        キャッシュからの読み込み（ウォーム）時間を記録
+        """
+        with self._lock:
+            self.loaded_pages += pages
+            self.load_seconds += seconds
+
+    def stats(self) -> Dict[str, float]:
+        """
+        ヒット数・ミス数・合計サイズと、1ページあたりのコールド／ウォーム時間を返す
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': self._total_bytes,
+                'cold_seconds_per_page': self.render_seconds / self.rendered_pages if self.rendered_pages else 0.0,
+                'warm_seconds_per_page': self.load_seconds / self.loaded_pages if self.loaded_pages else 0.0,
+            }
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from config import Config
+
+_cache_lock = threading.Lock()
+_result_cache: Optional["ResultCache"] = None
+
+
+def get_result_cache() -> "ResultCache":
+    """
+    プロセス共通の解析結果キャッシュを取得（Streamlitの再実行をまたいで共有）
+    """
+    global _result_cache
+    with _cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(Config.RESULT_CACHE_PATH, Config.RESULT_CACHE_MAX_BYTES)
+        return _result_cache
+
+
+class ResultCache:
+    """
+    SQLiteに保存する解析結果キャッシュ（合計サイズ上限を超えたら最終参照が古い順に削除）
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        """
+        ファイル内容のSHA-256を返す
+        """
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def make_key(file_hash: str, pages: Any, settings: Dict[str, Any]) -> str:
+        """
+        ファイルハッシュ・ページ範囲・解析設定からキャッシュキーを生成
+        """
+        payload = json.dumps(
+            {'file_hash': file_hash, 'pages': pages, 'settings': settings},
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, count: bool = True) -> Optional[str]:
+        """
+        キャッシュから結果を取得（見つからなければNone）
+        countがFalseの参照（解析結果以外の保存値）はヒット数・ミス数に数えない
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                if count:
+                    self.misses += 1
+                return None
+
+            if count:
+                self.hits += 1
+            self._conn.execute(
+                "UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def record_lookup(self, hit: bool) -> None:
+        """
+        複数のキーで探した1回の参照を、ヒットまたはミス1件として数える
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, value: str) -> None:
+        """
+        結果を保存し、サイズ上限を超えた分を古い順に削除
+        """
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """
+        合計サイズがmax_bytes以下になるまで最終参照が古いエントリを削除
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM results ORDER BY last_access ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self) -> Dict[str, int]:
+        """
+        ヒット数・ミス数・エントリ数・合計サイズを返す
+        """
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': total,
+        }
@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+
+# 解析1回分のファイル一覧（ファイル名・保存先・文字数）
+INDEX_FILE = 'index.json'
+
+_store_lock = threading.Lock()
+_result_store: Optional["ResultStore"] = None
+
+
+def get_result_store() -> "ResultStore":
+    """
+    プロセス共通の解析結果の保存先を取得
+    """
+    global _result_store
+    with _store_lock:
+        if _result_store is None:
+            _result_store = ResultStore(Config.RESULT_STORE_DIR, Config.RESULT_STORE_MAX_RUNS)
+        return _result_store
+
+
+class ResultStore:
+    """
+    解析結果をファイルごとのMarkdownとしてディスクへ保存し、ファイル名の一覧から1件ずつ読み出す
+    解析1回（ジョブ）ごとにディレクトリを作り、保存数の上限を超えたら古い解析から削除する
+    画面は一覧と選択したファイルの結果だけを読み込むため、ファイル数によらずメモリ使用量が一定になる
+    """
+
+    def __init__(self, directory: str, max_runs: int):
+        self.directory = directory
+        self.max_runs = max_runs
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _run_dir(self, run_id: str) -> str:
+        # 保存先の外を指せないよう、IDはファイル名として使える形に限る
+        return os.path.join(self.directory, os.path.basename(run_id))
+
+    def save(self, run_id: str, results: Dict[str, str]) -> None:
+        """
+        解析結果（{ファイル名: Markdown}）を保存
+        """
+        run_dir = self._run_dir(run_id)
+        os.makedirs(run_dir, exist_ok=True)
+
+        index = []
+        for number, (file_name, text) in enumerate(results.items(), 1):
+            path = f"{number:05d}.md"
+            with open(os.path.join(run_dir, path), 'w', encoding='utf-8') as f:
+                f.write(text)
+            index.append({'file_name': file_name, 'path': path, 'chars': len(text)})
+
+        # 一覧は書き終えてから置き換え、保存途中の解析を読み出さないようにする
+        temp_path = os.path.join(run_dir, INDEX_FILE + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(run_dir, INDEX_FILE))
+
+        with self._lock:
+            self._evict(keep=run_dir)
+
+    def exists(self, run_id: str) -> bool:
+        return os.path.exists(os.path.join(self._run_dir(run_id), INDEX_FILE))
+
+    def index(self, run_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        保存したファイルの一覧（保存順）を返す（見つからなければNone）
+        """
+        try:
+            with open(os.path.join(self._run_dir(run_id), INDEX_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def search(
+        self,
+        run_id: str,
+        query: str = "",
+        search_content: bool = False,
+        offset: int = 0,
+        limit: Optional[int] = None
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        ファイル名（search_contentがTrueなら結果の本文も）にqueryを含むファイルを探し、
+        offset件目からlimit件と、一致した総数を返す（大文字・小文字は区別しない）
+        """
+        entries = self.index(run_id) or []
+        query = query.strip().lower()
+        if query:
+            entries = [
+                entry for entry in entries
+                if query in entry['file_name'].lower()
+                or (search_content and query in (self._read_entry(run_id, entry) or '').lower())
+            ]
+
+        end = None if limit is None else offset + limit
+        return entries[offset:end], len(entries)
+
+    def read(self, run_id: str, file_name: str) -> Optional[str]:
+        """
+        1ファイル分の解析結果を読み込む（見つからなければNone）
+        """
+        for entry in self.index(run_id) or []:
+            if entry['file_name'] == file_name:
+                return self._read_entry(run_id, entry)
+        return None
+
+    def _read_entry(self, run_id: str, entry: Dict[str, Any]) -> Optional[str]:
+        try:
+            with open(os.path.join(self._run_dir(run_id), entry['path']), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _evict(self, keep: str) -> None:
+        """
+        保存数がmax_runs以下になるまで更新日時の古い解析を削除（keepは削除しない）
+        """
+        runs = sorted(
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(self.directory) if entry.is_dir()
+        )
+        excess = len(runs) - self.max_runs
+        for _, path in runs:
+            if excess <= 0:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            excess -= 1
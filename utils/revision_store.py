@@ -0,0 +1,81 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from config import Config
+
+_store_lock = threading.Lock()
+_revision_store: Optional["RevisionStore"] = None
+
+
+def get_revision_store() -> "RevisionStore":
+    """
+    プロセス共通の改訂履歴ストアを取得
+    """
+    global _revision_store
+    with _store_lock:
+        if _revision_store is None:
+            _revision_store = RevisionStore(Config.REVISION_STORE_PATH)
+        return _revision_store
+
+
+def document_key(file_name: str, pattern: str = Config.REVISION_NAME_PATTERN) -> str:
+    """
+    ファイル名から拡張子と改訂記号（_revB、-R2等）を取り除いた、図面セットを識別する名前
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    key = re.sub(pattern, '', stem, flags=re.IGNORECASE).strip()
+    return (key or stem).lower()
+
+
+class RevisionStore:
+    """
+    図面セットごとに、最後に解析した版のバッチ構成（各バッチのページとページの指紋）を保存する
+    次の版では、内容の変わっていないバッチを同じ区切りで作り直して解析結果を再利用する
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS revisions ("
+            " document_key TEXT PRIMARY KEY,"
+            " file_name TEXT NOT NULL,"
+            " file_hash TEXT NOT NULL,"
+            " batches TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        前回の版の{'file_name', 'file_hash', 'batches': [{'pages', 'fingerprints'}]}を返す（無ければNone）
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_name, file_hash, batches FROM revisions WHERE document_key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'file_name': row[0], 'file_hash': row[1], 'batches': json.loads(row[2])}
+
+    def put(self, key: str, file_name: str, file_hash: str, batches: List[Dict[str, Any]]) -> None:
+        """
+        最新の版のバッチ構成を保存（前回の版の情報は置き換える）
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO revisions (document_key, file_name, file_hash, batches, updated)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, file_name, file_hash, json.dumps(batches), time.time())
+            )
+            self._conn.commit()
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+from config import Config
+from utils.metrics import get_metrics
+
+_store_lock = threading.Lock()
+_upload_store: Optional["UploadStore"] = None
+
+
+def get_upload_store() -> "UploadStore":
+    """
+    プロセス共通のアップロードファイル置き場を取得
+    """
+    global _upload_store
+    with _store_lock:
+        if _upload_store is None:
+            _upload_store = UploadStore(Config.UPLOAD_STORE_DIR, Config.UPLOAD_STORE_MAX_BYTES)
+        return _upload_store
+
+
+def hash_file(path: str, chunk_size: int = Config.UPLOAD_CHUNK_SIZE) -> str:
+    """
+    ファイル全体をメモリに読み込まずにSHA-256を計算する
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StoredUpload:
+    """
+    ディスク上に保存されたアップロードファイル
+    名前・サイズ・形式・内容のハッシュは、ファイルを読み直さずに参照できる
+    """
+
+    def __init__(self, name: str, path: str, size: Optional[int] = None, file_hash: Optional[str] = None):
+        self.name = name
+        self.path = path
+        self.size = size if size is not None else os.path.getsize(path)
+        self._file_hash = file_hash
+
+    @property
+    def file_hash(self) -> str:
+        """
+        内容のSHA-256（未計算の場合はファイルから計算）
+        """
+        if self._file_hash is None:
+            self._file_hash = hash_file(self.path)
+        return self._file_hash
+
+    @property
+    def extension(self) -> str:
+        return self.name.lower().split('.')[-1]
+
+    def read(self) -> bytes:
+        """
+        内容をすべて読み込む（小さな画像ファイル用。PDFはpathを使うこと）
+        """
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'path': self.path, 'size': self.size, 'file_hash': self._file_hash}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StoredUpload":
+        return cls(data['name'], data['path'], data.get('size'), data.get('file_hash'))
+
+
+class UploadStore:
+    """
+    アップロードファイルを内容のハッシュ名で保存する置き場
+    同じ内容のファイルは1つだけ保存し、合計サイズ上限を超えたら更新日時が古いファイルから削除する
+    （in_useが返すパスのファイルは、上限を超えていても削除しない）
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        in_use: Optional[Callable[[], Iterable[str]]] = None
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # 使用中のファイル（待機中・実行中のジョブが参照するファイル等）のパスを返す関数
+        self.in_use = in_use
+        self.metrics = get_metrics()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(
+            entry.stat().st_size for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.endswith('.tmp')
+        )
+
+    def add(self, uploaded_file: Any, keep: Iterable[str] = ()) -> StoredUpload:
+        """
+        アップロードファイル（name・readを持つオブジェクト）をチャンク単位でディスクへ書き出す
+        既に同じ内容のファイルがあればそれを再利用する
+        keepには削除してはいけないパス（同時に登録する他のファイル等）を渡す
+        """
+        if isinstance(uploaded_file, StoredUpload):
+            return uploaded_file
+
+        name = uploaded_file.name
+        extension = os.path.splitext(name)[1].lower()
+        tmp_path = os.path.join(self.directory, f"{threading.get_ident()}_{id(uploaded_file)}.tmp")
+
+        with self.metrics.span('upload_read', file_name=name) as span:
+            digest = hashlib.sha256()
+            size = 0
+            if hasattr(uploaded_file, 'seek'):
+                uploaded_file.seek(0)
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: uploaded_file.read(Config.UPLOAD_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            if hasattr(uploaded_file, 'seek'):
+                uploaded_file.seek(0)
+            span['bytes'] = size
+
+        file_hash = digest.hexdigest()
+        path = os.path.join(self.directory, f"{file_hash}{extension}")
+
+        with self._lock:
+            if os.path.exists(path):
+                # 同じ内容のファイルは保存済みのものを使い、削除の順番を後ろにする
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+                self._total_bytes += size
+                if self._total_bytes > self.max_bytes:
+                    self._evict(keep={path, *keep})
+
+        return StoredUpload(name, path, size, file_hash)
+
+    def _evict(self, keep: Iterable[str]) -> None:
+        """
+        合計サイズがmax_bytes以下になるまで更新日時の古いファイルを削除（keep・使用中のファイルは削除しない）
+        """
+        keep = {os.path.abspath(path) for path in keep}
+        if self.in_use is not None:
+            keep.update(os.path.abspath(path) for path in self.in_use())
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass